@@ -0,0 +1,428 @@
+"""アダプティブ出題 (苦手克服モード)
+
+山札を一様にシャッフルする代わりに、間違えやすい問題ほど出やすくなるように区間の問題を選ぶ。
+
+- 全体の傾向: 問題ごとの成績 (question_stats) から誤答率を出し、重み 1 + BOOST × 誤答率 にする。
+  重みは Fenwick 木 (累積和の二分木) に入れるので、1回の抽選も重みの更新も O(log n)。
+  木は絞り込み条件ごとにワーカーで1回だけ作り、以後は回答を記録するたびにその問題の重みだけを直す
+  (PopulationModel)。ほかのワーカーの分は、一定間隔で「前回から書き出された行」だけを読んで直す。
+  出題済みの問題は棄却して引き直し、引き直しが続く時は一様に選んだ位置を重みの割合で採る (棄却法)。
+- 本人の傾向: 間違えた問題をライトナー式の復習表 (ReviewSchedule) に入れ、
+  箱ごとの間隔 (0, 1, 3, 7, 14, 30 日) が過ぎたものを次の旅でも優先して出す。
+  正解すると次の箱へ進み、最後の箱で正解したら表から外す。表は問題 ID のキーで持つので、問題集を読み直しても使える。
+- 旅ごとの山札の状態 (区間ごとに選んだ山札位置と、出題済みの山札位置のビットマップ) と復習表は
+  AdaptiveDeckStore (SQLite) に置き、セッションにはそれを引くハンドル・キーだけを持たせる
+  (山札が何万問あっても、復習表に何問あってもセッションは固定長)。
+"""
+import bisect
+import random
+import secrets
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from question_stats import attempt_counts
+from sqlite_conn import ProcessConnection
+
+# 誤答率 1.0 の問題は、誤答率 0 の問題の (1 + ADAPTIVE_BOOST) 倍出やすい
+ADAPTIVE_BOOST = 4.0
+# 回答数の少ない問題の誤答率を全体の平均に寄せるための仮の回答数
+PRIOR_ATTEMPTS = 5
+# 区間のうち復習に使う割合の上限
+REVIEW_SHARE = 0.5
+# 出題済みの問題を何回続けて引いたら棄却法に切り替えるか。
+# 残りが山札の 1 / MAX_REJECTS より少なければ、棄却法も未出題の位置を数え上げてから引く
+MAX_REJECTS = 32
+# 成績を読み直す時に、前回の読み直しより何秒前から書き出された行を読むか (書き出しの遅れの分)
+REFRESH_MARGIN = 60.0
+
+REVIEW_INTERVALS = (0, 1, 3, 7, 14, 30)  # 箱ごとの復習間隔 (日)
+MAX_REVIEWS = 1000                       # 復習表に載せる問題数の上限 (7バイト/問)
+_REVIEW_ENTRY = struct.Struct('<IBH')     # 問題のキー (question_key), 箱, 次の復習日 (1970-01-01 からの日数)
+
+
+class FenwickSampler:
+    """重み付き抽選。draw / update とも O(log n)"""
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = list(weights)
+        tree = [0.0] + self.weights
+        # O(n) で組み立てる (各ノードを親に足し込む)
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._top = 1 << (self.size.bit_length() - 1) if self.size else 0
+
+    @property
+    def total(self):
+        return self.prefix(self.size)
+
+    def prefix(self, count):
+        """先頭 count 個の重みの合計"""
+        total = 0.0
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def update(self, position, weight):
+        delta = weight - self.weights[position]
+        self.weights[position] = weight
+        i = position + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, value):
+        """累積和が value を超える最初の位置 (0 <= value < total)"""
+        position = 0
+        step = self._top
+        while step:
+            nxt = position + step
+            if nxt <= self.size and self._tree[nxt] <= value:
+                position = nxt
+                value -= self._tree[nxt]
+            step >>= 1
+        return min(position, self.size - 1)
+
+    def draw(self, rng):
+        return self.find(rng.random() * self.total)
+
+
+class PopulationModel:
+    """全体の誤答率で重み付けした抽選器 (絞り込み条件ごと) と、その元になる問題ごとの成績
+
+    成績は問題 ID で持つ。抽選器は (版, 回のマスク, 区分のマスク) ごとに最初に使う時に O(n) で作り、
+    record で回答を足すたびに、その問題を含む抽選器の重みを update で直す (O(log n))。
+    maybe_refresh は refresh_interval 秒ごとに、前回から書き出された行 (ほかのワーカーの回答を含む) だけを読み、
+    その値で上書きする (このワーカーのまだ書き出していない分は、書き出した後の読み直しで入る)。
+    重みの計算に使う全体の平均誤答率は、最初に読んだ時の値のまま使う。
+    """
+
+    def __init__(self, db_path, refresh_interval=30.0, max_samplers=16):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.max_samplers = max_samplers
+        self._lock = threading.Lock()
+        self._counts = None                # 問題 ID -> (回答数, 正解数)
+        self._mean_miss = None
+        self._synced_at = None
+        self._last_refresh = time.monotonic()
+        self._samplers = OrderedDict()   # (版, 回のマスク, 区分のマスク) -> (抽選器, BankVersion, 山札)
+
+    def _load(self):
+        """最初に使う時に全部の行を読む (ロックを持って呼ぶ)"""
+        self._synced_at = time.time()
+        self._counts = self._read()
+        attempts = sum(a for a, _ in self._counts.values())
+        self._mean_miss = 1 - sum(c for _, c in self._counts.values()) / attempts if attempts else 0.5
+
+    def _read(self, since=None):
+        try:
+            return attempt_counts(self.db_path, since)
+        except sqlite3.Error:
+            return {}   # まだ集計がない (テーブルがない) 間は全部同じ重み
+
+    def weight(self, qid):
+        a, c = self._counts.get(qid, (0, 0))
+        miss = (a - c + PRIOR_ATTEMPTS * self._mean_miss) / (a + PRIOR_ATTEMPTS)
+        return 1.0 + ADAPTIVE_BOOST * miss
+
+    def sampler(self, bank, round_mask, category_mask):
+        """bank (BankVersion) を絞り込んだ山札の、山札位置ごとの抽選器"""
+        key = (bank.version, round_mask, category_mask)
+        with self._lock:
+            entry = self._samplers.get(key)
+            if entry is not None:
+                self._samplers.move_to_end(key)
+                return entry[0]
+            if self._mean_miss is None:
+                self._load()
+            deck = bank.filtered_deck(round_mask, category_mask)
+            ids = bank.ids
+            positions = range(len(ids)) if deck is None else deck
+            sampler = FenwickSampler([self.weight(ids[idx]) for idx in positions])
+            self._samplers[key] = (sampler, bank, deck)
+            while len(self._samplers) > self.max_samplers:
+                self._samplers.popitem(last=False)
+            return sampler
+
+    def record(self, qid, correct):
+        """回答を1回足して、その問題の重みを直す"""
+        with self._lock:
+            if self._mean_miss is None:
+                return   # まだ抽選器を作っていない (作る時に読む)
+            a, c = self._counts.get(qid, (0, 0))
+            self._counts[qid] = (a + 1, c + bool(correct))
+            self._reweight([qid])
+
+    def maybe_refresh(self):
+        if self._mean_miss is None or time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        self.refresh()
+
+    def refresh(self):
+        """前回の読み直しから書き出された行だけを読んで重みを直す"""
+        self._last_refresh = time.monotonic()
+        now = time.time()
+        changed = self._read(None if self._synced_at is None else self._synced_at - REFRESH_MARGIN)
+        with self._lock:
+            self._synced_at = now
+            if self._mean_miss is None:
+                return
+            self._counts.update(changed)
+            self._reweight(changed)
+
+    def _reweight(self, qids):
+        """qids の問題を含む抽選器の重みを直す (ロックを持って呼ぶ)"""
+        for sampler, bank, deck in self._samplers.values():
+            for qid in qids:
+                idx = bank.index_of(qid)
+                position = None if idx is None else position_in_deck(deck, sampler.size, idx)
+                if position is not None:
+                    sampler.update(position, self.weight(qid))
+
+
+class ReviewSchedule:
+    """プレイヤーごとの復習表 (ライトナー式)。問題のキー (question_key) -> (箱, 次の復習日)"""
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+
+    @classmethod
+    def decode(cls, raw):
+        if not raw or len(raw) % _REVIEW_ENTRY.size:
+            return cls()
+        return cls({key: (box, due) for key, box, due in _REVIEW_ENTRY.iter_unpack(raw)})
+
+    def encode(self):
+        return b''.join(_REVIEW_ENTRY.pack(key, box, due) for key, (box, due) in self.entries.items())
+
+    def record(self, key, correct, today):
+        """回答を1回記録する。表が変わったら True"""
+        entry = self.entries.get(key)
+        if not correct:
+            if entry == (0, today):
+                return False
+            self.entries[key] = (0, today)
+        elif entry is None:
+            return False
+        else:
+            box, due = entry
+            if due > today:
+                return False  # 復習日より前に正解しても箱は進めない
+            if box + 1 >= len(REVIEW_INTERVALS):
+                del self.entries[key]
+            else:
+                self.entries[key] = (box + 1, today + REVIEW_INTERVALS[box + 1])
+        if len(self.entries) > MAX_REVIEWS:
+            # 覚えかけ (箱が大きく、復習日が先) のものから外す
+            drop = max(self.entries, key=lambda k: self.entries[k])
+            del self.entries[drop]
+        return True
+
+    def due(self, today):
+        """復習日が来た問題のキー (遅れている順)"""
+        return [key for key, (box, due) in sorted(self.entries.items(), key=lambda item: (item[1][1], item[1][0]))
+                if due <= today]
+
+
+def build_leg(state, count, sampler, schedule, today, rng, index_of_key):
+    """state の山札から区間の問題 (山札位置) を count 問選ぶ。index_of_key: 問題のキー -> 問題インデックス"""
+    count = min(count, state.deck_remaining())
+    chosen = []
+    taken = set()
+
+    # 1. 復習日が来た問題 (絞り込み中なら山札に含まれるものだけ)
+    for key in schedule.due(today):
+        if len(chosen) >= count * REVIEW_SHARE:
+            break
+        idx = index_of_key(key)
+        position = None if idx is None else deck_position(state, idx)
+        if position is not None and not state.is_drawn(position) and position not in taken:
+            chosen.append(position)
+            taken.add(position)
+
+    # 2. 全体の誤答率で重み付けした抽選 (出題済みは引き直し)
+    rejects = 0
+    while len(chosen) < count and rejects < MAX_REJECTS:
+        position = sampler.draw(rng)
+        if state.is_drawn(position) or position in taken:
+            rejects += 1
+            continue
+        rejects = 0
+        chosen.append(position)
+        taken.add(position)
+    if len(chosen) >= count:
+        return chosen
+
+    # 3. 引き直しが続く (重い問題を出し尽くした) 場合は棄却法: 未出題の位置を一様に引き、
+    #    重み / 重みの上限 の確率で採る。残りが山札の 1 / MAX_REJECTS より多ければ山札全体から一様に引き
+    #    (未出題に当たる確率が 1 / MAX_REJECTS 以上)、少なければ未出題の位置を数え上げてから引く
+    max_weight = 1.0 + ADAPTIVE_BOOST
+    pool = None
+    if (state.deck_remaining() - len(chosen)) * MAX_REJECTS < state.deck_size:
+        pool = [p for p in range(state.deck_size) if not state.is_drawn(p) and p not in taken]
+    while len(chosen) < count:
+        if pool is None:
+            position = rng.randrange(state.deck_size)
+            if state.is_drawn(position) or position in taken:
+                continue
+        else:
+            k = rng.randrange(len(pool))
+            position = pool[k]
+        if rng.random() * max_weight >= sampler.weights[position]:
+            continue
+        chosen.append(position)
+        taken.add(position)
+        if pool is not None:
+            pool[k] = pool[-1]
+            pool.pop()
+    return chosen
+
+
+def position_in_deck(deck, deck_size, idx):
+    """問題インデックスが山札 (絞り込みなしなら None) の何番目か (山札にない問題なら None)"""
+    if deck is None:
+        return idx if 0 <= idx < deck_size else None
+    k = bisect.bisect_left(deck, idx)
+    return k if k < len(deck) and deck[k] == idx else None
+
+
+def deck_position(state, idx):
+    """問題インデックスが state の山札の何番目か (山札にない問題なら None)"""
+    return position_in_deck(state.deck, state.deck_size, idx)
+
+
+# ---------------------------------------------------------
+# 旅ごとの山札の状態 (サーバー側)
+# ---------------------------------------------------------
+_LEG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS adaptive_legs (
+    handle INTEGER NOT NULL, leg_start INTEGER NOT NULL,
+    positions BLOB NOT NULL, created_at REAL NOT NULL,
+    PRIMARY KEY (handle, leg_start)
+);
+CREATE INDEX IF NOT EXISTS idx_adaptive_legs_created ON adaptive_legs (created_at);
+CREATE TABLE IF NOT EXISTS adaptive_drawn (
+    handle INTEGER PRIMARY KEY, drawn BLOB NOT NULL, updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_adaptive_drawn_updated ON adaptive_drawn (updated_at);
+CREATE TABLE IF NOT EXISTS adaptive_reviews (
+    review_key TEXT PRIMARY KEY, entries BLOB NOT NULL, updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_adaptive_reviews_updated ON adaptive_reviews (updated_at);
+"""
+
+
+class AdaptiveDeckStore:
+    """アダプティブ出題の旅の、区間ごとに選んだ山札位置と出題済みのビットマップ、プレイヤーの復習表
+
+    区間の行は (ハンドル, 区間の先頭位置) ごとに1回書いたら変えないので、どのワーカーでも読んだ行を
+    そのまま使い回せる (最近使った max_entries 行をメモリに置く)。出題済みの山札位置は、ハンドルごとに1行の
+    ビットマップ (山札1問1ビット) に持ち、区間を選んだ時に区間の行と一緒に書き直す (読むのも次の区間を選ぶ時の1行だけ)。
+    次のリクエストが別のワーカーに行っても読めるよう、どれもその場で書く。
+    ttl 秒より古い旅の行は cleanup_interval 秒ごとに消す (プロフィールに残した旅も、それより後に再開すると区間を選び直す)。
+    復習表は review_ttl 秒書き換えがなければ消す。
+    """
+
+    def __init__(self, db_path, ttl=30 * 86400, review_ttl=365 * 86400, max_entries=10000, cleanup_interval=3600.0):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.review_ttl = review_ttl
+        self.max_entries = max_entries
+        self.cleanup_interval = cleanup_interval
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # (ハンドル, 区間の先頭位置) -> 山札位置のリスト
+        self._last_cleanup = time.monotonic()
+        self._db = ProcessConnection(db_path)
+        with self._db.use() as conn:
+            conn.executescript(_LEG_SCHEMA)
+
+    @staticmethod
+    def new_handle():
+        return random.getrandbits(63) or 1   # SQLite の INTEGER に入る正の値。0 は「ハンドルなし」
+
+    @staticmethod
+    def new_review_key():
+        return secrets.token_hex(8)
+
+    @staticmethod
+    def is_review_key(value):
+        """new_review_key の形か (表そのものを Cookie に入れていた古いセッションの値は False)"""
+        return isinstance(value, str) and len(value) == 16 and all(c in '0123456789abcdef' for c in value)
+
+    # --- 旅の山札 ---
+    def save_leg(self, handle, leg_start, positions, drawn):
+        """区間の山札位置と、それを含めた出題済みのビットマップ (bytearray) を書く"""
+        positions = list(positions)
+        now = time.time()
+        with self._db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO adaptive_legs (handle, leg_start, positions, created_at) VALUES (?, ?, ?, ?)",
+                (handle, leg_start, array('I', positions).tobytes(), now))
+            conn.execute("INSERT OR REPLACE INTO adaptive_drawn (handle, drawn, updated_at) VALUES (?, ?, ?)",
+                         (handle, bytes(drawn), now))
+        self._put((handle, leg_start), positions)
+
+    def leg(self, handle, leg_start):
+        """区間の山札位置のリスト。ない (ttl を過ぎて消えた) なら None"""
+        key = (handle, leg_start)
+        with self._lock:
+            positions = self._cache.get(key)
+            if positions is not None:
+                self._cache.move_to_end(key)
+                return positions
+        with self._db.use() as conn:
+            row = conn.execute(
+                "SELECT positions FROM adaptive_legs WHERE handle = ? AND leg_start = ?", key).fetchone()
+        if row is None:
+            return None
+        positions = array('I', row[0]).tolist()
+        self._put(key, positions)
+        return positions
+
+    def drawn(self, handle):
+        """この旅で出題済みの山札位置のビットマップ (bytearray)。まだ区間を選んでいなければ None"""
+        with self._db.use() as conn:
+            row = conn.execute("SELECT drawn FROM adaptive_drawn WHERE handle = ?", (handle,)).fetchone()
+        return None if row is None else bytearray(row[0])
+
+    def _put(self, key, positions):
+        with self._lock:
+            self._cache[key] = positions
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    # --- 復習表 ---
+    def review(self, review_key):
+        """復習表 (ReviewSchedule)。キーがない・行がなければ空の表"""
+        if not self.is_review_key(review_key):
+            return ReviewSchedule()
+        with self._db.use() as conn:
+            row = conn.execute("SELECT entries FROM adaptive_reviews WHERE review_key = ?", (review_key,)).fetchone()
+        return ReviewSchedule.decode(row[0] if row else None)
+
+    def save_review(self, review_key, schedule):
+        with self._db.use() as conn:
+            conn.execute("INSERT OR REPLACE INTO adaptive_reviews (review_key, entries, updated_at) VALUES (?, ?, ?)",
+                         (review_key, schedule.encode(), time.time()))
+
+    def maybe_cleanup(self):
+        if time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+            self.cleanup()
+
+    def cleanup(self):
+        self._last_cleanup = time.monotonic()
+        now = time.time()
+        with self._db.transaction() as conn:
+            conn.execute("DELETE FROM adaptive_legs WHERE created_at < ?", (now - self.ttl,))
+            conn.execute("DELETE FROM adaptive_drawn WHERE updated_at < ?", (now - self.ttl,))
+            conn.execute("DELETE FROM adaptive_reviews WHERE updated_at < ?", (now - self.review_ttl,))
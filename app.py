@@ -1,728 +1,1421 @@
-import os
-import csv
-import random
-import time
-from flask import Flask, request, session, render_template_string, redirect, url_for
-
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'default_secret_key_for_shinkansen')
-
-# ---------------------------------------------------------
-# 1. マスターデータ・設定
-# ---------------------------------------------------------
-
-CSV_FILENAME = '67-76_hissu_004.csv'
-
-# 駅データ (九州〜北海道まで完全収録！)
-STATION_DATA = [
-    # --- 九州新幹線 (0-11) ---
-    {"name": "鹿児島中央", "is_nozomi": False}, {"name": "川内", "is_nozomi": False},
-    {"name": "出水", "is_nozomi": False}, {"name": "新水俣", "is_nozomi": False},
-    {"name": "新八代", "is_nozomi": False}, {"name": "熊本", "is_nozomi": True},
-    {"name": "新玉名", "is_nozomi": False}, {"name": "新大牟田", "is_nozomi": False},
-    {"name": "筑後船小屋", "is_nozomi": False}, {"name": "久留米", "is_nozomi": False},
-    {"name": "新鳥栖", "is_nozomi": False}, {"name": "博多", "is_nozomi": True},
-    # --- 山陽・東海道新幹線 (12-45) ---
-    {"name": "小倉", "is_nozomi": True}, {"name": "新下関", "is_nozomi": False},
-    {"name": "厚狭", "is_nozomi": False}, {"name": "新山口", "is_nozomi": False},
-    {"name": "徳山", "is_nozomi": False}, {"name": "新岩国", "is_nozomi": False},
-    {"name": "広島", "is_nozomi": True}, {"name": "東広島", "is_nozomi": False},
-    {"name": "三原", "is_nozomi": False}, {"name": "新尾道", "is_nozomi": False},
-    {"name": "福山", "is_nozomi": False}, {"name": "新倉敷", "is_nozomi": False},
-    {"name": "岡山", "is_nozomi": True}, {"name": "相生", "is_nozomi": False},
-    {"name": "姫路", "is_nozomi": False}, {"name": "西明石", "is_nozomi": False},
-    {"name": "新神戸", "is_nozomi": True}, {"name": "新大阪", "is_nozomi": True},
-    {"name": "京都", "is_nozomi": True}, {"name": "米原", "is_nozomi": False},
-    {"name": "岐阜羽島", "is_nozomi": False}, {"name": "名古屋", "is_nozomi": True},
-    {"name": "三河安城", "is_nozomi": False}, {"name": "豊橋", "is_nozomi": False},
-    {"name": "浜松", "is_nozomi": False}, {"name": "掛川", "is_nozomi": False},
-    {"name": "静岡", "is_nozomi": False}, {"name": "新富士", "is_nozomi": False},
-    {"name": "三島", "is_nozomi": False}, {"name": "熱海", "is_nozomi": False},
-    {"name": "小田原", "is_nozomi": False}, {"name": "新横浜", "is_nozomi": True},
-    {"name": "品川", "is_nozomi": True}, {"name": "東京", "is_nozomi": True},
-    # --- 東北・北海道新幹線 (46-) ---
-    {"name": "上野", "is_nozomi": False}, {"name": "大宮", "is_nozomi": True},
-    {"name": "宇都宮", "is_nozomi": False}, {"name": "那須塩原", "is_nozomi": False},
-    {"name": "新白河", "is_nozomi": False}, {"name": "郡山", "is_nozomi": False},
-    {"name": "福島", "is_nozomi": False}, {"name": "白石蔵王", "is_nozomi": False},
-    {"name": "仙台", "is_nozomi": True}, {"name": "古川", "is_nozomi": False},
-    {"name": "くりこま高原", "is_nozomi": False}, {"name": "一ノ関", "is_nozomi": False},
-    {"name": "水沢江刺", "is_nozomi": False}, {"name": "北上", "is_nozomi": False},
-    {"name": "新花巻", "is_nozomi": False}, {"name": "盛岡", "is_nozomi": True},
-    {"name": "いわて沼宮内", "is_nozomi": False}, {"name": "二戸", "is_nozomi": False},
-    {"name": "八戸", "is_nozomi": False}, {"name": "七戸十和田", "is_nozomi": False},
-    {"name": "新青森", "is_nozomi": True}, {"name": "奥津軽いまべつ", "is_nozomi": False},
-    {"name": "木古内", "is_nozomi": False}, {"name": "新函館北斗", "is_nozomi": True}
-]
-
-# 名所データ
-LANDMARK_DATA = {
-    0: { "name": "桜島", "svg": '<path fill="#FF8C00" d="M100,200 Q200,50 300,200 L400,250 L0,250 Z" opacity="0.8"/><circle cx="200" cy="50" r="10" fill="#FFF" opacity="0.5"><animate attributeName="cy" from="50" to="20" dur="2s" repeatCount="indefinite"/><animate attributeName="opacity" values="0.5;0;0.5" dur="2s" repeatCount="indefinite"/></circle>', "desc": "雄大な桜島の噴煙" },
-    25: { "name": "姫路城", "svg": '<path fill="#EEE" d="M150,200 L150,150 L250,150 L250,200 Z M120,150 L280,150 L200,80 Z M190,80 L210,80 L200,60 Z" stroke="#333" stroke-width="2"/>', "desc": "白鷺城の美しさ" },
-    30: { "name": "五重塔", "svg": '<g fill="#8B4513"><rect x="180" y="50" width="40" height="150"/><path d="M150,90 L250,90 L200,60 Z"/><path d="M140,120 L260,120 L200,90 Z"/><path d="M130,150 L270,150 L200,120 Z"/><path d="M120,180 L280,180 L200,150 Z"/><path d="M110,210 L290,210 L200,180 Z"/></g>', "desc": "古都のシンボル" },
-    38: { "name": "富士山", "svg": '<path fill="#FFF" d="M150,100 L250,100 L200,60 Z"/><path fill="#4682B4" d="M50,250 L200,60 L350,250 Z" stroke="none"/><path fill="#FFF" d="M165,105 L200,60 L235,105 Q200,120 165,105 Z"/>', "desc": "日本一の霊峰" },
-    44: { "name": "東京タワー", "svg": '<path fill="#FF4500" d="M180,250 L220,250 L200,50 Z"/><rect x="190" y="100" width="20" height="10" fill="#FFF"/><rect x="185" y="180" width="30" height="10" fill="#FFF"/>', "desc": "首都のランドマーク" },
-    53: { "name": "松島", "svg": '<rect x="0" y="200" width="400" height="50" fill="#4682B4"/><path fill="#228B22" d="M50,210 Q70,180 90,210 Z M150,220 Q180,170 210,220 Z M300,210 Q320,190 340,210 Z"/>', "desc": "日本三景の島々" },
-    66: { "name": "青函トンネル", "svg": '<rect x="0" y="0" width="1000" height="1000" fill="#111"/><circle cx="200" cy="150" r="10" fill="#FFFF00" opacity="0.5"><animate attributeName="opacity" values="0.5;1;0.5" dur="0.5s" repeatCount="indefinite"/></circle>', "desc": "海底の大動脈", "is_tunnel": True },
-    67: { "name": "函館山", "svg": '<path fill="#000" d="M50,250 Q200,100 350,250 Z" opacity="0.8"/><circle cx="100" cy="50" r="2" fill="white" /><circle cx="200" cy="80" r="2" fill="white" /><circle cx="300" cy="40" r="2" fill="white" />', "desc": "100万ドルの夜景" }
-}
-
-# ---------------------------------------------------------
-# 2. データ読み込みロジック
-# ---------------------------------------------------------
-
-def load_questions():
-    questions = []
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    csv_path = os.path.join(base_dir, CSV_FILENAME)
-    
-    try:
-        with open(csv_path, mode='r', encoding='utf-8-sig') as f:
-            reader = csv.reader(f)
-            header = next(reader)
-            for row in reader:
-                if len(row) < 11: continue
-                q_data = {
-                    "id": row[3],
-                    "question": row[4],
-                    "options": [row[5], row[6], row[7], row[8], row[9]],
-                    "answer_idx": int(row[10])
-                }
-                questions.append(q_data)
-    except Exception as e:
-        error_msg = f"エラー発生: {str(e)} (Path: {csv_path})"
-        print(error_msg)
-        questions = [{"id": "ERROR", "question": error_msg, "options": ["-"]*5, "answer_idx": 1}]
-    return questions
-
-ALL_QUESTIONS = load_questions()
-
-# ★ ヘルパー関数: 現在地に応じた超特急の名称を取得
-def get_express_name(station_idx):
-    # 博多(11)より前は九州新幹線
-    if station_idx < 11:
-        return "みずほ"
-    # 東京(45)より前は山陽・東海道新幹線
-    elif station_idx < 45:
-        return "のぞみ"
-    # それ以降は東北・北海道新幹線
-    else:
-        return "はやぶさ"
-
-# ---------------------------------------------------------
-# 3. HTMLテンプレート
-# ---------------------------------------------------------
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no, viewport-fit=cover">
-    <title>新幹線でGO! 日本縦断完走ドリル</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Share+Tech+Mono&family=Zen+Kaku+Gothic+New:wght@500;700&display=swap');
-        
-        /* ★重要: iPhoneのDynamic Viewport Heightに対応し、スクロール禁止をbodyのみに適用 */
-        body { 
-            font-family: 'Zen Kaku Gothic New', sans-serif; 
-            background: #1a1a1a;
-            height: 100vh; /* Fallback */
-            height: 100dvh; /* Mobile Safari fix */
-            width: 100vw;
-            overflow: hidden; /* アプリ全体のスクロールを防ぐ */
-            overscroll-behavior-y: none; /* バウンススクロール防止 */
-            padding-bottom: env(safe-area-inset-bottom); /* iPhone下部バー対策 */
-        }
-        .digital-font { font-family: 'Share Tech Mono', monospace; }
-        
-        /* 車窓アニメーション */
-        .window-view {
-            background: linear-gradient(to bottom, #87CEEB 0%, #E0F6FF 80%, #90EE90 100%);
-            position: relative;
-            overflow: hidden;
-            transition: background 1s ease;
-        }
-        .weather-rainy { background: linear-gradient(to bottom, #4a5568 0%, #718096 80%, #2d3748 100%) !important; }
-        .weather-tunnel { background: #000 !important; }
-
-        .scenery-layer {
-            position: absolute;
-            bottom: 0; left: 0; width: 200%; height: 100%;
-            background-repeat: repeat-x; background-position: bottom left;
-            animation: moveScenery linear infinite;
-        }
-        .landmark-layer {
-            position: absolute; bottom: 20px; right: -300px;
-            width: 300px; height: 300px; pointer-events: none;
-        }
-        @keyframes flowLandmark { 0% { transform: translateX(0); } 100% { transform: translateX(-150vw); } }
-        
-        .layer-mountains {
-            background-image: url('data:image/svg+xml;utf8,<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 1000 300"><path fill="%23A0C0A0" d="M0,300 L200,100 L400,300 Z M300,300 L500,50 L700,300 Z M600,300 L800,150 L1000,300 Z"/></svg>');
-            background-size: 50% 60%; animation-duration: 60s;
-        }
-        .layer-buildings {
-            background-image: url('data:image/svg+xml;utf8,<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 500 100"><rect x="50" y="50" width="30" height="50" fill="%23666" /><rect x="150" y="20" width="40" height="80" fill="%23777" /><rect x="300" y="40" width="20" height="60" fill="%23555" /><path d="M400,0 L410,100" stroke="%23333" stroke-width="2"/></svg>');
-            background-size: 50% 40%; animation-duration: 5s; 
-        }
-        .rain-effect {
-            position: absolute; inset: 0;
-            background-image: url('data:image/svg+xml;utf8,<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 20 20"><path d="M10,0 L10,10" stroke="rgba(255,255,255,0.5)" stroke-width="1"/></svg>');
-            animation: rain 0.5s linear infinite; opacity: 0; pointer-events: none;
-        }
-        @keyframes rain { 0% { background-position: 0 0; } 100% { background-position: -5px 20px; } }
-        @keyframes moveScenery { 0% { transform: translateX(0); } 100% { transform: translateX(-50%); } }
-
-        .cockpit-frame {
-            background: linear-gradient(180deg, #2d3748 0%, #1a202c 100%);
-            box-shadow: inset 0 2px 10px rgba(0,0,0,0.5);
-            border-top: 4px solid #4a5568;
-        }
-        .glass-panel {
-            background: rgba(10, 20, 30, 0.85);
-            border: 1px solid #4a5568;
-            box-shadow: 0 0 15px rgba(66, 153, 225, 0.1);
-            backdrop-filter: blur(2px);
-        }
-        /* スクロールバー装飾 */
-        .custom-scrollbar::-webkit-scrollbar { width: 6px; }
-        .custom-scrollbar::-webkit-scrollbar-track { background: rgba(0,0,0,0.3); }
-        .custom-scrollbar::-webkit-scrollbar-thumb { background: rgba(66, 153, 225, 0.5); border-radius: 3px; }
-    </style>
-</head>
-<body class="text-white h-screen flex flex-col">
-
-    <!-- 1. フロントガラス（上部 35%） -->
-    <div class="window-view relative flex-shrink-0" style="height: 35%;" id="windowView">
-        <div class="scenery-layer layer-mountains" id="layerMountains"></div>
-        <div class="scenery-layer layer-buildings" id="layerBuildings"></div>
-        {% if landmark %}
-        <div class="landmark-layer flex flex-col items-center" id="landmarkLayer" style="animation: flowLandmark 15s linear infinite;">
-            <div class="transform scale-150">{{ landmark.svg | safe }}</div>
-        </div>
-        {% endif %}
-        <div class="rain-effect" id="rainEffect"></div>
-        <div class="absolute inset-0 bg-gradient-to-r from-transparent via-white/5 to-transparent opacity-0" id="speedEffect"></div>
-        
-        <div id="landmarkGet" class="absolute top-10 right-10 transform translate-x-full transition-transform duration-500 bg-yellow-400 text-slate-900 p-3 rounded-l-xl shadow-xl border-2 border-white z-30">
-            <div class="flex items-center gap-2"><span class="text-2xl">📸</span><div><div class="text-xs font-bold text-slate-700">名所ゲット!</div><div class="font-black text-lg">{{ landmark.name if landmark else '' }}</div></div></div>
-        </div>
-
-        {% if state == 'menu' %}
-        <div class="absolute inset-0 flex items-center justify-center bg-black/50 backdrop-blur-sm z-20 p-4">
-            <div class="bg-white/90 text-slate-900 p-6 rounded-2xl shadow-2xl w-full max-w-lg text-center border-4 border-blue-600 overflow-y-auto max-h-full">
-                <h1 class="text-2xl md:text-3xl font-black mb-2 text-blue-800 tracking-tighter italic transform -skew-x-6">SHINKANSEN GO!</h1>
-                <p class="font-bold text-slate-600 mb-6 text-sm">日本縦断・国試必須問題ドリル</p>
-                <form action="/start" method="post" class="space-y-3 mb-6">
-                    <button name="mode" value="shinkansen" class="w-full bg-blue-600 hover:bg-blue-500 text-white font-bold py-3 px-4 rounded shadow-lg transform transition active:scale-95">
-                        <div class="pointer-events-none">各駅停車モード (7問/区間)</div>
-                        <div class="text-xs opacity-75 font-normal pointer-events-none">じっくり確実に進むならこちら</div>
-                    </button>
-                    <button name="mode" value="nozomi" class="w-full bg-yellow-500 hover:bg-yellow-400 text-slate-900 font-bold py-3 px-4 rounded shadow-lg transform transition active:scale-95">
-                        <div class="pointer-events-none">超特急{{ express_name }}モード (28問/区間)</div>
-                        <div class="text-xs opacity-75 font-normal pointer-events-none">大量の問題を高速処理！</div>
-                    </button>
-                </form>
-                <div class="border-t border-slate-300 pt-3">
-                    <h3 class="text-xs font-bold text-slate-500 mb-2">旅の思い出コレクション</h3>
-                    <div class="grid grid-cols-4 gap-2">
-                        {% for l_id, l_data in all_landmarks.items() %}
-                            <div class="aspect-square rounded border {{ 'bg-yellow-100 border-yellow-400' if l_id|string in collected else 'bg-slate-200 border-slate-300' }} flex flex-col items-center justify-center p-1">
-                                {% if l_id|string in collected %}
-                                    <div class="w-6 h-6 overflow-hidden">{{ l_data.svg | safe }}</div>
-                                    <div class="text-[8px] font-bold mt-1 text-slate-800 truncate w-full">{{ l_data.name }}</div>
-                                {% else %}<div class="text-lg text-slate-400">🔒</div>{% endif %}
-                            </div>
-                        {% endfor %}
-                    </div>
-                </div>
-            </div>
-        </div>
-        {% endif %}
-    </div>
-
-    <!-- 2. コックピット（下部 65% - クイズ領域確保） -->
-    <div class="cockpit-frame flex flex-col p-2 relative z-10" style="height: 65%;">
-        <!-- ヘッダー情報 -->
-        <div class="flex justify-between items-center px-3 py-1 bg-black/40 rounded mb-2 border border-slate-600 flex-shrink-0">
-            <div class="flex items-center gap-2">
-                <div class="text-[10px] text-slate-400">MODE</div>
-                <div class="text-yellow-400 font-bold tracking-widest text-sm">{{ mode_label|default('WAITING') }}</div>
-            </div>
-            <div class="flex items-center gap-2">
-                <div class="text-[10px] text-slate-400">PROGRESS</div>
-                <div class="digital-font text-lg text-green-400">{{ total_answered|default(0) }} / {{ total_questions }}</div>
-            </div>
-        </div>
-
-        <!-- ★修正ポイント: min-h-0 を追加して、親コンテナの高さを強制的に守らせる -->
-        <div class="flex flex-grow gap-2 overflow-hidden min-h-0">
-            <!-- 左パネル（計器類 - 幅固定・小さめ） -->
-            <div class="w-1/3 max-w-[120px] glass-panel rounded-lg p-2 flex flex-col relative flex-shrink-0">
-                <div class="text-[10px] text-blue-300 mb-1 border-b border-blue-900/50 pb-1 text-center">MONITOR</div>
-                <div class="mb-2">
-                    <div class="text-[8px] text-slate-400">NEXT</div>
-                    <div class="text-sm font-bold text-white truncate">{{ next_station|default('---') }}</div>
-                    <div class="w-full bg-slate-700 h-1 mt-1 rounded"><div class="bg-green-500 h-1 rounded" style="width: {{ progress|default(0) }}%"></div></div>
-                </div>
-                <div class="flex-grow flex flex-col items-center justify-center relative">
-                    <canvas id="speedometer" width="200" height="200" class="max-w-full max-h-full"></canvas>
-                    <div class="absolute bottom-8 text-center">
-                        <div class="digital-font text-2xl text-cyan-400" id="speedDisplay">0</div>
-                        <div class="text-[8px] text-slate-500">km/h</div>
-                    </div>
-                    
-                    <!-- ★追加ギミック: 運転状態インジケーター -->
-                    <div class="flex gap-1 mt-1">
-                        <div id="ind-p" class="w-3 h-3 rounded-full bg-slate-800 border border-slate-600 flex items-center justify-center text-[6px] text-slate-400 font-bold transition-colors">P</div>
-                        <div id="ind-n" class="w-3 h-3 rounded-full bg-green-500 border border-green-400 flex items-center justify-center text-[6px] text-black font-bold shadow-[0_0_5px_rgba(34,197,94,0.8)] transition-colors">N</div>
-                        <div id="ind-b" class="w-3 h-3 rounded-full bg-slate-800 border border-slate-600 flex items-center justify-center text-[6px] text-slate-400 font-bold transition-colors">B</div>
-                    </div>
-                </div>
-                <div class="absolute top-1 right-1 text-xs" id="weatherIcon">☀️</div>
-            </div>
-
-            <!-- 右パネル（クイズ - メイン領域） -->
-            <!-- ★修正: スクロール制御を親ではなく内部のdivで行うように構造変更 -->
-            <div class="flex-1 glass-panel rounded-lg p-2 flex flex-col relative monitor-scanline h-full min-h-0">
-                {% if state == 'quiz' %}
-                    <!-- ★緊急停止ボタン: 右上に移動し、z-indexを上げて確実に表示 -->
-                    <div class="absolute top-2 right-3 z-50">
-                        <form action="/emergency_stop" method="post" onsubmit="return confirm('緊急停止しますか？ひとつ前ののぞみ停車駅に戻ります。');">
-                            <button type="submit" class="bg-red-600/90 hover:bg-red-500 text-white text-[10px] font-bold py-1 px-2 rounded shadow-md border border-red-400 animate-pulse">
-                                🚨 STOP
-                            </button>
-                        </form>
-                    </div>
-
-                    <!-- ★スクロールコンテナ: ここでスクロールさせる -->
-                    <!-- 上部に余白(pt-8)を作ってボタンと重ならないようにする -->
-                    <div class="flex-grow overflow-y-auto custom-scrollbar flex flex-col relative pb-4 pt-8">
-                        <div class="flex-shrink-0 mb-4">
-                            <div class="text-blue-300 text-[10px] font-mono">ID: {{ question.id }}</div>
-                            <h2 class="text-sm md:text-base font-bold leading-snug text-white drop-shadow-md">{{ question.question }}</h2>
-                        </div>
-                        
-                        <form action="/answer" method="post" class="flex flex-col gap-2 flex-grow">
-                            <input type="hidden" name="client_speed" id="clientSpeedInput" value="0">
-                            <input type="hidden" name="got_landmark" id="gotLandmarkInput" value="0">
-                            {% for opt in question.options %}
-                            {% set is_disabled = (loop.index0 in disabled_indices) %}
-                            <button name="choice" value="{{ loop.index }}" onclick="submitAnswer(this)"
-                                {% if is_disabled %}disabled{% endif %}
-                                class="w-full text-left px-3 py-3 rounded text-xs md:text-sm transition-all duration-100 group border flex-shrink-0
-                                {% if is_disabled %}
-                                    bg-slate-900/50 border-slate-800 text-slate-700 cursor-not-allowed
-                                {% else %}
-                                    bg-slate-800/80 hover:bg-blue-600/50 border-slate-600 hover:border-blue-400 text-white active:bg-blue-700
-                                {% endif %}">
-                                <span class="mr-2 pointer-events-none {% if is_disabled %}invisible{% else %}text-blue-400 group-hover:text-white{% endif %}">[{{ loop.index }}]</span>
-                                <span class="pointer-events-none {% if is_disabled %}line-through opacity-30{% endif %}">{{ opt }}</span>
-                            </button>
-                            {% endfor %}
-                        </form>
-                    </div>
-                {% elif state == 'judgement' %}
-                     <div class="flex-grow flex flex-col items-center justify-center text-center">
-                        {% if is_correct %}
-                            <div class="text-green-400 text-5xl font-black mb-2 tracking-tighter drop-shadow-[0_0_10px_rgba(74,222,128,0.5)]">CLEAR</div>
-                            <div class="text-blue-200 text-sm">加速します！</div>
-                        {% else %}
-                            <div class="text-red-500 text-5xl font-black mb-2 tracking-tighter">WARNING</div>
-                            <div class="text-sm font-bold text-white px-4">{{ correct_answer_text }}</div>
-                             <!-- 追試メッセージ -->
-                            <div class="text-yellow-300 text-xs mt-2 font-bold animate-pulse">※この問題は再出題されます</div>
-                        {% endif %}
-                        <!-- 自動遷移用フォーム (非表示) -->
-                        <form id="nextForm" action="/next" method="post"></form>
-                        <div class="mt-4 text-[10px] text-slate-400 animate-pulse">NEXT QUESTION IN <span id="countdown">1.5</span>s...</div>
-                        
-                        <script>
-                            setTimeout(() => {
-                                document.getElementById('nextForm').submit();
-                            }, 1500);
-                        </script>
-                    </div>
-                {% elif state == 'station_arrival' %}
-                    <div class="flex-grow flex flex-col items-center justify-center text-center overflow-y-auto">
-                        <div class="text-3xl font-bold text-yellow-400 mb-2">{{ current_station }} ARRIVED</div>
-                        <div class="text-slate-400 text-sm mb-6">区間運行完了</div>
-                        
-                        <!-- モード選択・乗り換えUI -->
-                        <div class="w-full max-w-xs space-y-3">
-                            <form action="/depart" method="post" class="space-y-3">
-                                {% if is_nozomi_station %}
-                                    <div class="text-xs text-yellow-300 font-bold mb-1">乗り換え案内: 運行モードを選択できます</div>
-                                    <!-- ★ここを修正しました！のぞみボタンを上に移動 -->
-                                    <button name="mode" value="nozomi" class="w-full bg-yellow-500 hover:bg-yellow-400 text-slate-900 font-bold py-3 px-4 rounded shadow flex justify-between items-center group text-sm active:scale-95 transition">
-                                        <span class="pointer-events-none">超特急{{ express_name }}で次へ</span> <span class="text-[10px] opacity-75 pointer-events-none">28問/区間</span>
-                                    </button>
-                                    <button name="mode" value="shinkansen" class="w-full bg-blue-600 hover:bg-blue-500 text-white font-bold py-3 px-4 rounded shadow flex justify-between items-center group text-sm active:scale-95 transition">
-                                        <span class="pointer-events-none">各駅停車で次へ</span> <span class="text-[10px] opacity-75 pointer-events-none">7問/区間</span>
-                                    </button>
-                                {% else %}
-                                    <button name="mode" value="shinkansen" class="w-full bg-green-600 hover:bg-green-500 text-white font-bold py-3 px-8 rounded shadow-lg active:scale-95 transition">
-                                        次の駅へ出発
-                                    </button>
-                                {% endif %}
-                            </form>
-                            
-                            <!-- タイトルへ戻るボタン -->
-                            <a href="/" class="block mt-4 text-xs text-slate-500 hover:text-white underline">
-                                途中下車してタイトルへ戻る
-                            </a>
-                        </div>
-                    </div>
-                {% elif state == 'goal' %}
-                     <div class="flex-grow flex flex-col items-center justify-center text-center">
-                        <div class="text-4xl font-black text-yellow-400 mb-4">MISSION COMPLETE</div>
-                        <div class="text-lg text-white mb-2">全問走破＆新函館北斗駅 到着</div>
-                        <div class="text-sm text-slate-300 mb-8">最終スコア: {{ score }} / {{ total_answered }} 問正解</div>
-                        <a href="/" class="bg-slate-700 hover:bg-slate-600 text-white py-2 px-6 rounded text-sm">タイトルへ戻る</a>
-                     </div>
-                {% endif %}
-            </div>
-        </div>
-    </div>
-    <script>
-        const canvas = document.getElementById('speedometer');
-        const ctx = canvas ? canvas.getContext('2d') : null;
-        let currentSpeed = {{ current_speed|default(0) }}, targetSpeed = {{ current_speed|default(0) }};
-        const hasLandmark = {{ 'true' if landmark else 'false' }};
-        const isTunnel = {{ 'true' if landmark and landmark.is_tunnel else 'false' }};
-        let landmarkCollected = false;
-
-        function drawSpeedometer() {
-            if (!ctx) return;
-            ctx.clearRect(0, 0, 200, 200);
-            const cx = 100, cy = 100, radius = 80;
-            ctx.beginPath(); ctx.arc(cx, cy, radius, 0.75 * Math.PI, 2.25 * Math.PI); ctx.lineWidth = 10; ctx.strokeStyle = '#1e293b'; ctx.stroke();
-            const maxSpeed = 350;
-            const speedAngle = (0.75 + (1.5 * (currentSpeed / maxSpeed))) * Math.PI;
-            ctx.beginPath(); ctx.moveTo(cx, cy); ctx.lineTo(cx + Math.cos(speedAngle)*(radius-10), cy + Math.sin(speedAngle)*(radius-10)); ctx.lineWidth = 4; ctx.strokeStyle = '#facc15'; ctx.stroke();
-            const display = document.getElementById('speedDisplay'); if(display) display.innerText = Math.round(currentSpeed);
-            updateEnvironment(currentSpeed);
-        }
-
-        function updateEnvironment(speed) {
-            const windowView = document.getElementById('windowView');
-            const rainEffect = document.getElementById('rainEffect');
-            const weatherIcon = document.getElementById('weatherIcon');
-            const landmarkLayer = document.getElementById('landmarkLayer');
-            const landmarkNotify = document.getElementById('landmarkGet');
-            const inputGotLandmark = document.getElementById('gotLandmarkInput');
-            
-            // ★インジケーター制御
-            const p = document.getElementById('ind-p');
-            const n = document.getElementById('ind-n');
-            const b = document.getElementById('ind-b');
-            
-            const reset = (el) => {
-                el.className = "w-3 h-3 rounded-full bg-slate-800 border border-slate-600 flex items-center justify-center text-[6px] text-slate-400 font-bold transition-colors";
-            };
-            const active = (el, colorClass, glowColor) => {
-                el.className = `w-3 h-3 rounded-full ${colorClass} border border-white/50 flex items-center justify-center text-[6px] text-black font-bold shadow-[0_0_8px_${glowColor}] transition-colors`;
-            };
-
-            if (p && n && b) {
-                reset(p); reset(n); reset(b);
-                if (Math.abs(targetSpeed - currentSpeed) < 1) {
-                    active(n, "bg-green-500", "rgba(34,197,94,0.8)"); // Neutral
-                } else if (targetSpeed > currentSpeed) {
-                    active(p, "bg-orange-500", "rgba(249,115,22,0.8)"); // Power
-                } else {
-                    active(b, "bg-red-500", "rgba(239,68,68,0.8)"); // Brake
-                }
-            }
-
-            if (isTunnel) {
-                windowView.classList.add('weather-tunnel'); if(weatherIcon) weatherIcon.innerText = "🚇";
-            } else {
-                if (speed < 100) {
-                    windowView.classList.add('weather-rainy'); rainEffect.style.opacity = 1; if(weatherIcon) weatherIcon.innerText = "☔️";
-                    if(landmarkLayer) landmarkLayer.style.opacity = 0.2;
-                } else {
-                    windowView.classList.remove('weather-rainy'); rainEffect.style.opacity = 0; if(weatherIcon) weatherIcon.innerText = "☀️";
-                    if(landmarkLayer) landmarkLayer.style.opacity = 1;
-                    if (hasLandmark && !landmarkCollected && speed > 200) {
-                        landmarkCollected = true;
-                        if(landmarkNotify) landmarkNotify.classList.remove('translate-x-full');
-                        if(inputGotLandmark) inputGotLandmark.value = "1";
-                        setTimeout(() => { if(landmarkNotify) landmarkNotify.classList.add('translate-x-full'); }, 3000);
-                    }
-                }
-            }
-        }
-
-        function animate() {
-            if (Math.abs(targetSpeed - currentSpeed) > 1) currentSpeed += (targetSpeed - currentSpeed) * 0.1; else currentSpeed = targetSpeed;
-            drawSpeedometer(); requestAnimationFrame(animate);
-        }
-        setInterval(() => {
-             const mt = document.getElementById('layerMountains'), bd = document.getElementById('layerBuildings'), se = document.getElementById('speedEffect');
-             if(!mt) return;
-             if(currentSpeed < 5) { mt.style.animationPlayState = 'paused'; bd.style.animationPlayState = 'paused'; se.style.opacity = 0; }
-             else { mt.style.animationPlayState = 'running'; bd.style.animationPlayState = 'running'; se.style.opacity = Math.min((currentSpeed - 100) / 200, 0.5);
-                 const factor = 300 / Math.max(currentSpeed, 10); bd.style.animationDuration = (0.5 * factor) + 's'; }
-        }, 100);
-        if (ctx) animate();
-        function submitAnswer(btn) { document.getElementById('clientSpeedInput').value = Math.round(currentSpeed); btn.innerHTML = "TRANSMITTING..."; }
-    </script>
-</body>
-</html>
-"""
-
-# ---------------------------------------------------------
-# 4. ルーティング & ゲームロジック
-# ---------------------------------------------------------
-
-@app.route('/')
-def index():
-    # ★修正: タイトルに戻ったら、コレクション以外のゲーム進行データをきれいサッパリ忘れるようにします！
-    keys_to_remove = ['mode', 'current_station_idx', 'next_station_idx', 'score', 
-                      'current_speed', 'question_deck', 'quiz_queue', 'current_quiz_idx', 
-                      'question_start_time', 'total_answered_count']
-    for key in keys_to_remove:
-        session.pop(key, None)
-
-    collected = session.get('collected_landmarks', [])
-    # ★ 初期値は「みずほ」(0)
-    return render_template_string(HTML_TEMPLATE, state='menu', current_speed=0, all_landmarks=LANDMARK_DATA, collected=collected, total_questions=len(ALL_QUESTIONS), express_name=get_express_name(0))
-
-@app.route('/start', methods=['POST'])
-def start_game():
-    # ★修正: フォームの値に変な空白が入っていても除去して受け取るように修正
-    # デバッグ用にログを出力
-    raw_mode = request.form.get('mode')
-    print(f"DEBUG: Start Game Request Mode = '{raw_mode}'")
-    
-    if raw_mode:
-        mode = raw_mode.strip()
-    else:
-        mode = 'shinkansen' # デフォルト
-        
-    session['mode'] = mode
-    session['current_station_idx'] = 0
-    session['score'] = 0
-    session['current_speed'] = 50
-    if 'collected_landmarks' not in session: session['collected_landmarks'] = []
-
-    # ★完走型ロジックの核：問題IDの山札（Deck）を作成してシャッフル
-    deck = list(range(len(ALL_QUESTIONS)))
-    random.shuffle(deck)
-    session['question_deck'] = deck
-    session['total_answered_count'] = 0 # 累計回答数
-    
-    set_next_destination(0, mode)
-    
-    # 最初の区間の問題を取得
-    prepare_next_leg_questions()
-    
-    session['current_quiz_idx'] = 0
-    session['question_start_time'] = time.time()
-    return redirect(url_for('play'))
-
-def set_next_destination(current_idx, mode):
-    next_idx = current_idx + 1
-    if mode == 'nozomi':
-        # ★修正: のぞみロジックをより確実に。
-        # 現在地より後で、最初に「is_nozomi=True」になる駅を探す
-        found = False
-        for i in range(current_idx + 1, len(STATION_DATA)):
-            if STATION_DATA[i]['is_nozomi']:
-                next_idx = i
-                found = True
-                break
-        # もし最後まで見つからなかったら終点（新函館北斗）へ
-        if not found:
-            next_idx = len(STATION_DATA) - 1
-            
-    session['next_station_idx'] = next_idx
-
-def prepare_next_leg_questions():
-    """山札から次の区間分の問題を取り出す"""
-    mode = session.get('mode')
-    count = 7 if mode == 'shinkansen' else 28
-    
-    deck = session.get('question_deck', [])
-    
-    # デッキから取り出す（足りない場合はあるだけ取り出す）
-    num_to_take = min(count, len(deck))
-    
-    if num_to_take == 0:
-        # もう問題がない場合 -> 空リスト
-        selected_indices = []
-    else:
-        selected_indices = deck[:num_to_take]
-        session['question_deck'] = deck[num_to_take:] # デッキ更新
-        
-    # インデックスから実際の問題データを取得
-    # ★修正: Cookie容量オーバー対策のため、セッションには「問題インデックスのリスト」のみを保存する
-    session['quiz_queue'] = selected_indices
-
-@app.route('/play')
-def play():
-    if 'quiz_queue' not in session: return redirect(url_for('index'))
-    queue = session['quiz_queue'] # ここはインデックスのリスト
-    idx = session['current_quiz_idx']
-    
-    # 区間クリア判定
-    if idx >= len(queue):
-        # もしデッキも空なら、ゲームクリア（ゴール）へ
-        if len(session.get('question_deck', [])) == 0:
-             return render_template_string(HTML_TEMPLATE, state='goal', score=session['score'], total_answered=session['total_answered_count'])
-        
-        # 現在の駅が「のぞみ停車駅」かどうかを判定してテンプレートへ渡す
-        current_station_data = STATION_DATA[session['next_station_idx']]
-        is_nozomi_station = current_station_data['is_nozomi']
-        
-        # ★ 次の区間の列車名を取得（到着した駅＝次の出発駅）
-        express_name = get_express_name(session['next_station_idx'])
-
-        return render_template_string(HTML_TEMPLATE, 
-            state='station_arrival',
-            current_station=current_station_data['name'],
-            score=session['score'], current_speed=0, total_questions=len(ALL_QUESTIONS), total_answered=session['total_answered_count'],
-            is_nozomi_station=is_nozomi_station,
-            express_name=express_name # ★追加
-        )
-    
-    current_st_idx = session['current_station_idx']
-    landmark = LANDMARK_DATA.get(current_st_idx)
-    session['question_start_time'] = time.time()
-    
-    # ★修正: インデックスを使ってマスターデータから問題を取得
-    q_index = queue[idx]
-    current_question = ALL_QUESTIONS[q_index]
-
-    # ★ 追加: 超特急のぞみモードなら、選択肢を2択にする（3つ消す）
-    disabled_indices = []
-    if session.get('mode') == 'nozomi':
-        # 正解のインデックス(0始まり)を取得
-        correct_idx_zero = current_question['answer_idx'] - 1
-        # 正解以外のインデックス(0-4)のリストを作成
-        others = [i for i in range(5) if i != correct_idx_zero]
-        # その中からランダムに3つ選ぶ
-        disabled_indices = random.sample(others, 3)
-    
-    # ★ モードラベルの動的生成
-    express_name = get_express_name(current_st_idx)
-    mode_label = "各駅停車" if session['mode'] == 'shinkansen' else f"超特急{express_name}"
-
-    return render_template_string(HTML_TEMPLATE,
-        state='quiz',
-        question=current_question,
-        mode_label=mode_label, # ★修正
-        current_station=STATION_DATA[current_st_idx]['name'],
-        next_station=STATION_DATA[session['next_station_idx']]['name'],
-        score=session['score'],
-        progress=(idx / len(queue)) * 100,
-        current_speed=session.get('current_speed', 100),
-        landmark=landmark,
-        total_questions=len(ALL_QUESTIONS),
-        total_answered=session['total_answered_count'] + 1,
-        disabled_indices=disabled_indices
-    )
-
-@app.route('/answer', methods=['POST'])
-def answer():
-    choice = int(request.form.get('choice'))
-    client_speed = int(request.form.get('client_speed', 0))
-    got_landmark_flag = request.form.get('got_landmark', '0')
-    queue = session['quiz_queue']
-    idx = session['current_quiz_idx']
-    
-    # ★修正: インデックスから問題を取得
-    q_index = queue[idx]
-    current_q = ALL_QUESTIONS[q_index]
-    
-    elapsed = time.time() - session.get('question_start_time', time.time())
-    is_correct = (choice == current_q['answer_idx'])
-    current_speed = client_speed
-    
-    if is_correct:
-        session['score'] += 1
-        speed_bonus = max(10, 50 - (elapsed * 2))
-        current_speed = min(320, current_speed + speed_bonus)
-    else:
-        current_speed = max(30, current_speed - 50)
-        # ★修正: 不正解なら問題をキューの末尾に追加（再出題） - インデックスを追加
-        queue.append(q_index)
-        session['quiz_queue'] = queue
-    
-    session['current_speed'] = current_speed
-    session['total_answered_count'] += 1 # 回答済みカウントアップ
-
-    landmark_info = LANDMARK_DATA.get(session['current_station_idx'])
-    if landmark_info and got_landmark_flag == "1":
-        collected = session.get('collected_landmarks', [])
-        l_id = str(session['current_station_idx'])
-        if l_id not in collected:
-            collected.append(l_id)
-            session['collected_landmarks'] = collected
-
-    return render_template_string(HTML_TEMPLATE,
-        state='judgement',
-        is_correct=is_correct,
-        correct_answer_text=current_q['options'][current_q['answer_idx']-1],
-        current_speed=current_speed,
-        total_questions=len(ALL_QUESTIONS),
-        total_answered=session['total_answered_count']
-    )
-
-@app.route('/next', methods=['POST'])
-def next_question():
-    session['current_quiz_idx'] += 1
-    return redirect(url_for('play'))
-
-@app.route('/depart', methods=['POST'])
-def depart():
-    # ★モード変更の処理（フォームから送信された場合のみ更新）
-    new_mode = request.form.get('mode')
-    if new_mode:
-        session['mode'] = new_mode
-
-    current_idx = session['next_station_idx']
-    session['current_station_idx'] = current_idx
-    
-    # 終点チェック or 問題切れチェック
-    deck_is_empty = (len(session.get('question_deck', [])) == 0)
-    
-    if current_idx >= len(STATION_DATA) - 1 or deck_is_empty:
-        return render_template_string(HTML_TEMPLATE, state='goal', score=session['score'], total_answered=session['total_answered_count'])
-    
-    # 更新されたモードで次の目的地を設定
-    set_next_destination(current_idx, session['mode'])
-    
-    # 次の問題セット補充（デッキから引く）
-    prepare_next_leg_questions()
-    
-    session['current_quiz_idx'] = 0
-    session['current_speed'] = 100
-    return redirect(url_for('play'))
-
-# ★緊急停止機能（リタイヤ）を追加
-@app.route('/emergency_stop', methods=['POST'])
-def emergency_stop():
-    current_idx = session.get('current_station_idx', 0)
-    
-    # 現在地より手前（過去）の「のぞみ停車駅」を探す
-    target_idx = 0 # 見つからなければ始発駅
-    for i in range(current_idx, -1, -1):
-        if STATION_DATA[i]['is_nozomi']:
-            target_idx = i
-            break
-            
-    # 強制的にその駅に到着した状態にする
-    session['next_station_idx'] = target_idx
-    
-    # 現在のクイズキューを強制的に終了状態にするため、インデックスを大きくする
-    session['current_quiz_idx'] = 9999
-    
-    # play() にリダイレクトすると、区間クリア判定 (idx >= len(queue)) に引っかかり、
-    # target_idx (戻った先の駅) への到着画面が表示される
-    return redirect(url_for('play'))
-
-if __name__ == '__main__':
+import atexit
+import os
+import csv
+import functools
+import glob
+import hashlib
+import random
+import re
+import time
+import hmac
+
+# ★ 起動時間の内訳 (import / 問題集 / テンプレート)。Flask 等の import より前から測る
+_startup_mark = time.perf_counter()
+STARTUP_TIMES = {}
+
+def mark_startup(phase):
+    """前回の区切りからの秒数を STARTUP_TIMES[phase] に記録する"""
+    global _startup_mark
+    now = time.perf_counter()
+    STARTUP_TIMES[phase] = now - _startup_mark
+    _startup_mark = now
+
+from flask import Flask, request, session, render_template, redirect, url_for, jsonify, g, request_finished, abort
+from flask.sessions import session_json_serializer
+from jinja2 import FileSystemBytecodeCache
+from adaptive_deck import AdaptiveDeckStore, PopulationModel, build_leg
+from bank_versions import BankRegistry
+from compression import ResponseCompressor, choose_encoding
+from page_cache import PageCache
+from player_profiles import ProfileStore, valid_player_id
+from event_log import create_event_log
+from game_engine import GameEngine
+from leaderboard import Leaderboard
+from metrics import Registry
+from profiling import SamplingProfiler, TimedSessionInterface, add_span, mark_routing, span
+from game_state import MODE_CODES, GameState, decode_state, encode_state, migrate_legacy_session
+from question_bank import (MappedQuestionBank, QuestionBank, SQLiteQuestionBank, file_checksum, filter_indices,
+                           import_versioned_db, question_key, read_bank_file, sources_checksum, write_bank_file)
+from question_stats import SORT_KEYS, QuestionStats, hardest_questions
+from race import RaceBroadcaster
+from route_engine import RouteEngine
+from session_store import create_session_interface
+
+app = Flask(__name__)
+app.secret_key = os.environ.get('SECRET_KEY', 'default_secret_key_for_shinkansen')
+
+# ★ セッションの保存先: cookie (Flask標準) / memory (プロセス内LRU) / sqlite (全ワーカー共有)
+#    memory / sqlite ではブラウザにはセッションIDだけが渡る
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cookie')
+_server_session = create_session_interface(
+    SESSION_BACKEND,
+    db_path=os.environ.get('SESSION_DB_PATH'),
+    ttl=int(os.environ.get('SESSION_TTL', 86400)),
+    max_entries=int(os.environ.get('SESSION_MAX_ENTRIES', 10000)),
+)
+if _server_session is not None:
+    app.session_interface = _server_session
+
+# ★ 計測: /metrics で Prometheus 形式の集計を返す
+#    gunicorn の複数ワーカーで動かす場合は METRICS_DIR に共通のディレクトリを指定すると全ワーカー分を合算する
+METRICS = Registry(os.environ.get('METRICS_DIR'), float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0)))
+REQUEST_LATENCY = METRICS.histogram('shinkansen_request_duration_seconds', 'Request latency by route.',
+                                    ('endpoint', 'method'))
+SESSION_SIZE = METRICS.histogram('shinkansen_session_bytes', 'Serialized size of modified sessions.',
+                                 buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192))
+TEMPLATE_RENDER = METRICS.histogram('shinkansen_template_render_seconds', 'Template render time by screen.',
+                                    ('screen',), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+GAMES_STARTED = METRICS.counter('shinkansen_games_started_total', 'Games started by mode.', ('mode',))
+GAMES_COMPLETED = METRICS.counter('shinkansen_games_completed_total', 'Games that reached the goal by mode.', ('mode',))
+ANSWERS = METRICS.counter('shinkansen_answers_total', 'Answers by mode and result (correct/wrong).', ('mode', 'result'))
+EMERGENCY_STOPS = METRICS.counter('shinkansen_emergency_stops_total', 'Emergency stops.')
+EVENTS_WRITTEN = METRICS.counter('shinkansen_events_written_total', 'Play events written to the event log.')
+EVENTS_DROPPED = METRICS.counter('shinkansen_events_dropped_total', 'Play events dropped because the queue was full.')
+BANK_RELOADS = METRICS.counter('shinkansen_bank_reloads_total', 'Question bank reloads by result (ok/error).', ('result',))
+BANK_RELOAD_SECONDS = METRICS.histogram('shinkansen_bank_reload_seconds', 'Time to rebuild and swap in the question bank.',
+                                        buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+BANK_OVERLAP_BYTES = METRICS.histogram('shinkansen_bank_overlap_bytes',
+                                       'RSS growth while the old and new question banks are loaded together.',
+                                       buckets=(1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20, 1 << 30))
+BANK_DRAIN_SECONDS = METRICS.histogram('shinkansen_bank_drain_seconds',
+                                       'How long a replaced question bank stayed loaded for in-flight games.',
+                                       buckets=(1, 10, 60, 300, 900, 3600, 14400))
+
+# ★ プレイ記録: 回答・開始・出発・緊急停止をイベントとして書き出す (jsonl / sqlite / off)
+#    リクエスト中はキューに積むだけで、書き込みは別スレッドがまとめて行う
+EVENT_LOG = create_event_log(
+    os.environ.get('EVENT_LOG', 'jsonl'),
+    path=os.environ.get('EVENT_LOG_PATH'),
+    max_queue=int(os.environ.get('EVENT_LOG_MAX_QUEUE', 10000)),
+    on_write=lambda count: EVENTS_WRITTEN.inc(amount=count),
+)
+
+def record_event(kind, **fields):
+    if EVENT_LOG is not None and not EVENT_LOG.emit(kind, **fields):
+        EVENTS_DROPPED.inc()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+def record_request(sender, response, **extra):
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - start, request.endpoint or 'unmatched', request.method)
+    if session.modified:
+        SESSION_SIZE.observe(len(session_json_serializer.dumps(dict(session))))
+    METRICS.maybe_flush()
+    QUESTION_STATS.maybe_flush(describe_question)
+    PROFILES.maybe_flush()
+    LEADERBOARD.maybe_flush()
+    ADAPTIVE_DECKS.maybe_cleanup()
+    ADAPTIVE_POPULATION.maybe_refresh()
+    BANKS.maybe_reload()
+
+# セッションの保存・圧縮まで終わった後に呼ばれる
+request_finished.connect(record_request, app)
+
+@app.route('/metrics')
+def metrics():
+    return app.response_class(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# ★ 処理時間の内訳: 応答の Server-Timing ヘッダーに session / routing / state / deck / render / compress を載せる
+#    既定では X-Admin-Token (ADMIN_TOKEN) の合うリクエストにだけ載せる。SERVER_TIMING=1 で全員に、0 で誰にも載せない
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'admin')
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+def is_admin_request():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+app.session_interface = TimedSessionInterface(
+    app.session_interface,
+    header={'1': True, '0': False}.get(SERVER_TIMING, is_admin_request))
+
+# ★ プロファイラ: PROFILE_SAMPLE_RATE の割合のリクエストだけを測り、PROFILE_DIR に集計を書き出す (既定は無効)
+#    ADMIN_TOKEN を設定すると /admin/profile から実行中に割合・形式を変えられる (変わるのは受けたワーカーだけ)
+PROFILER = SamplingProfiler(
+    directory=os.environ.get('PROFILE_DIR', 'profiles'),
+    rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    mode=os.environ.get('PROFILE_MODE', 'cprofile'),
+)
+
+@app.before_request
+def start_profile():
+    mark_routing()
+    g.profile = PROFILER.start(request.endpoint or 'unmatched') if PROFILER.rate else None
+
+@app.teardown_request
+def stop_profile(exc):
+    token = g.pop('profile', None)
+    if token is not None:
+        PROFILER.stop(token)
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """GET: 現在の設定 / POST (rate, mode): 設定を変える。X-Admin-Token ヘッダーが必要"""
+    if not is_admin_request():
+        abort(404)
+    if request.method == 'POST':
+        try:
+            PROFILER.configure(request.values.get('rate'), request.values.get('mode'))
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        if request.values.get('flush') == '1':
+            PROFILER.flush()
+    return jsonify(dict(PROFILER.status(), startup=STARTUP_TIMES))
+
+# ---------------------------------------------------------
+# 1. マスターデータ・設定
+# ---------------------------------------------------------
+
+CSV_FILENAME = os.environ.get('QUESTION_CSV', '67-76_hissu_004.csv')
+
+# ★ 問題集の持ち方: memory (起動時に全問読み込む) / sqlite (SQLiteに取り込み、出題する問題だけ読む)
+#    / mmap (CSV をスナップショット QUESTION_MAP_PATH に書き出して mmap する。gunicorn.conf.py を参照)
+#    sqlite では QUESTION_CSV_GLOB に当たる全CSV (過去問すべて等) を版ごとの DB ファイル
+#    (QUESTION_DB_PATH の名前に版の番号を付けたもの) に取り込み、版を捨てる時にファイルも消す
+QUESTION_BACKEND = os.environ.get('QUESTION_BACKEND', 'memory')
+QUESTION_DB_PATH = os.environ.get('QUESTION_DB_PATH', 'questions.sqlite3')
+# ★ CSV を解析した結果のスナップショット (既定は CSV の隣の <CSV名>.qbank)。CSV の中身の CRC32 が
+#    同じ間は CSV を解析せずにスナップショットから読む (memory でも使う。QUESTION_SNAPSHOT=0 で無効)
+QUESTION_MAP_PATH = os.environ.get('QUESTION_MAP_PATH')
+QUESTION_SNAPSHOT = os.environ.get('QUESTION_SNAPSHOT', '1') == '1'
+QUESTION_CSV_GLOB = os.environ.get('QUESTION_CSV_GLOB', CSV_FILENAME)
+
+# ★ 路線データ (九州〜北海道まで完全収録！)
+#    "stations" はその路線だけの駅、"from" は分岐駅。分岐駅とその路線の駅を出る超特急が "express"
+#    駅番号は路線を並べた順の通し番号 (九州 0-11 / 山陽・東海道 12-45 / 東北・北海道 46-69 / 上越 70- / 北陸 79-)
+#    路線を足す時は末尾に足す (セッション・プロフィール・名所が持っている駅番号を変えないため)
+LINES = [
+    {"line": "九州新幹線", "express": "みずほ", "stations": [
+        {"name": "鹿児島中央", "is_nozomi": False}, {"name": "川内", "is_nozomi": False},
+        {"name": "出水", "is_nozomi": False}, {"name": "新水俣", "is_nozomi": False},
+        {"name": "新八代", "is_nozomi": False}, {"name": "熊本", "is_nozomi": True},
+        {"name": "新玉名", "is_nozomi": False}, {"name": "新大牟田", "is_nozomi": False},
+        {"name": "筑後船小屋", "is_nozomi": False}, {"name": "久留米", "is_nozomi": False},
+        {"name": "新鳥栖", "is_nozomi": False}, {"name": "博多", "is_nozomi": True}
+    ]},
+    {"line": "山陽・東海道新幹線", "from": "博多", "express": "のぞみ", "stations": [
+        {"name": "小倉", "is_nozomi": True}, {"name": "新下関", "is_nozomi": False},
+        {"name": "厚狭", "is_nozomi": False}, {"name": "新山口", "is_nozomi": False},
+        {"name": "徳山", "is_nozomi": False}, {"name": "新岩国", "is_nozomi": False},
+        {"name": "広島", "is_nozomi": True}, {"name": "東広島", "is_nozomi": False},
+        {"name": "三原", "is_nozomi": False}, {"name": "新尾道", "is_nozomi": False},
+        {"name": "福山", "is_nozomi": False}, {"name": "新倉敷", "is_nozomi": False},
+        {"name": "岡山", "is_nozomi": True}, {"name": "相生", "is_nozomi": False},
+        {"name": "姫路", "is_nozomi": False}, {"name": "西明石", "is_nozomi": False},
+        {"name": "新神戸", "is_nozomi": True}, {"name": "新大阪", "is_nozomi": True},
+        {"name": "京都", "is_nozomi": True}, {"name": "米原", "is_nozomi": False},
+        {"name": "岐阜羽島", "is_nozomi": False}, {"name": "名古屋", "is_nozomi": True},
+        {"name": "三河安城", "is_nozomi": False}, {"name": "豊橋", "is_nozomi": False},
+        {"name": "浜松", "is_nozomi": False}, {"name": "掛川", "is_nozomi": False},
+        {"name": "静岡", "is_nozomi": False}, {"name": "新富士", "is_nozomi": False},
+        {"name": "三島", "is_nozomi": False}, {"name": "熱海", "is_nozomi": False},
+        {"name": "小田原", "is_nozomi": False}, {"name": "新横浜", "is_nozomi": True},
+        {"name": "品川", "is_nozomi": True}, {"name": "東京", "is_nozomi": True}
+    ]},
+    {"line": "東北・北海道新幹線", "from": "東京", "express": "はやぶさ", "stations": [
+        {"name": "上野", "is_nozomi": False}, {"name": "大宮", "is_nozomi": True},
+        {"name": "宇都宮", "is_nozomi": False}, {"name": "那須塩原", "is_nozomi": False},
+        {"name": "新白河", "is_nozomi": False}, {"name": "郡山", "is_nozomi": False},
+        {"name": "福島", "is_nozomi": False}, {"name": "白石蔵王", "is_nozomi": False},
+        {"name": "仙台", "is_nozomi": True}, {"name": "古川", "is_nozomi": False},
+        {"name": "くりこま高原", "is_nozomi": False}, {"name": "一ノ関", "is_nozomi": False},
+        {"name": "水沢江刺", "is_nozomi": False}, {"name": "北上", "is_nozomi": False},
+        {"name": "新花巻", "is_nozomi": False}, {"name": "盛岡", "is_nozomi": True},
+        {"name": "いわて沼宮内", "is_nozomi": False}, {"name": "二戸", "is_nozomi": False},
+        {"name": "八戸", "is_nozomi": False}, {"name": "七戸十和田", "is_nozomi": False},
+        {"name": "新青森", "is_nozomi": True}, {"name": "奥津軽いまべつ", "is_nozomi": False},
+        {"name": "木古内", "is_nozomi": False}, {"name": "新函館北斗", "is_nozomi": True}
+    ]},
+    {"line": "上越新幹線", "from": "大宮", "express": "とき", "stations": [
+        {"name": "熊谷", "is_nozomi": False}, {"name": "本庄早稲田", "is_nozomi": False},
+        {"name": "高崎", "is_nozomi": True}, {"name": "上毛高原", "is_nozomi": False},
+        {"name": "越後湯沢", "is_nozomi": True}, {"name": "浦佐", "is_nozomi": False},
+        {"name": "長岡", "is_nozomi": True}, {"name": "燕三条", "is_nozomi": False},
+        {"name": "新潟", "is_nozomi": True}
+    ]},
+    {"line": "北陸新幹線", "from": "高崎", "express": "かがやき", "stations": [
+        {"name": "安中榛名", "is_nozomi": False}, {"name": "軽井沢", "is_nozomi": True},
+        {"name": "佐久平", "is_nozomi": False}, {"name": "上田", "is_nozomi": False},
+        {"name": "長野", "is_nozomi": True}, {"name": "飯山", "is_nozomi": False},
+        {"name": "上越妙高", "is_nozomi": False}, {"name": "糸魚川", "is_nozomi": False},
+        {"name": "黒部宇奈月温泉", "is_nozomi": False}, {"name": "富山", "is_nozomi": True},
+        {"name": "新高岡", "is_nozomi": False}, {"name": "金沢", "is_nozomi": True},
+        {"name": "小松", "is_nozomi": False}, {"name": "加賀温泉", "is_nozomi": False},
+        {"name": "芦原温泉", "is_nozomi": False}, {"name": "福井", "is_nozomi": True},
+        {"name": "越前たけふ", "is_nozomi": False}, {"name": "敦賀", "is_nozomi": True}
+    ]},
+]
+
+# ★ 次の停車駅・緊急停止先・超特急名は起動時に経路ごとの表にしておく (route_engine.py)
+#    ゲームは始発駅 (鹿児島中央) から東北・北海道新幹線の終点 (新函館北斗) までの経路を走る
+ROUTES = RouteEngine(LINES)
+STATION_DATA = ROUTES.stations
+ROUTE = ROUTES.route("東北・北海道新幹線")
+
+# 名所データ
+LANDMARK_DATA = {
+    0: { "name": "桜島", "svg": '<path fill="#FF8C00" d="M100,200 Q200,50 300,200 L400,250 L0,250 Z" opacity="0.8"/><circle cx="200" cy="50" r="10" fill="#FFF" opacity="0.5"><animate attributeName="cy" from="50" to="20" dur="2s" repeatCount="indefinite"/><animate attributeName="opacity" values="0.5;0;0.5" dur="2s" repeatCount="indefinite"/></circle>', "desc": "雄大な桜島の噴煙" },
+    25: { "name": "姫路城", "svg": '<path fill="#EEE" d="M150,200 L150,150 L250,150 L250,200 Z M120,150 L280,150 L200,80 Z M190,80 L210,80 L200,60 Z" stroke="#333" stroke-width="2"/>', "desc": "白鷺城の美しさ" },
+    30: { "name": "五重塔", "svg": '<g fill="#8B4513"><rect x="180" y="50" width="40" height="150"/><path d="M150,90 L250,90 L200,60 Z"/><path d="M140,120 L260,120 L200,90 Z"/><path d="M130,150 L270,150 L200,120 Z"/><path d="M120,180 L280,180 L200,150 Z"/><path d="M110,210 L290,210 L200,180 Z"/></g>', "desc": "古都のシンボル" },
+    38: { "name": "富士山", "svg": '<path fill="#FFF" d="M150,100 L250,100 L200,60 Z"/><path fill="#4682B4" d="M50,250 L200,60 L350,250 Z" stroke="none"/><path fill="#FFF" d="M165,105 L200,60 L235,105 Q200,120 165,105 Z"/>', "desc": "日本一の霊峰" },
+    44: { "name": "東京タワー", "svg": '<path fill="#FF4500" d="M180,250 L220,250 L200,50 Z"/><rect x="190" y="100" width="20" height="10" fill="#FFF"/><rect x="185" y="180" width="30" height="10" fill="#FFF"/>', "desc": "首都のランドマーク" },
+    53: { "name": "松島", "svg": '<rect x="0" y="200" width="400" height="50" fill="#4682B4"/><path fill="#228B22" d="M50,210 Q70,180 90,210 Z M150,220 Q180,170 210,220 Z M300,210 Q320,190 340,210 Z"/>', "desc": "日本三景の島々" },
+    66: { "name": "青函トンネル", "svg": '<rect x="0" y="0" width="1000" height="1000" fill="#111"/><circle cx="200" cy="150" r="10" fill="#FFFF00" opacity="0.5"><animate attributeName="opacity" values="0.5;1;0.5" dur="0.5s" repeatCount="indefinite"/></circle>', "desc": "海底の大動脈", "is_tunnel": True },
+    67: { "name": "函館山", "svg": '<path fill="#000" d="M50,250 Q200,100 350,250 Z" opacity="0.8"/><circle cx="100" cy="50" r="2" fill="white" /><circle cx="200" cy="80" r="2" fill="white" /><circle cx="300" cy="40" r="2" fill="white" />', "desc": "100万ドルの夜景" }
+}
+
+# ★ ゲームの規則 (速度・区間の問題数・再出題・名所・緊急停止) は game_engine.py にまとめ、ルートはそれを呼ぶ
+ENGINE = GameEngine(ROUTE, LANDMARK_DATA)
+
+# ---------------------------------------------------------
+# 2. データ読み込みロジック
+# ---------------------------------------------------------
+
+def question_sources():
+    """問題集の元データのパス (ホットリロードで変更を確認するファイル)"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    if QUESTION_BACKEND == 'sqlite':
+        return sorted(glob.glob(os.path.join(base_dir, QUESTION_CSV_GLOB)))
+    return [os.path.join(base_dir, CSV_FILENAME)]
+
+def load_questions_from_db():
+    """CSVを版ごとのSQLiteファイルへ取り込んで (前の版から変更のないファイルは飛ばす)、遅延読み込みの問題集を返す
+
+    読み直しても古い版のファイルはそのまま残るので、旅の途中の古い版は古い内容で出題し続けられる。
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    csv_paths = question_sources()
+    db_path, imported = import_versioned_db(os.path.join(base_dir, QUESTION_DB_PATH), csv_paths,
+                                            sources_checksum(csv_paths))
+    app.logger.info('問題DB: %d ファイルを確認し、%d 問を取り込みました (%s)', len(csv_paths), imported, db_path)
+    return SQLiteQuestionBank(db_path, remove_on_close=True)
+
+def load_questions_from_csv(csv_path):
+    # ★ 問題は列ごとの配列で持つ省メモリな QuestionBank に読み込む (question_bank.py)
+    questions = QuestionBank()
+    with open(csv_path, mode='r', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            if len(row) < 11: continue
+            questions.add(row[3], row[4], row[5:10], int(row[10]),
+                          round_no=int(row[1]) if row[1].isdigit() else None, category=row[2])
+    return questions
+
+def load_questions_from_snapshot(csv_path, mapped=False):
+    """スナップショットが CSV と同じ中身なら CSV を解析せずに読む。古ければ CSV から作り直して書き出す
+
+    mapped=True なら mmap する。gunicorn の preload_app で読み込めば、書き出しはマスターで1回だけ。
+    ワーカーは fork で同じ mmap を受け継ぎ、問題を読むたびにファイルのページから文字列を作るだけなので、
+    共有ページを書き換えない (コピーが起きない)。書き直しは一時ファイルからの置き換えなので、
+    古い版を mmap しているワーカーはそのまま古い中身を読める。
+    """
+    map_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), QUESTION_MAP_PATH or csv_path + '.qbank')
+    source = [os.path.basename(csv_path), file_checksum(csv_path)]
+    try:
+        questions = MappedQuestionBank(map_path) if mapped else read_bank_file(map_path)
+        if questions.source == source:
+            return questions
+    except (OSError, ValueError):
+        pass
+    questions = load_questions_from_csv(csv_path)
+    try:
+        write_bank_file(questions, map_path, source)
+    except OSError as e:
+        # 書き出せない (読み取り専用の場所など) 場合は、解析した問題集をそのまま使う
+        app.logger.warning('問題ファイル: %s に書き出せませんでした (%s)', map_path, e)
+        return questions
+    app.logger.info('問題ファイル: %s を %s に書き出しました', csv_path, map_path)
+    return MappedQuestionBank(map_path) if mapped else questions
+
+def load_questions():
+    """問題集を読み込む (読めなければ例外。起動時は error_questions、読み直し時は今の版のまま)"""
+    if QUESTION_BACKEND == 'sqlite':
+        return load_questions_from_db()
+    csv_path = question_sources()[0]
+    if QUESTION_BACKEND == 'mmap':
+        questions = load_questions_from_snapshot(csv_path, mapped=True)
+    elif QUESTION_SNAPSHOT:
+        questions = load_questions_from_snapshot(csv_path)
+    else:
+        questions = load_questions_from_csv(csv_path)
+    if len(questions) == 0:
+        # 書きかけ・空のファイルで問題集を差し替えない
+        raise ValueError(f"問題が1問もありません: {csv_path}")
+    return questions
+
+def error_questions(error):
+    """起動時に問題集が読めなかった場合に、エラーの内容を1問として出す"""
+    error_msg = f"エラー発生: {str(error)} (Path: {', '.join(question_sources()) or CSV_FILENAME})"
+    print(error_msg)
+    questions = QuestionBank()
+    questions.add("ERROR", error_msg, ["-"]*5, 1)
+    return questions
+
+def observe_bank_reload(result, seconds, overlap):
+    BANK_RELOADS.inc(result)
+    if result == 'ok':
+        BANK_RELOAD_SECONDS.observe(seconds)
+        if overlap is not None:
+            BANK_OVERLAP_BYTES.observe(overlap)
+
+# ★ 問題集のホットリロード: BANK_CHECK_INTERVAL 秒ごとに元の CSV を確認し、変わっていれば別スレッドで読み直して
+#    差し替える (bank_versions.py)。旅は始めた時の版 (GameState.bank_version) で問題番号を引き続け、
+#    古い版は参照がなくなって BANK_DRAIN_GRACE 秒 (放置された旅があっても BANK_IDLE_TTL 秒) で捨てる
+mark_startup('import')
+BANKS = BankRegistry(question_sources, load_questions, fallback=error_questions,
+                     check_interval=float(os.environ.get('BANK_CHECK_INTERVAL', 2.0)),
+                     grace=float(os.environ.get('BANK_DRAIN_GRACE', 300)),
+                     idle_ttl=float(os.environ.get('BANK_IDLE_TTL', 3600)),
+                     on_reload=observe_bank_reload, on_drain=BANK_DRAIN_SECONDS.observe)
+mark_startup('bank')
+
+# ★ 出題範囲の絞り込み (回・区分)。選択肢と問題数は版ごとに1回だけ数えておく (BankVersion)
+#    セッションには選んだ回・区分をその版の並び順のビットマスクで保存する
+CATEGORY_LABELS = {'N': '必須'}
+
+def keys_to_mask(keys, choices):
+    return sum(1 << bit for bit, key in enumerate(choices) if key in keys)
+
+def mask_to_keys(mask, choices):
+    return [key for bit, key in enumerate(choices) if mask >> bit & 1]
+
+# ★ 問題ごとの成績 (回答数・正答率・解答時間・選ばれた選択肢)。各ワーカーの増分を STATS_DB_PATH に足し込む
+STATS_DB_PATH = os.environ.get('STATS_DB_PATH', os.path.join(app.root_path, 'stats.sqlite3'))
+QUESTION_STATS = QuestionStats(len(BANKS.current.bank), STATS_DB_PATH,
+                               flush_interval=float(os.environ.get('STATS_FLUSH_INTERVAL', 5.0)))
+
+def describe_question(idx):
+    return BANKS.current.describe(idx)
+
+def swap_question_stats(old, new):
+    # 集計は今の版の問題番号で持つので、差し替える前に古い版の番号のまま書き出しておく
+    QUESTION_STATS.flush(old.describe)
+    QUESTION_STATS.resize(len(new.bank))
+
+BANKS.on_swap = swap_question_stats
+atexit.register(lambda: QUESTION_STATS.flush(describe_question))
+
+# ★ 苦手克服モード (アダプティブ出題): 全体の誤答率で重み付けした抽選器を、絞り込み条件ごとに作って使い回す
+#    このワーカーの回答はその場で重みに足し、ほかのワーカーの分は ADAPTIVE_REFRESH 秒ごとに変わった行だけ読む
+ADAPTIVE_REFRESH = float(os.environ.get('ADAPTIVE_REFRESH', 30))
+ADAPTIVE_POPULATION = PopulationModel(STATS_DB_PATH, refresh_interval=ADAPTIVE_REFRESH)
+
+def adaptive_sampler(state):
+    return ADAPTIVE_POPULATION.sampler(journey_bank(state), state.round_mask, state.category_mask)
+
+# 旅ごとに選んだ区間の問題はサーバー側 (ADAPTIVE_DB_PATH) に置き、セッションにはハンドルだけを持たせる
+ADAPTIVE_DECKS = AdaptiveDeckStore(os.environ.get('ADAPTIVE_DB_PATH', os.path.join(app.root_path, 'adaptive.sqlite3')),
+                                   ttl=float(os.environ.get('ADAPTIVE_DECK_TTL', 30 * 86400)))
+
+def today():
+    """復習日の単位 (1970-01-01 からの日数)"""
+    return int(time.time() // 86400)
+
+# ★ プレイヤープロフィール: 希望したプレイヤーだけ、旅の続き・名所コレクション・完走の記録を PLAYER_DB_PATH に残す
+#    回答のたびの書き換えはメモリ上だけで、PLAYER_FLUSH_INTERVAL 秒ごとにまとめて書き出す (ライトビハインド)
+PLAYER_DB_PATH = os.environ.get('PLAYER_DB_PATH', os.path.join(app.root_path, 'players.sqlite3'))
+PROFILES = ProfileStore(PLAYER_DB_PATH, flush_interval=float(os.environ.get('PLAYER_FLUSH_INTERVAL', 2.0)),
+                        max_entries=int(os.environ.get('PLAYER_CACHE_SIZE', 10000)))
+PLAYER_COOKIE = 'player'
+PLAYER_COOKIE_MAX_AGE = 365 * 86400
+atexit.register(PROFILES.flush)
+
+# ★ ランキング: モード・出題範囲ごとに、完走した旅を正答率順・時間順に並べる
+#    記録は LEADERBOARD_FLUSH_INTERVAL 秒ごとにまとめて SQLite に書き、その時に他のワーカーの記録も取り込む
+LEADERBOARD = Leaderboard(os.environ.get('LEADERBOARD_DB_PATH', os.path.join(app.root_path, 'leaderboard.sqlite3')),
+                          flush_interval=float(os.environ.get('LEADERBOARD_FLUSH_INTERVAL', 5.0)))
+LEADERBOARD_METRIC_LABELS = {'accuracy': '正答率', 'time': '旅の時間'}
+MODE_LABELS = {'shinkansen': '各駅停車', 'nozomi': '超特急'}
+atexit.register(LEADERBOARD.flush)
+
+def current_player():
+    """プロフィールを作ったプレイヤーなら (player_id, プロフィール)、そうでなければ (None, None)"""
+    if 'player' not in g:
+        player_id = request.cookies.get(PLAYER_COOKIE)
+        profile = PROFILES.get(player_id) if valid_player_id(player_id) else None
+        g.player = (player_id, profile) if profile is not None else (None, None)
+    return g.player
+
+# ★ ヘルパー関数: 現在地に応じた超特急の名称を取得
+def get_express_name(station_idx):
+    return ROUTE.express_name(station_idx)
+
+mark_startup('stores')
+
+# ---------------------------------------------------------
+# 3. HTMLテンプレート
+# ---------------------------------------------------------
+# ★ 画面(state)ごとにテンプレートを分割 (templates/ 配下)。
+#    共通部分は layout.html にまとめ、各画面はそれを extends する。
+#    Jinjaのテンプレートキャッシュに載るので、毎リクエストのパース＆コンパイルが不要になる。
+SCREEN_TEMPLATES = {
+    'menu': 'menu.html',
+    'quiz': 'quiz.html',
+    'judgement': 'judgement.html',
+    'station_arrival': 'station_arrival.html',
+    'goal': 'goal.html',
+}
+
+def warm_templates():
+    """全画面のテンプレートを起動時にコンパイルしてキャッシュしておく"""
+    # auto_reload 有効時 (デバッグ等) はファイル更新を検知して自動で再コンパイルされる
+    app.jinja_env.get_template('layout.html')
+    for template_name in SCREEN_TEMPLATES.values():
+        app.jinja_env.get_template(template_name)
+
+def render_screen(state, **context):
+    """state に対応するコンパイル済みテンプレートで画面を描画する"""
+    start = time.perf_counter()
+    html = render_template(SCREEN_TEMPLATES[state], state=state, **context)
+    elapsed = time.perf_counter() - start
+    TEMPLATE_RENDER.observe(elapsed, state)
+    add_span('render', elapsed)
+    return html
+
+# ★ CSS・JS・名所のSVGは静的ファイルとして配信する。URLに内容のハッシュ (?v=) を付けるので、
+#    中身が変わればURLも変わり、ブラウザには長期間キャッシュさせておける
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+ASSET_REFERENCE = re.compile(r"asset_url\('([^']+)'\)")
+_asset_versions = {}   # ファイル名 -> (更新時刻, 内容のハッシュ)
+
+def asset_version(filename):
+    """静的ファイルの内容のハッシュ (先頭12桁)
+
+    一度計算したら覚えておく。auto_reload 有効時だけ更新時刻を見て、変わっていれば計算し直す
+    (テンプレートと同じ扱い。ページキャッシュの版もこの値で決まる)。
+    """
+    cached = _asset_versions.get(filename)
+    if cached is not None and not app.jinja_env.auto_reload:
+        return cached[1]
+    path = os.path.join(app.static_folder, filename)
+    mtime = os.stat(path).st_mtime_ns
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _asset_versions[filename] = (mtime, hashlib.sha1(f.read()).hexdigest()[:12])
+    return cached[1]
+
+def template_assets(template_dir, names):
+    """テンプレートが asset_url('...') で参照している静的ファイル"""
+    assets = set()
+    for name in names:
+        with open(os.path.join(template_dir, name), encoding='utf-8') as f:
+            assets.update(ASSET_REFERENCE.findall(f.read()))
+    return tuple(sorted(assets))
+
+@app.template_global()
+def asset_url(filename):
+    return url_for('static', filename=filename, v=asset_version(filename))
+
+def build_landmark_sprite():
+    """LANDMARK_DATA のSVGを <symbol id="landmark-駅番号"> にまとめた1枚のスプライトを作る"""
+    symbols = ''.join(f'<symbol id="landmark-{station_idx}" viewBox="0 0 400 250">{data["svg"]}</symbol>'
+                      for station_idx, data in LANDMARK_DATA.items())
+    return f'<svg xmlns="http://www.w3.org/2000/svg">{symbols}</svg>'
+
+LANDMARK_SPRITE = build_landmark_sprite()
+LANDMARK_SPRITE_VERSION = hashlib.sha1(LANDMARK_SPRITE.encode('utf-8')).hexdigest()[:12]
+
+@app.template_global()
+def landmark_speed():
+    return ENGINE.speed.landmark_speed
+
+@app.template_global()
+def landmark_href(station_idx):
+    return f"{url_for('landmark_sprite', v=LANDMARK_SPRITE_VERSION)}#landmark-{station_idx}"
+
+@app.route('/landmarks.svg')
+def landmark_sprite():
+    response = app.response_class(LANDMARK_SPRITE, mimetype='image/svg+xml')
+    response.set_etag(LANDMARK_SPRITE_VERSION)
+    return response.make_conditional(request)
+
+# ★ 画面・JSON・CSS などの応答は Accept-Encoding に応じて brotli / gzip で圧縮する
+#    (512B 未満は圧縮しない。圧縮結果を使い回すのは ETag の付いた静的ファイル・名所のスプライトだけ)
+COMPRESSOR = ResponseCompressor(
+    min_size=int(os.environ.get('COMPRESS_MIN_SIZE', 512)),
+    gzip_level=int(os.environ.get('COMPRESS_GZIP_LEVEL', 6)),
+    brotli_quality=int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5)),
+)
+
+@app.after_request
+def compress_response(response):
+    with span('compress'):
+        return COMPRESSOR(request, response)
+
+@app.after_request
+def sync_player_profile(response):
+    # 名所コレクション・復習表のキーが変わったらプロフィールにも写す (書き出しは後でまとめて)
+    if session.modified and PLAYER_COOKIE in request.cookies:
+        player_id, profile = current_player()
+        landmarks, review = session.get('landmarks', 0), session.get('review')
+        if profile is not None and (landmarks & ~profile['landmarks'] or (review and review != profile['review'])):
+            PROFILES.update(player_id, landmarks=landmarks | profile['landmarks'], review=review or profile['review'])
+    return response
+
+@app.after_request
+def cache_versioned_assets(response):
+    # ハッシュ付きURLで取りに来たものは内容が変わらないので、1年キャッシュさせる
+    if request.endpoint in ('static', 'landmark_sprite') and request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+# ★ メニュー・到着・ゴール画面は描画結果を決める値が少ないので、描画済みのHTML (と gzip 版) を保存して使い回す
+#    テンプレート・名所データ・テンプレートが読み込む CSS/JS が変わったら版が変わり、キャッシュは自動で捨てられる
+PAGE_CACHE = PageCache(int(os.environ.get('PAGE_CACHE_SIZE', 1024)))
+CACHED_SCREENS = ('menu', 'station_arrival', 'goal')
+_template_mtimes = _template_assets = None
+
+def page_cache_version():
+    global _template_mtimes, _template_assets
+    # テンプレートの更新を見るのは auto_reload 有効時だけ (無効ならJinja側も読み直さない)
+    if _template_mtimes is None or app.jinja_env.auto_reload:
+        template_dir = os.path.join(app.root_path, app.template_folder)
+        names = ['layout.html'] + [SCREEN_TEMPLATES[screen] for screen in CACHED_SCREENS]
+        _template_mtimes = tuple(os.stat(os.path.join(template_dir, name)).st_mtime_ns for name in names)
+        _template_assets = template_assets(template_dir, names)
+    # 静的ファイルのハッシュは asset_url と同じ値 (計算し直されたら、キャッシュ済みの画面の URL も古くなる)
+    return (_template_mtimes, LANDMARK_SPRITE_VERSION, tuple(asset_version(name) for name in _template_assets))
+
+def render_cached_screen(state, key, **context):
+    """key (画面の内容を決める値の組) ごとに1回だけ描画し、2回目からは保存したHTMLを返す"""
+    page = PAGE_CACHE.get_or_render(page_cache_version(), (state,) + key,
+                                    functools.partial(render_screen, state, **context))
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        response = app.response_class(page.body, mimetype='text/html')
+        response.set_etag(page.etag)
+    else:
+        response = app.response_class(page.encoded[encoding], mimetype='text/html')
+        response.content_encoding = encoding
+        response.set_etag(f'{page.etag}-{encoding}')
+    response.vary.add('Accept-Encoding')
+    # 中身はセッション (名所コレクション・スコア) 次第なので共有キャッシュには載せず、毎回 ETag で確認させる
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# ★ コンパイル済みテンプレート (Jinja のバイトコード) を保存しておき、
+#    次の起動ではテンプレートの解析・コンパイルを飛ばす (元のファイルが変われば作り直される)。
+#    TEMPLATE_CACHE_DIR を指定しなければ Jinja の既定 (一時ディレクトリの下の、このユーザーだけが読み書きできる
+#    _jinja2-cache-<uid>。ほかのユーザーのものなら使わない)。指定するなら自分だけが書けるディレクトリにすること
+#    (置かれたバイトコードはそのまま実行される)。空なら使わない
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+if TEMPLATE_CACHE_DIR is None:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+elif TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, mode=0o700, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+warm_templates()
+mark_startup('templates')
+
+# ---------------------------------------------------------
+# 4. ルーティング & ゲームロジック
+# ---------------------------------------------------------
+
+# ★ 旧形式 (山札をリストで保存していた頃) のセッションキー
+LEGACY_GAME_KEYS = ['mode', 'current_station_idx', 'next_station_idx', 'score',
+                    'current_speed', 'question_deck', 'quiz_queue', 'current_quiz_idx',
+                    'question_start_time', 'total_answered_count']
+
+# ★ 名所コレクションはビットマスクで保存する (ビット位置 = LANDMARK_DATA の並び順)
+#    ※ビット位置がずれないよう、名所を増やすときは LANDMARK_DATA の末尾に追加すること
+LANDMARK_BITS = {station_idx: bit for bit, station_idx in enumerate(LANDMARK_DATA)}
+
+def load_game():
+    """セッションから進行状態を取り出す（旧形式なら変換する）。ゲーム中でなければ None"""
+    encoded = session.get('game')
+    if encoded:
+        with span('state'):
+            state = decode_state(encoded)
+            if state is not None:
+                attach_bank(state)
+                if state.adaptive and state.leg_positions is None:
+                    attach_adaptive_leg(state)
+        return state
+    if 'quiz_queue' in session:
+        bank = BANKS.current
+        state = migrate_legacy_session(session, random.getrandbits(32), len(bank.bank))
+        state.bank_version = bank.version
+        BANKS.acquire(bank)
+        for key in LEGACY_GAME_KEYS:
+            session.pop(key, None)
+        save_game(state)
+        return state
+    return None
+
+def journey_bank(state):
+    """旅の版の問題集 (BankVersion)"""
+    return BANKS.get(state.bank_version) or BANKS.current
+
+def attach_bank(state):
+    """旅の版の問題集を探して、絞り込み後の山札 (state.deck) を設定する"""
+    bank = BANKS.find(state.bank_version) if state.bank_version else None
+    if bank is None and not state.bank_version:
+        # 版の番号を持たない古いセッション: 山札の大きさが合えば今の版の旅として続ける
+        current = BANKS.current
+        deck = current.filtered_deck(state.round_mask, state.category_mask)
+        if state.deck_size == (len(current.bank) if deck is None else len(deck)):
+            bank = current
+            state.bank_version = bank.version
+    if bank is None:
+        rebase_journey(state)
+        return
+    if state.round_mask or state.category_mask:
+        state.deck = bank.filtered_deck(state.round_mask, state.category_mask)
+
+def rebase_journey(state):
+    """旅の版の問題集がもうない (読み直しの後に起動したワーカー・放置されていた旅など) 場合に、今の版で続ける
+
+    現在地・スコア・山札を引いた割合はそのままに、今の版の山札で区間の問題を引き直す。
+    山札の並びは作り直しになるので、前の版で出題済みの問題がもう一度出ることがある。
+    """
+    bank = BANKS.current
+    deck = bank.filtered_deck(state.round_mask, state.category_mask)
+    if deck is not None and len(deck) == 0:
+        state.round_mask = state.category_mask = 0
+        deck = None
+    size = len(bank.bank) if deck is None else len(deck)
+    record_event('rebase', game=state.seed, from_bank=state.bank_version, to_bank=bank.version,
+                 deck_size=size, cursor=state.cursor)
+    state.cursor = min(size, state.leg_start * size // max(1, state.deck_size))
+    state.deck_size, state.deck, state.bank_version = size, deck, bank.version
+    state.leg_positions = None
+    if state.adaptive:
+        # 前の版の山札位置は使えないので、山札の状態も新しいハンドルで始め直す
+        state.deck_handle = ADAPTIVE_DECKS.new_handle()
+        state.clear_drawn()
+    BANKS.acquire(bank)
+    prepare_next_leg_questions(state)
+
+def attach_adaptive_leg(state):
+    """(苦手克服モード) 今の区間の山札位置をハンドルで引く
+
+    行が消えていたら (ttl を過ぎてから再開した旅など)、同じ問題数で区間を選び直す。
+    """
+    positions = ADAPTIVE_DECKS.leg(state.deck_handle, state.leg_start) if state.deck_handle else None
+    if positions is not None and len(positions) == state.leg_len:
+        state.leg_positions = positions
+        return
+    if not state.deck_handle:
+        state.deck_handle = ADAPTIVE_DECKS.new_handle()
+    state.drawn = ADAPTIVE_DECKS.drawn(state.deck_handle)
+    # build_leg は山札の残りから選ぶので、今の区間の分を戻してから選ぶ
+    state.cursor = state.leg_start
+    positions = build_adaptive_leg(state, state.leg_len)
+    if len(positions) == state.leg_len:
+        # 区間の途中 (何問目か・再出題待ち) はそのまま続ける
+        state.cursor += state.leg_len
+        state.mark_drawn(positions)
+        state.leg_positions = positions
+    else:
+        state.set_leg(positions)
+    ADAPTIVE_DECKS.save_leg(state.deck_handle, state.leg_start, state.leg_positions, state.drawn)
+
+def release_journey():
+    """進行中の旅をセッションから消し、その版の参照を返す (ゴール済みの旅は record_completion で返している)"""
+    encoded = session.pop('game', None)
+    state = decode_state(encoded) if encoded else None
+    if state is not None and state.bank_version and session.get('completed') != state.seed:
+        BANKS.release(state.bank_version)
+
+def save_game(state, started=False):
+    with span('state'):
+        session['game'] = encode_state(state)
+    # プロフィールがあれば旅の続きとして覚える (ゴール済みの旅は覚えない)
+    player_id, _ = current_player()
+    if player_id is not None and session.get('completed') != state.seed:
+        PROFILES.save_journey(player_id, session['game'], state.mode, state.current_station_idx, state.score,
+                              session.get('offline', False), started=started)
+    report_race_position(state)
+
+def get_landmark_mask():
+    if 'collected_landmarks' in session:
+        # 旧形式 (駅番号の文字列リスト) をビットマスクへ変換
+        mask = session.get('landmarks', 0)
+        for l_id in session.pop('collected_landmarks'):
+            bit = LANDMARK_BITS.get(int(l_id))
+            if bit is not None:
+                mask |= 1 << bit
+        session['landmarks'] = mask
+    return session.get('landmarks', 0)
+
+def collected_landmark_ids():
+    """テンプレート用: 収集済みの名所の駅番号 (文字列) のリスト"""
+    mask = get_landmark_mask()
+    return [str(station_idx) for station_idx, bit in LANDMARK_BITS.items() if mask >> bit & 1]
+
+@app.route('/')
+def index():
+    # ★修正: タイトルに戻ったら、コレクション以外のゲーム進行データをきれいサッパリ忘れるようにします！
+    release_journey()
+    session.pop('completed', None)
+    session.pop('ranks', None)
+    session.pop('race', None)
+    for key in LEGACY_GAME_KEYS:
+        session.pop(key, None)
+
+    # ★ プロフィールがあれば、別の端末・消えた Cookie の分の名所コレクションと復習表 (のキー) を取り戻す
+    player_id, profile = current_player()
+    resume = None
+    if profile is not None:
+        if profile['landmarks'] & ~get_landmark_mask():
+            session['landmarks'] = get_landmark_mask() | profile['landmarks']
+        if ADAPTIVE_DECKS.is_review_key(profile['review']) and not ADAPTIVE_DECKS.is_review_key(session.get('review')):
+            session['review'] = profile['review']
+        if profile['journey']:
+            resume = (STATION_DATA[profile['journey_station']]['name'], profile['journey_mode'], profile['journey_score'])
+    player = None if profile is None else (profile['games_completed'], profile['best_score'])
+
+    mask = get_landmark_mask()
+    collected = collected_landmark_ids()
+    # ★ 初期値は「みずほ」(0)
+    # 名所コレクション (最大256通り)・問題集の版・プロフィールの表示内容で決まるので、描画済みのページを使い回す
+    bank = BANKS.current
+    return render_cached_screen('menu', (mask, bank.version, player, resume, races_enabled()), current_speed=0, all_landmarks=LANDMARK_DATA, collected=collected, total_questions=len(bank.bank), express_name=get_express_name(0),
+                         round_counts=bank.round_counts, category_counts=bank.category_counts, category_labels=CATEGORY_LABELS,
+                         player=player, resume=resume, race_enabled=races_enabled())
+
+@app.route('/player', methods=['GET', 'POST'])
+def player_profile():
+    """POST: プロフィールを作る (今の名所コレクションと復習表を引き継ぐ)。GET: プロフィールと完走の記録 (JSON)"""
+    player_id, profile = current_player()
+    if request.method == 'POST':
+        if player_id is None:
+            player_id = PROFILES.create(landmarks=get_landmark_mask(), review=session.get('review'))
+        response = redirect(url_for('index'))
+        response.set_cookie(PLAYER_COOKIE, player_id, max_age=PLAYER_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+        return response
+    if profile is None:
+        abort(404)
+    journey = None
+    if profile['journey']:
+        journey = dict(station=STATION_DATA[profile['journey_station']]['name'], mode=profile['journey_mode'],
+                       score=profile['journey_score'])
+    return jsonify(landmarks=collected_landmark_ids(), games_started=profile['games_started'],
+                   games_completed=profile['games_completed'], best_score=profile['best_score'],
+                   journey=journey, history=PROFILES.history(player_id))
+
+@app.route('/resume', methods=['POST'])
+def resume_journey():
+    """プロフィールに残っている旅の続きから再開する (プロフィールの1行だけで復元できる)
+
+    問題集が読み直されて旅の版がもうなければ、load_game (attach_bank) で今の版に移して続ける。
+    """
+    player_id, profile = current_player()
+    if profile is None or not profile['journey']:
+        return redirect(url_for('index'))
+    state = decode_state(profile['journey'])
+    if state is None:
+        PROFILES.update(player_id, journey=None, journey_mode=None, journey_station=None, journey_score=None)
+        return redirect(url_for('index'))
+
+    release_journey()
+    bank = BANKS.find(state.bank_version) if state.bank_version else None
+    if bank is not None:
+        BANKS.acquire(bank)
+    session['game'] = profile['journey']
+    session['offline'] = bool(profile['offline'])
+    session.pop('completed', None)
+    session.pop('race', None)
+    record_event('resume', game=state.seed, mode=state.mode, station=state.current_station_idx,
+                 score=state.score, total_answered=state.total_answered)
+    return redirect(url_for('play'))
+
+@app.route('/start', methods=['POST'])
+def start_game():
+    # ★修正: フォームの値に変な空白が入っていても除去して受け取るように修正
+    # 選ばれたモードは /metrics の shinkansen_games_started_total{mode=...} で数える
+    raw_mode = request.form.get('mode')
+
+    if raw_mode:
+        mode = raw_mode.strip()
+    else:
+        mode = 'shinkansen' # デフォルト
+    if mode not in MODE_CODES:
+        abort(400)
+
+    # ★ オフライン区間モード (区間の問題をまとめて先読み) の希望
+    session['offline'] = request.form.get('offline') == '1'
+    session.pop('race', None)
+    round_mask, category_mask = requested_filters()
+    return begin_journey(mode, random.getrandbits(32), round_mask, category_mask,
+                         adaptive=request.form.get('adaptive') == '1')
+
+def requested_filters():
+    """★ 出題範囲の絞り込み (未選択ならその軸は全問)。該当する問題がなければ全問で出発"""
+    bank = BANKS.current
+    rounds = [int(r) for r in request.form.getlist('round') if r.isdigit()]
+    round_mask = keys_to_mask(rounds, bank.round_choices)
+    category_mask = keys_to_mask(request.form.getlist('category'), bank.category_choices)
+    deck = bank.filtered_deck(round_mask, category_mask)
+    if deck is not None and len(deck) == 0:
+        return 0, 0
+    return round_mask, category_mask
+
+def begin_journey(mode, seed, round_mask, category_mask, adaptive=False, race=None):
+    """新しい旅を始めて出題画面へ (今の版の問題集で)"""
+    release_journey()
+    bank = BANKS.current
+    deck = bank.filtered_deck(round_mask, category_mask)
+    # ★完走型ロジックの核：問題IDの山札（Deck）をシャッフル
+    #   山札そのものは保存せず、シャッフルのシードだけを持つ
+    state = GameState(mode, seed, len(bank.bank) if deck is None else len(deck))
+    state.round_mask, state.category_mask, state.deck = round_mask, category_mask, deck
+    state.bank_version = bank.version
+    BANKS.acquire(bank)
+    state.adaptive = adaptive
+    if adaptive:
+        state.deck_handle = ADAPTIVE_DECKS.new_handle()
+        state.clear_drawn()
+    ENGINE.start(state)
+
+    # 最初の区間の問題を取得
+    prepare_next_leg_questions(state)
+
+    state.question_start_time = time.time()
+    save_game(state, started=True)
+    GAMES_STARTED.inc(mode)
+    record_event('start', game=state.seed, mode=mode, bank=bank.version, deck_size=state.deck_size, round_mask=round_mask,
+                 category_mask=category_mask, offline=session['offline'], adaptive=adaptive, race=race)
+    return redirect(url_for('play'))
+
+# ★ レースモード: 同じ部屋の全員が同じシードの山札で出発し、互いの現在地を SSE で受け取る
+#    位置は RACE_TICK 秒ごとにまとめて配信する (部屋はプロセス内にだけあるので、ワーカー1つ + gevent で動かす)
+#    gunicorn.conf.py がワーカーの構成を見て RACE_ENABLED を決める。0 の構成では /race* を 503 で断る
+RACES = RaceBroadcaster(tick=float(os.environ.get('RACE_TICK', 0.25)),
+                        max_racers=int(os.environ.get('RACE_MAX_RACERS', 500)))
+RACE_UNAVAILABLE = ('このサーバーの構成 (複数ワーカー、または同期ワーカー) ではレースモードを使えません。'
+                    'レースモードを使う場合は GUNICORN_RACES=1 (gevent のワーカー1つ) で起動してください')
+
+def races_enabled():
+    return os.environ.get('RACE_ENABLED', '1') == '1'
+
+def require_races():
+    if not races_enabled():
+        abort(503, description=RACE_UNAVAILABLE)
+
+@app.route('/race', methods=['POST'])
+def create_race():
+    """部屋を作って、自分も乗る"""
+    require_races()
+    mode = request.form.get('race_mode', 'shinkansen')
+    if mode not in MODE_CODES:
+        abort(400)
+    round_mask, category_mask = requested_filters()
+    room = RACES.create_room(random.getrandbits(32), mode, round_mask, category_mask)
+    if room is None:
+        abort(503)
+    return board_race(room)
+
+@app.route('/race/join', methods=['POST'])
+def join_race():
+    require_races()
+    room = RACES.room(request.form.get('code', '').strip())
+    if room is None:
+        return redirect(url_for('index'))
+    return board_race(room)
+
+def board_race(room):
+    racer_id = RACES.join(room, request.form.get('name', '').strip())
+    if racer_id is None:
+        return redirect(url_for('index'))
+    session['race'] = [room.code, racer_id]
+    session['offline'] = False
+    return begin_journey(room.mode, room.seed, room.round_mask, room.category_mask, race=room.code)
+
+def report_race_position(state, finished=False):
+    """レース中なら自分の現在地を部屋に知らせる (配信は次の tick でまとめて)"""
+    race = session.get('race')
+    room = RACES.room(race[0]) if race else None
+    if room is None:
+        return
+    RACES.update(room, race[1], station=STATION_DATA[state.current_station_idx]['name'],
+                 next_station=STATION_DATA[state.next_station_idx]['name'], station_idx=state.current_station_idx,
+                 progress=round(min(state.quiz_idx / max(1, state.queue_length()), 1.0), 3),
+                 speed=round(state.current_speed), score=state.score, finished=finished)
+
+@app.route('/race/<code>')
+def race_status(code):
+    require_races()
+    room = RACES.room(code)
+    if room is None:
+        abort(404)
+    return jsonify(room.snapshot())
+
+@app.route('/race/<code>/events')
+def race_events(code):
+    require_races()
+    room = RACES.room(code)
+    if room is None:
+        abort(404)
+    last_version = request.headers.get('Last-Event-ID', 0, type=int)
+    response = app.response_class(RACES.stream(room, last_version), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'   # nginx の後ろでも溜めずに流す
+    return response
+
+def prepare_next_leg_questions(state):
+    """山札から次の区間分の問題を取り出す"""
+    count = ENGINE.leg_size(state.mode)
+    # デッキから取り出す（足りない場合はあるだけ取り出す）
+    with span('deck'):
+        if state.adaptive:
+            # ★ 苦手克服モード: 復習日が来た問題と、間違えやすい問題を多めに選ぶ
+            #    選んだ山札位置と出題済みのビットマップはサーバー側に書き、セッションにはハンドルだけを残す
+            if state.drawn is None:
+                state.drawn = ADAPTIVE_DECKS.drawn(state.deck_handle)
+            state.set_leg(build_adaptive_leg(state, count))
+            ADAPTIVE_DECKS.save_leg(state.deck_handle, state.leg_start, state.leg_positions, state.drawn)
+        else:
+            state.draw_leg(count)
+
+def build_adaptive_leg(state, count):
+    schedule = ADAPTIVE_DECKS.review(session.get('review'))
+    return build_leg(state, count, adaptive_sampler(state), schedule, today(), random,
+                     journey_bank(state).index_of_key)
+
+def nozomi_disabled_indices(mode, question):
+    """★ 追加: 超特急のぞみモードなら、選択肢を2択にする（消す3つのインデックスを返す）"""
+    if mode != 'nozomi':
+        return []
+    # 正解のインデックス(0始まり)を取得
+    correct_idx_zero = question['answer_idx'] - 1
+    # 正解以外のインデックス(0-4)のリストを作成
+    others = [i for i in range(5) if i != correct_idx_zero]
+    # その中からランダムに3つ選ぶ
+    return random.sample(others, 3)
+
+def quiz_context(state):
+    """出題画面 (quiz) に渡す値を組み立てる。play と JSON API で共用"""
+    current_st_idx = state.current_station_idx
+    state.question_start_time = time.time()
+
+    # ★修正: 山札の位置からマスターデータの問題を取得
+    with span('deck'):
+        q_index = state.current_question_index()
+        current_question = journey_bank(state).bank[q_index]
+
+    disabled_indices = nozomi_disabled_indices(state.mode, current_question)
+
+    # ★ モードラベルの動的生成
+    express_name = get_express_name(current_st_idx)
+    mode_label = "各駅停車" if state.mode == 'shinkansen' else f"超特急{express_name}"
+
+    return dict(
+        question=current_question,
+        mode_label=mode_label, # ★修正
+        current_station=STATION_DATA[current_st_idx]['name'],
+        next_station=STATION_DATA[state.next_station_idx]['name'],
+        score=state.score,
+        progress=(state.quiz_idx / state.queue_length()) * 100,
+        current_speed=state.current_speed,
+        landmark=LANDMARK_DATA.get(current_st_idx),
+        landmark_id=current_st_idx,
+        total_questions=state.deck_size,
+        total_answered=state.total_answered + 1,
+        disabled_indices=disabled_indices,
+        offline_mode=session.get('offline', False),
+        race=session.get('race'),
+    )
+
+@app.route('/play')
+def play():
+    state = load_game()
+    if state is None: return redirect(url_for('index'))
+    idx = state.quiz_idx
+
+    # 区間クリア判定
+    if ENGINE.leg_finished(state):
+        # もしデッキも空なら、ゲームクリア（ゴール）へ
+        if state.deck_remaining() == 0:
+             return render_goal(state)
+
+        # 現在の駅が「のぞみ停車駅」かどうかを判定してテンプレートへ渡す
+        current_station_data = STATION_DATA[state.next_station_idx]
+        is_nozomi_station = current_station_data['is_nozomi']
+
+        # ★ 次の区間の列車名を取得（到着した駅＝次の出発駅）
+        express_name = get_express_name(state.next_station_idx)
+
+        return render_cached_screen('station_arrival',
+            (state.next_station_idx, state.score, state.deck_size, state.total_answered),
+            current_station=current_station_data['name'],
+            score=state.score, current_speed=0, total_questions=state.deck_size, total_answered=state.total_answered,
+            is_nozomi_station=is_nozomi_station,
+            express_name=express_name # ★追加
+        )
+
+    context = quiz_context(state)
+    save_game(state)
+    return render_screen('quiz', **context)
+
+# 判定画面を表示している秒数 (judgement.html / quiz.html のタイマーと合わせる)
+VERDICT_DISPLAY_SECONDS = 1.5
+
+def wants_json():
+    """fetch から Accept: application/json で呼ばれた場合は API モードで応答する"""
+    return request.accept_mimetypes.best == 'application/json'
+
+def collect_landmark(station_idx):
+    """駅の名所をコレクションに加える。新たに取得した場合はその名前を返す"""
+    landmark_bit = LANDMARK_BITS.get(station_idx)
+    if landmark_bit is None:
+        return None
+    mask = get_landmark_mask()
+    if mask >> landmark_bit & 1:
+        return None
+    session['landmarks'] = mask | (1 << landmark_bit)
+    return LANDMARK_DATA[station_idx]['name']
+
+def record_answer(event):
+    """apply_answer が返した回答イベントを集計・記録する"""
+    ANSWERS.inc(event['mode'], 'correct' if event['correct'] else 'wrong')
+    # 問題ごとの成績は今の版の問題番号で数える (古い版の旅の回答は番号を直す。今の版にない問題は数えない)
+    bank = BANKS.get(event['bank'])
+    stats_index = event['q_index'] if bank is None else bank.current_index(event['q_index'])
+    if stats_index is not None:
+        QUESTION_STATS.record(stats_index, event['choice'], event['correct'], event['elapsed'])
+    ADAPTIVE_POPULATION.record(event['qid'], event['correct'])
+    if event['adaptive']:
+        # 苦手克服モードでは、本人の復習表 (次の旅以降に出し直す問題) も更新する
+        #    表はサーバー側に置き、セッション (とプロフィール) には表のキーだけを持たせる
+        schedule = ADAPTIVE_DECKS.review(session.get('review'))
+        if schedule.record(question_key(event['qid']), event['correct'], today()):
+            if not ADAPTIVE_DECKS.is_review_key(session.get('review')):
+                session['review'] = ADAPTIVE_DECKS.new_review_key()
+            ADAPTIVE_DECKS.save_review(session['review'], schedule)
+    record_event('answer', **event)
+
+def record_completion(state):
+    """ゴール到着を数える (ゴール画面の再読み込みで二重に数えないよう、旅のシードを覚えておく)"""
+    if session.get('completed') != state.seed:
+        session['completed'] = state.seed
+        BANKS.release(state.bank_version)
+        GAMES_COMPLETED.inc(state.mode)
+        record_event('goal', game=state.seed, mode=state.mode, station=state.current_station_idx,
+                     score=state.score, total_answered=state.total_answered, play_time=round(state.play_time, 1))
+        player_id, _ = current_player()
+        if player_id is not None:
+            PROFILES.finish_journey(player_id, state.seed, state.mode, state.score, state.total_answered)
+        # ランキングに載せ、その時点の順位を覚えておく (ゴール画面に出す)
+        # オフライン区間で遊んだ旅は端末で採点できてしまうので載せない
+        if state.unranked:
+            session.pop('ranks', None)
+        else:
+            ranks = LEADERBOARD.record(state.mode, state.round_mask, state.category_mask, state.score,
+                                       state.total_answered, state.play_time, player_id)
+            session['ranks'] = [ranks['accuracy'], ranks['time'], ranks['total']]
+        report_race_position(state, finished=True)
+
+def render_goal(state):
+    record_completion(state)
+    ranks = tuple(session.get('ranks') or ())
+    board = (state.mode, state.round_mask, state.category_mask)
+    return render_cached_screen('goal', (state.score, state.total_answered, ranks, state.unranked, board),
+                                score=state.score, total_answered=state.total_answered, ranks=ranks,
+                                unranked=state.unranked,
+                                leaderboard_url=url_for('leaderboard', mode=state.mode, rounds=state.round_mask,
+                                                        categories=state.category_mask))
+
+def apply_answer(state, choice, client_speed, got_landmark_flag, elapsed=None, source='online'):
+    """回答を採点して状態に反映する。(正誤, 問題, 新しい速度, 新たに取得した名所, 回答イベント) を返す"""
+    # ★修正: 山札の位置から問題を取得
+    with span('deck'):
+        q_index = state.current_question_index()
+        current_q = journey_bank(state).bank[q_index]
+
+    if elapsed is None:
+        elapsed = time.time() - (state.question_start_time or time.time())
+    elapsed = max(0.0, elapsed)
+    is_correct = (choice == current_q['answer_idx'])
+    # ★ 加速・減速と再出題 (不正解ならキューの末尾に追加) は game_engine.py
+    current_speed = ENGINE.answer(state, is_correct, client_speed, elapsed)
+
+    new_landmark = None
+    if got_landmark_flag == "1":
+        new_landmark = collect_landmark(state.current_station_idx)
+
+    event = dict(game=state.seed, mode=state.mode, adaptive=state.adaptive, bank=state.bank_version, qid=current_q['id'], q_index=q_index, choice=choice,
+                 correct=is_correct, elapsed=round(elapsed, 3), speed=current_speed,
+                 station=state.current_station_idx, next_station=state.next_station_idx, source=source)
+    return is_correct, current_q, current_speed, new_landmark, event
+
+@app.route('/answer', methods=['POST'])
+def answer():
+    choice = int(request.form.get('choice'))
+    client_speed = int(request.form.get('client_speed', 0))
+    got_landmark_flag = request.form.get('got_landmark', '0')
+    state = load_game()
+    if state is None or ENGINE.leg_finished(state):
+        if wants_json(): return jsonify(redirect=url_for('play'))
+        return redirect(url_for('play'))
+
+    is_correct, current_q, current_speed, new_landmark, event = apply_answer(
+        state, choice, client_speed, got_landmark_flag, source='json' if wants_json() else 'online')
+    record_answer(event)
+    correct_answer_text = current_q['options'][current_q['answer_idx']-1]
+
+    if wants_json():
+        # ★ APIモード: 判定と次の問題を1回の応答で返す（/next と /play を省略）
+        state.advance()
+        payload = dict(
+            correct=is_correct,
+            correct_answer_text=correct_answer_text,
+            speed=current_speed,
+            score=state.score,
+            total_answered=state.total_answered,
+            landmark=new_landmark,
+            next=None,
+        )
+        if not ENGINE.leg_finished(state):
+            context = quiz_context(state)
+            # 判定の表示が終わってから次の問題が見えるので、その分だけ計測開始を遅らせる
+            state.question_start_time += VERDICT_DISPLAY_SECONDS
+            question = context['question']
+            payload['next'] = dict(
+                id=question['id'],
+                question=question['question'],
+                options=question['options'],
+                disabled_indices=context['disabled_indices'],
+                progress=context['progress'],
+                total_answered=context['total_answered'],
+            )
+        else:
+            # 区間終了（駅到着・ゴール）は通常の画面遷移に任せる
+            payload['redirect'] = url_for('play')
+        save_game(state)
+        return jsonify(payload)
+
+    save_game(state)
+    return render_screen('judgement',
+        is_correct=is_correct,
+        correct_answer_text=correct_answer_text,
+        current_speed=current_speed,
+        total_questions=state.deck_size,
+        total_answered=state.total_answered
+    )
+
+# ★ オフライン区間モード: 区間の問題をまとめてダウンロードし、端末側で採点する
+#   (トンネル内など通信できない区間でも遊べる。結果は駅到着時に1回で送信)
+#   正答を端末に渡すので、一度でも区間を渡した旅はランキングに載せない (GameState.unranked)。
+#   回答時間は端末の値を信用せず、区間を渡してから結果を受け取るまでの時間をサーバーで測って割り振る
+MAX_OFFLINE_ELAPSED = 600
+
+@app.route('/leg_bundle')
+def leg_bundle():
+    """現在の区間で残っている問題を、正答・2択マスク付きでまとめて返す"""
+    state = load_game()
+    if state is None or ENGINE.leg_finished(state):
+        return jsonify(redirect=url_for('play')), 409
+
+    # 区間を最初に渡した時刻を覚えておく (取り直しても、同じ区間・同じ位置なら最初の時刻のまま)
+    issued = session.get('bundle')
+    if not issued or issued[:3] != [state.seed, state.leg_start, state.quiz_idx]:
+        session['bundle'] = [state.seed, state.leg_start, state.quiz_idx, time.time()]
+    if not state.unranked:
+        state.unranked = True
+        save_game(state)
+
+    obfuscate = request.args.get('obfuscate', '1') == '1'
+    bank = journey_bank(state).bank
+    questions, answers, salts = [], [], []
+    for idx in range(state.quiz_idx, state.queue_length()):
+        question = bank[state.question_index(idx)]
+        questions.append(dict(
+            id=question['id'],
+            question=question['question'],
+            options=question['options'],
+            disabled_indices=nozomi_disabled_indices(state.mode, question),
+        ))
+        # 正答はそのまま載せず、問題ごとの乱数で XOR しておく（画面を覗かれても分からない程度の難読化）
+        salt = random.randrange(256) if obfuscate else 0
+        salts.append(salt)
+        answers.append(question['answer_idx'] ^ salt)
+
+    return jsonify(
+        leg=state.leg_start,
+        start=state.quiz_idx,
+        mode=state.mode,
+        questions=questions,
+        answers=answers,
+        salts=salts,
+        speed=state.current_speed,
+        speed_rule=ENGINE.speed.params(),
+        score=state.score,
+        total_answered=state.total_answered,
+    )
+
+@app.route('/leg_result', methods=['POST'])
+def leg_result():
+    """オフラインで解いた結果をまとめて受け取り、サーバー側で採点し直して反映する"""
+    data = request.get_json(silent=True) or {}
+    state = load_game()
+    # 別の区間の結果・送信済みの結果 (再送) は反映しない
+    if state is None or data.get('leg') != state.leg_start or data.get('start') != state.quiz_idx:
+        return jsonify(ok=False, redirect=url_for('play')), 409
+
+    # このセッションに渡していない区間の結果は受け取らない
+    issued = session.get('bundle')
+    if not issued or issued[:3] != [state.seed, state.leg_start, state.quiz_idx]:
+        return jsonify(ok=False, redirect=url_for('play')), 409
+
+    results = data.get('results')
+    if not isinstance(results, list) or not results:
+        return jsonify(ok=False, error='results がありません'), 400
+
+    got_landmark = False
+    events = []
+    bank = journey_bank(state).bank
+    # 区間を渡してから今までの時間を、端末が送ってきた回答時間の比で各回答に割り振る (端末の値は比にだけ使う)
+    window = max(0.0, time.time() - issued[3])
+    try:
+        reported = [max(float(result.get('elapsed', 0)), 0.0) for result in results]
+        total = sum(reported)
+        for result, claimed in zip(results, reported):
+            if ENGINE.leg_finished(state):
+                raise ValueError('区間の問題数を超えています')
+            expected = bank[state.current_question_index()]
+            if result.get('id') != expected['id']:
+                raise ValueError(f"出題順が一致しません: {result.get('id')}")
+            elapsed = min(window * claimed / total if total > 0 else window / len(results), MAX_OFFLINE_ELAPSED)
+            # 速度はクライアントの値ではなく、サーバー側で積み上げた値から計算する
+            events.append(apply_answer(state, int(result['choice']), state.current_speed, '0',
+                                       elapsed=elapsed, source='offline')[-1])
+            got_landmark = got_landmark or result.get('got_landmark') == 1
+            state.advance()
+    except (ValueError, TypeError, KeyError) as e:
+        # 途中まで反映した状態は保存しない
+        return jsonify(ok=False, error=str(e)), 400
+
+    session.pop('bundle', None)
+    for event in events:
+        record_answer(event)
+    if got_landmark:
+        collect_landmark(state.current_station_idx)
+    save_game(state)
+    return jsonify(ok=True, score=state.score, speed=state.current_speed,
+                   total_answered=state.total_answered, redirect=url_for('play'))
+
+@app.route('/next', methods=['POST'])
+def next_question():
+    state = load_game()
+    if state is not None:
+        state.advance()
+        save_game(state)
+    return redirect(url_for('play'))
+
+@app.route('/depart', methods=['POST'])
+def depart():
+    state = load_game()
+    if state is None: return redirect(url_for('index'))
+
+    # ★モード変更の処理（フォームから送信された場合のみ更新）
+    # 着いた駅から、更新されたモードで次の目的地へ (終点・問題切れならゴール)
+    mode = request.form.get('mode')
+    if mode and mode not in MODE_CODES:
+        abort(400)
+    if not ENGINE.depart(state, mode):
+        save_game(state)
+        return render_goal(state)
+
+    # 次の問題セット補充（デッキから引く）
+    prepare_next_leg_questions(state)
+
+    save_game(state)
+    record_event('depart', game=state.seed, mode=state.mode, station=state.current_station_idx,
+                 next_station=state.next_station_idx, score=state.score, total_answered=state.total_answered)
+    return redirect(url_for('play'))
+
+# ★ 問題別の成績: 間違えやすい問題から順に表示する (回・区分で絞り込み、並べ替えができる)
+STATS_SORT_LABELS = {'miss_rate': '正答率が低い順', 'elapsed': '時間がかかる順', 'attempts': '回答数が多い順',
+                     'round': '回ごと', 'category': '区分ごと'}
+
+@app.route('/stats')
+def stats():
+    rounds = [int(r) for r in request.args.getlist('round') if r.isdigit()]
+    categories = request.args.getlist('category')
+    sort = request.args.get('sort', 'miss_rate')
+    if sort not in SORT_KEYS:
+        sort = 'miss_rate'
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    min_attempts = max(request.args.get('min_attempts', 1, type=int), 1)
+
+    # このワーカーの増分は書き出してから読む (他のワーカーの分は最大 STATS_FLUSH_INTERVAL 秒遅れる)
+    QUESTION_STATS.flush(describe_question)
+    rows = hardest_questions(STATS_DB_PATH, rounds, categories, sort, min_attempts, limit)
+    bank = BANKS.current
+    for row in rows:
+        idx = row['q_index']
+        question = bank.bank[idx] if 0 <= idx < len(bank.bank) else None
+        if question is not None and question['id'] == row['qid']:
+            row['question'], row['answer_idx'] = question['question'], question['answer_idx']
+        else:
+            row['question'], row['answer_idx'] = '', None
+
+    if wants_json() or request.args.get('format') == 'json':
+        return jsonify(sort=sort, rounds=rounds, categories=categories, questions=rows)
+    return render_template('stats.html', rows=rows, rounds=rounds, categories=categories, sort=sort,
+                           sort_labels=STATS_SORT_LABELS, round_counts=bank.round_counts,
+                           category_counts=bank.category_counts, category_labels=CATEGORY_LABELS)
+
+# ★ ランキング: モード・出題範囲 (rounds / categories はビットマスク) ごとの上位と件数
+@app.route('/leaderboard')
+def leaderboard():
+    mode = request.args.get('mode', 'shinkansen')
+    if mode not in MODE_CODES:
+        mode = 'shinkansen'
+    metric = request.args.get('metric', 'accuracy')
+    if metric not in LEADERBOARD_METRIC_LABELS:
+        metric = 'accuracy'
+    round_mask = request.args.get('rounds', 0, type=int)
+    category_mask = request.args.get('categories', 0, type=int)
+    count = min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+    rows = LEADERBOARD.top(mode, round_mask, category_mask, metric, count)
+    total = LEADERBOARD.size(mode, round_mask, category_mask)
+    bank = BANKS.current
+    rounds, categories = mask_to_keys(round_mask, bank.round_choices), mask_to_keys(category_mask, bank.category_choices)
+    if wants_json() or request.args.get('format') == 'json':
+        return jsonify(mode=mode, metric=metric, rounds=rounds, categories=categories, total=total, runs=rows)
+    scope = [f'第{r}回' for r in rounds]
+    scope += [CATEGORY_LABELS.get(c, c) for c in categories]
+    return render_template('leaderboard.html', rows=rows, total=total, mode=mode, metric=metric,
+                           mode_labels={m: MODE_LABELS.get(m, m) for m in MODE_CODES},
+                           metric_labels=LEADERBOARD_METRIC_LABELS, round_mask=round_mask,
+                           category_mask=category_mask, scope='・'.join(scope) or '全問')
+
+# ★緊急停止機能（リタイヤ）を追加
+@app.route('/emergency_stop', methods=['POST'])
+def emergency_stop():
+    state = load_game()
+    if state is None: return redirect(url_for('index'))
+    current_idx = state.current_station_idx
+
+    # 現在地より手前（過去）の「のぞみ停車駅」へ (見つからなければ始発駅) 着いた状態にし、
+    # 現在のクイズキューを終了状態にする
+    target_idx = ENGINE.emergency_stop(state)
+    save_game(state)
+    EMERGENCY_STOPS.inc()
+    record_event('emergency_stop', game=state.seed, mode=state.mode, station=current_idx, target=target_idx,
+                 score=state.score, total_answered=state.total_answered)
+
+    # play() にリダイレクトすると、区間クリア判定 (idx >= len(queue)) に引っかかり、
+    # target_idx (戻った先の駅) への到着画面が表示される
+    return redirect(url_for('play'))
+
+mark_startup('routes')
+STARTUP_TIMES['total'] = sum(STARTUP_TIMES.values())
+# 内訳は /admin/profile でも見られる (import のたびに標準出力へは出さない)
+app.logger.info('起動時間: %s', ' / '.join(f'{phase} {seconds * 1000:.1f}ms' for phase, seconds in STARTUP_TIMES.items()))
+
+if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,291 @@
+"""問題集の版とホットリロード
+
+元の CSV が書き換わったら、リクエストを処理するスレッドとは別のスレッドで問題集を作り直し、
+出来上がったら「今の版」を差し替える (参照の付け替え1回なので、読み込み中も今までの版で出題し続けられる)。
+元データの確認・読み直しは、ワーカーごとに1つの見張りスレッド (bank-watch) だけが行い、
+リクエストの処理中は今ある版を引くだけ (ファイルを確認したり読み込みを待ったりしない)。
+
+- 版の番号は元データの中身の CRC32 から作る。どのワーカーが読み込んでも同じ番号になるので、
+  旅 (GameState) に版の番号を持たせておけば、どのワーカーに来ても同じ版の問題集で問題番号を引ける
+- 旅の途中の古い版は参照カウントで残しておく: 旅を始めた時に acquire、完走・やめた時に release。
+  参照カウントはワーカーごとの目安なので (別のワーカーで始めた旅もある)、参照がなくなってから
+  grace 秒、またはどの旅からも idle_ttl 秒使われなかった古い版を捨てる
+- 捨てた版の問題集に close があれば呼ぶ (SQLite 版は版ごとの DB ファイルを消す)。
+  別のワーカーに消されて読めなくなった版 (available() が False) も捨て、その版の旅は今の版に移す
+- 古い版で答えた問題は、差し替えの時に作る「古い版の番号 -> 今の版の番号」の表 (問題 ID で対応付け) で
+  今の版の番号に直してから集計する。問題 ID -> 問題番号の索引は版ごとに1回だけ作る (BankVersion.index_of)
+"""
+import functools
+import os
+import threading
+import time
+from array import array
+
+from question_bank import filter_indices, question_key, sources_checksum
+
+
+def _rss_bytes():
+    """このプロセスの RSS (取れない環境では None)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class BankVersion:
+    """1つの版の問題集と、そこから作る索引"""
+
+    def __init__(self, version, bank):
+        self.version = version
+        self.bank = bank
+        self.round_choices = sorted(bank.round_index)
+        self.category_choices = sorted(bank.category_index)
+        self.round_counts = [(key, len(bank.round_index[key])) for key in self.round_choices]
+        self.category_counts = [(key, len(bank.category_index[key])) for key in self.category_choices]
+        self.refs = 0                        # この版で進行中の旅の数 (このワーカーで数えた分)
+        self.last_used = time.monotonic()
+        self.retired_at = None               # 今の版でなくなった時刻
+        self.to_current = None               # 問題番号 -> 今の版の問題番号 (-1: 今の版にない)
+        self.filtered_deck = functools.lru_cache(maxsize=256)(self._filtered_deck)
+        self._facets = None
+        self._ids = None
+        self._id_index = None
+        self._key_index = None
+
+    def _filtered_deck(self, round_mask, category_mask):
+        """絞り込み条件 (この版の回・区分の並びのビットマスク) に合う問題インデックスの配列。条件なしなら None"""
+        return filter_indices(self.bank,
+                              [key for bit, key in enumerate(self.round_choices) if round_mask >> bit & 1],
+                              [key for bit, key in enumerate(self.category_choices) if category_mask >> bit & 1])
+
+    def describe(self, idx):
+        """問題番号 -> (問題 ID, 回, 区分)。回・区分は索引から1回だけ表にする"""
+        if self._facets is None:
+            facets = {}
+            for round_no, indices in self.bank.round_index.items():
+                for i in indices:
+                    facets[i] = (round_no, None)
+            for category, indices in self.bank.category_index.items():
+                for i in indices:
+                    facets[i] = (facets.get(i, (None, None))[0], category)
+            self._facets = facets
+        round_no, category = self._facets.get(idx, (None, None))
+        return self.bank[idx]['id'], round_no, category
+
+    @property
+    def ids(self):
+        """問題番号順の問題 ID (版ごとに1回だけ全問を読む)"""
+        if self._ids is None:
+            self._ids = [question['id'] for question in self.bank]
+        return self._ids
+
+    def index_of(self, qid):
+        """問題 ID -> この版の問題番号 (この版にない問題なら None)"""
+        if self._id_index is None:
+            self._id_index = {qid: idx for idx, qid in enumerate(self.ids)}
+        return self._id_index.get(qid)
+
+    def index_of_key(self, key):
+        """問題のキー (question_key) -> この版の問題番号 (この版にない問題なら None)"""
+        if self._key_index is None:
+            self._key_index = {question_key(qid): idx for idx, qid in enumerate(self.ids)}
+        return self._key_index.get(key)
+
+    def current_index(self, idx):
+        """この版の問題番号を今の版の番号に直す (今の版にない問題なら None)"""
+        if self.to_current is None:
+            return idx
+        idx = self.to_current[idx] if 0 <= idx < len(self.to_current) else -1
+        return idx if idx >= 0 else None
+
+
+class BankRegistry:
+    """今の版と、旅の途中の古い版の問題集"""
+
+    def __init__(self, sources, loader, fallback=None, check_interval=2.0, grace=300.0, idle_ttl=3600.0,
+                 on_swap=None, on_reload=None, on_drain=None):
+        self.sources = sources               # () -> 元データのパスのリスト
+        self.loader = loader                 # () -> 問題集 (読めなければ例外)
+        self.check_interval = check_interval
+        self.grace = grace
+        self.idle_ttl = idle_ttl
+        self.on_swap = on_swap               # (古い版, 新しい版)。差し替える直前に呼ぶ
+        self.on_reload = on_reload           # ('ok' / 'error', 読み込み秒数, 2つの版が同時にある分のメモリ増加 (バイト) または None)
+        self.on_drain = on_drain             # (古い版が残っていた秒数)
+        self.reloads = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._versions = {}
+        self._seen = None                    # 前回の確認で見たファイルの状態 (書き込み途中を読まないため)
+        self._thread = None                  # 見張りスレッド (fork したらワーカーごとに作り直す)
+        self._pid = None
+        self._wake = threading.Event()       # 知らない版を引かれた時に、見張りスレッドをすぐ起こす
+
+        signature = self._signature()
+        try:
+            bank = loader()
+        except Exception as e:
+            if fallback is None:
+                raise
+            bank = fallback(e)
+        self.current = BankVersion(self._checksum(), bank)
+        self._versions[self.current.version] = self.current
+        self._loaded = signature
+
+    def _signature(self):
+        signature = []
+        for path in self.sources():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _checksum(self):
+        return sources_checksum(self.sources())
+
+    # --- 版を引く ---
+    def get(self, version):
+        """版の番号から BankVersion を返す。知らない版 (捨てた・まだ読んでいない) なら None"""
+        bank = self._versions.get(version)
+        if bank is not None:
+            bank.last_used = time.monotonic()
+        return bank
+
+    def find(self, version):
+        """get と同じだが、知らない版なら見張りスレッドを起こして、すぐに元データを確認させる
+
+        別のワーカーが先に新しい版を読み込み、そこで始まった旅がこのワーカーに来た場合。
+        読み込みは待たずに None を返す (その旅は今の版に移る)。
+        """
+        bank = self.get(version)
+        if bank is None:
+            self._ensure_thread()
+            self._wake.set()
+        return bank
+
+    def acquire(self, bank):
+        with self._lock:
+            bank.refs += 1
+            bank.last_used = time.monotonic()
+
+    def release(self, version):
+        with self._lock:
+            bank = self._versions.get(version)
+            if bank is not None and bank.refs > 0:
+                bank.refs -= 1
+            self._drain()
+
+    # --- 読み直し ---
+    def maybe_reload(self):
+        """このプロセスの見張りスレッドがなければ起こす (リクエストの終わりに呼ぶ。確認・読み直しはそのスレッドで)"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._watch, name='bank-watch', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _watch(self):
+        while True:
+            woken = self._wake.wait(self.check_interval)
+            self._wake.clear()
+            try:
+                self.check(force=woken)
+            except Exception:
+                self.errors += 1   # 見張りは止めない (次の確認でやり直す)
+
+    def check(self, force=False):
+        """元データを確認し、変わっていれば読み直す。古い版の片付けもここで行う
+
+        変わってから1回分の確認の間、変化が止まっているものだけ読む (書き込み途中のファイルを読まない)。
+        force: 知らない版を引かれた時 (別のワーカーが読み込み済みなので、止まるのを待たずに読む)
+        """
+        signature = self._signature()
+        stable, self._seen = signature == self._seen, signature
+        if signature != self._loaded and (stable or force):
+            self.reload()
+        elif len(self._versions) > 1:
+            with self._lock:
+                self._drain()
+
+    def reload(self):
+        """元データを読み直して今の版を差し替える。読めなければ今の版のまま (False)"""
+        with self._reload_lock:
+            signature = self._signature()
+            if signature == self._loaded:
+                return True
+            start = time.perf_counter()
+            rss_before = _rss_bytes()
+            try:
+                version = self._checksum()
+                bank = self._versions.get(version)
+                if bank is None:
+                    bank = BankVersion(version, self.loader())
+            except Exception:
+                self.errors += 1
+                self._loaded = signature   # 同じ壊れたファイルを何度も読まない (次に書き換わったら読む)
+                if self.on_reload is not None:
+                    self.on_reload('error', time.perf_counter() - start, None)
+                return False
+            self._swap(bank)
+            self._loaded = signature
+            self.reloads += 1
+            elapsed = time.perf_counter() - start
+            rss_after = _rss_bytes()
+            if self.on_reload is not None:
+                self.on_reload('ok', elapsed, None if rss_before is None or rss_after is None
+                               else max(0, rss_after - rss_before))
+            return True
+
+    def _swap(self, bank):
+        if bank is self.current:
+            return
+        # 番号の対応表はロックの外で作る (古い版は読み取り専用なので、作っている間も出題に使える)
+        # 問題 ID の並び・索引は版ごとに1回だけ作ったものを使う (問題本体は読み直さない)
+        remaps = {}
+        for other in list(self._versions.values()):
+            if other is not bank:
+                indices = (bank.index_of(qid) for qid in other.ids)
+                remaps[other.version] = array('i', [-1 if idx is None else idx for idx in indices])
+        with self._lock:
+            old = self.current
+            for other in self._versions.values():
+                if other is not bank:
+                    other.to_current = remaps.get(other.version)
+            if self.on_swap is not None:
+                self.on_swap(old, bank)
+            bank.to_current = None
+            bank.retired_at = None
+            old.retired_at = time.monotonic()
+            self._versions[bank.version] = bank
+            self.current = bank
+            self._drain()
+
+    def _drain(self):
+        """参照がなくなって grace 秒たった、または idle_ttl 秒使われていない古い版を捨てる (ロックを持って呼ぶ)"""
+        now = time.monotonic()
+        for version, bank in list(self._versions.items()):
+            if bank is self.current:
+                continue
+            idle = now - bank.last_used
+            available = getattr(bank.bank, 'available', None)
+            if (bank.refs <= 0 and idle >= self.grace) or idle >= self.idle_ttl or (available and not available()):
+                del self._versions[version]
+                close = getattr(bank.bank, 'close', None)
+                if close is not None:
+                    close()
+                if self.on_drain is not None:
+                    self.on_drain(now - bank.retired_at)
+
+    def stats(self):
+        return dict(version=self.current.version, reloads=self.reloads, errors=self.errors,
+                    versions=[dict(version=bank.version, questions=len(bank.bank), refs=bank.refs)
+                              for bank in list(self._versions.values())])
@@ -0,0 +1,117 @@
+"""問題集のメモリ使用量レポート
+
+旧形式 (dict + 選択肢リストのリスト) と QuestionBank について、
+1問あたりのバイト数 (tracemalloc) とプロセス全体の RSS を、
+現在の問題集と合成した大規模問題集 (既定 10万問 / 20万問) で比較する。
+RSS は条件ごとに子プロセスを起動して測る。
+
+    python bench/bank_footprint.py [問題数 ...]
+"""
+import csv
+import os
+import random
+import subprocess
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from question_bank import QuestionBank  # noqa: E402
+
+CSV_PATH = os.path.join(ROOT, '67-76_hissu_004.csv')
+
+
+def read_rows():
+    with open(CSV_PATH, encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [row for row in reader if len(row) >= 11]
+
+
+def synthetic_rows(size):
+    """実際の問題文・選択肢を組み合わせて size 問の問題集を作る (問題文は1問ずつ別の文字列)"""
+    rows = read_rows()
+    rng = random.Random(size)
+    options = [opt for row in rows for opt in row[5:10]]
+    result = []
+    for i in range(size):
+        base = rows[i % len(rows)]
+        qid = f"{base[1]}-{base[2]}-{i:06d}"
+        result.append(['', base[1], base[2], qid, f"{base[4]} (#{i})"] +
+                      [rng.choice(options) for _ in range(5)] + [str(rng.randint(1, 5))])
+    return result
+
+
+def build_legacy(rows):
+    return [{"id": row[3], "question": row[4], "options": [row[5], row[6], row[7], row[8], row[9]],
+             "answer_idx": int(row[10])} for row in rows]
+
+
+def build_compact(rows):
+    bank = QuestionBank()
+    for row in rows:
+        bank.add(row[3], row[4], row[5:10], int(row[10]))
+    return bank
+
+
+BUILDERS = {'legacy': build_legacy, 'compact': build_compact}
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # /proc がない環境 (macOS 等) では最大 RSS で代用
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_rows(size):
+    return read_rows() if size == 0 else synthetic_rows(size)
+
+
+def child(kind, size):
+    """子プロセス: 問題集を1つ作り、RSS 増分を出力する"""
+    before = rss_bytes()
+    rows = load_rows(size)
+    bank = BUILDERS[kind](rows)
+    del rows
+    print(rss_bytes() - before, rss_bytes(), len(bank))
+
+
+def measure_bytes(kind, size):
+    # 文字列も含めて、問題集が保持し続けるメモリだけを数える (一時的な行データは捨てる)
+    tracemalloc.start()
+    rows = load_rows(size)
+    bank = BUILDERS[kind](rows)
+    del rows
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, len(bank)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        child(sys.argv[2], int(sys.argv[3]))
+        return
+
+    sizes = [0] + [int(arg) for arg in sys.argv[1:]] if len(sys.argv) > 1 else [0, 100_000, 200_000]
+    print(f"{'bank':<12}{'format':<9}{'questions':>10}{'bytes/q':>10}{'heap(MB)':>10}{'RSS delta(MB)':>15}{'RSS(MB)':>9}")
+    for size in sizes:
+        for kind in BUILDERS:
+            heap, count = measure_bytes(kind, size)
+            out = subprocess.run([sys.executable, __file__, '--child', kind, str(size)],
+                                 capture_output=True, text=True, check=True).stdout.split()
+            rss_delta, rss_total = int(out[0]), int(out[1])
+            label = 'current' if size == 0 else 'synthetic'
+            print(f"{label:<12}{kind:<9}{count:>10}{heap / count:>10.0f}{heap / 2**20:>10.1f}"
+                  f"{rss_delta / 2**20:>15.1f}{rss_total / 2**20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""SQLite 版の問題集の取り込み・ホットリロードの時間と、読み直した版の中身の確認
+
+CSV を版ごとの DB ファイルに取り込み (import_versioned_db)、BankRegistry で
+「変更なし → 1問書き換え → 途中の問題を消して縮める → 問題を足す」と読み直して、
+それぞれの取り込み・読み直しの時間を出す。読み直すたびに、今の版の問題 (ID と順番) が
+CSV と同じか、古い版が古い中身のまま読めるかを確かめ、違っていれば終了コード 1 で終わる。
+
+    python bench/bench_bank_reload.py [問題数 (0 なら今の問題集。既定 0)]
+"""
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bank_footprint import load_rows  # noqa: E402
+from bank_versions import BankRegistry  # noqa: E402
+from question_bank import SQLiteQuestionBank, import_versioned_db, sources_checksum  # noqa: E402
+
+HEADER = ['番号', '回', '区分', 'ID', '設問', '選択肢1', '選択肢2', '選択肢3', '選択肢4', '選択肢5', '正答']
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    # 同じ秒のうちに書き直しても、取り込み済みのファイルと見分けられるように mtime を進める
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def check(label, version, rows, failures):
+    bank = version.bank
+    expected = [row[3] for row in rows]
+    actual = [bank[idx]['id'] for idx in range(len(bank))]
+    if actual != expected:
+        failures.append(f'{label}: 問題数 {len(actual)} (CSV は {len(expected)} 問)、または ID の並びが CSV と違います')
+        return
+    for idx in (0, len(rows) // 2, len(rows) - 1):
+        if rows and (bank[idx]['question'], bank[idx]['answer_idx']) != (rows[idx][4], int(rows[idx][10])):
+            failures.append(f'{label}: {idx} 番目の問題の中身が CSV と違います')
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    rows = load_rows(size)
+    tmpdir = tempfile.mkdtemp()
+    failures = []
+    try:
+        csv_path = os.path.join(tmpdir, 'questions.csv')
+        db_path = os.path.join(tmpdir, 'questions.sqlite3')
+        write_csv(csv_path, rows)
+
+        def loader():
+            path, imported = import_versioned_db(db_path, [csv_path], sources_checksum([csv_path]))
+            loader.imported = imported
+            return SQLiteQuestionBank(path, remove_on_close=True)
+
+        start = time.perf_counter()
+        registry = BankRegistry(lambda: [csv_path], loader, grace=3600.0)
+        print(f'問題集: {len(rows):,} 問  初回の取り込み {(time.perf_counter() - start) * 1000:.1f}ms'
+              f' ({loader.imported:,} 問)')
+        check('初回', registry.current, rows, failures)
+
+        edited = [list(row) for row in rows]
+        edited[0][4] += ' (改)'
+        shrunk = [row for i, row in enumerate(edited) if i % 7 == 3 or i < 3][:max(10, len(rows) // 50)]
+        grown = shrunk + [[*row[:3], f'{row[3]}-new', *row[4:]] for row in rows[:5]]
+        steps = [('変更なし', rows), ('1問書き換え', edited), ('縮める', shrunk), ('問題を足す', grown)]
+        for label, step_rows in steps:
+            old = registry.current
+            old_ids = [old.bank[idx]['id'] for idx in range(len(old.bank))]
+            write_csv(csv_path, step_rows)
+            loader.imported = 0   # 同じ中身の版があれば読み込まない
+            start = time.perf_counter()
+            registry.reload()
+            elapsed = time.perf_counter() - start
+            current = registry.current
+            print(f'{label:<8} 読み直し {elapsed * 1000:7.1f}ms  取り込み {loader.imported:>6,} 問'
+                  f'  版 {current.version:08x}  {len(old.bank):,} 問 -> {len(current.bank):,} 問')
+            check(label, current, step_rows, failures)
+            if current is not old and [old.bank[idx]['id'] for idx in range(len(old.bank))] != old_ids:
+                failures.append(f'{label}: 古い版の中身が変わりました')
+            if step_rows is shrunk and len(current.bank) >= len(old.bank):
+                failures.append('縮めた CSV を読み直しても問題集が小さくなりません')
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    for failure in failures:
+        print(f'NG {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
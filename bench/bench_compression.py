@@ -0,0 +1,102 @@
+"""圧縮形式・レベルごとの圧縮率と CPU 時間を比べるベンチマーク
+
+実際の画面 (メニュー・出題・判定・到着・JSON 応答・CSS) を Flask テストクライアントで取得し、
+gzip の各レベル・brotli の各品質で圧縮して、サイズと1回あたりの圧縮時間を測る。
+「圧縮時間 + 転送時間 (回線速度から計算)」が最小になる設定を形式ごとに表示する。
+compression.py の既定値 (GZIP_LEVEL / BROTLI_QUALITY / MIN_SIZE) はこの結果から決めた。
+
+    python bench/bench_compression.py [回線速度 Mbps (既定 10)]
+"""
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as shinkansen  # noqa: E402
+from compression import brotli  # noqa: E402
+from game_state import decode_state  # noqa: E402
+
+GZIP_LEVELS = [1, 3, 5, 6, 9]
+BROTLI_QUALITIES = [1, 3, 4, 5, 6, 8, 11]
+
+
+def correct_choice(client):
+    with client.session_transaction() as sess:
+        state = decode_state(sess['game'])
+    return shinkansen.BANKS.get(state.bank_version).bank[state.current_question_index()]['answer_idx']
+
+
+def sample_bodies():
+    """圧縮対象の代表的な応答本文 (ラベル, バイト列) を集める"""
+    shinkansen.app.config['TESTING'] = True
+    client = shinkansen.app.test_client()
+    bodies = [('menu', client.get('/').get_data())]
+    client.post('/start', data={'mode': 'shinkansen'})
+    bodies.append(('quiz', client.get('/play').get_data()))
+    bodies.append(('judgement', client.post('/answer', data={'choice': '1', 'client_speed': '120'}).get_data()))
+    client.post('/next')
+    bodies.append(('answer.json', client.post('/answer', data={'choice': '1', 'client_speed': '120'},
+                                              headers={'Accept': 'application/json'}).get_data()))
+    while b'ARRIVED' not in (page := client.get('/play').get_data()):
+        client.post('/answer', data={'choice': str(correct_choice(client)), 'client_speed': '120'})
+        client.post('/next')
+    bodies.append(('arrival', page))
+    with shinkansen.app.open_resource('static/css/app.css', 'rb') as f:
+        bodies.append(('app.css', f.read()))
+    return bodies
+
+
+def timed(func, body, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = func(body)
+    return len(data), (time.perf_counter() - start) / repeat
+
+
+def main():
+    mbps = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    bytes_per_sec = mbps * 1_000_000 / 8
+    settings = [('gzip', level, lambda body, level=level: gzip.compress(body, level)) for level in GZIP_LEVELS]
+    if brotli is not None:
+        settings += [('br', quality, lambda body, quality=quality: brotli.compress(body, quality=quality))
+                     for quality in BROTLI_QUALITIES]
+    else:
+        print("(brotli がインストールされていないので gzip だけ測ります)")
+
+    bodies = sample_bodies()
+    print(f"{'body':<13}{'bytes':>8}" + ''.join(f"{f'{name}-{level}':>14}" for name, level, _ in settings))
+    totals = {(name, level): [0, 0.0] for name, level, _ in settings}
+    raw_total = 0
+    for label, body in bodies:
+        raw_total += len(body)
+        cells = []
+        for name, level, func in settings:
+            size, seconds = timed(func, body, 20 if level < 9 else 5)
+            totals[name, level][0] += size
+            totals[name, level][1] += seconds
+            cells.append(f"{size:>6}/{seconds * 1e6:>5.0f}us")
+        print(f"{label:<13}{len(body):>8}" + ''.join(f"{cell:>14}" for cell in cells))
+
+    print(f"\n合計 {raw_total} bytes を {mbps:g} Mbps で送る場合 (圧縮なし: {raw_total / bytes_per_sec * 1000:.1f} ms)")
+    print(f"{'setting':<10}{'bytes':>8}{'ratio':>8}{'cpu(ms)':>10}{'cpu+send(ms)':>14}")
+    best = {}
+    for (name, level), (size, seconds) in totals.items():
+        cost = seconds + size / bytes_per_sec
+        print(f"{f'{name}-{level}':<10}{size:>8}{size / raw_total:>8.2f}{seconds * 1000:>10.2f}{cost * 1000:>14.2f}")
+        if name not in best or cost < best[name][1]:
+            best[name] = (level, cost)
+    for name, (level, cost) in best.items():
+        print(f"最適: {name} レベル {level} ({cost * 1000:.2f} ms)")
+
+    # 小さい本文は圧縮しても縮む量が少ないので、どこから得をするかも見ておく
+    print(f"\n{'size':>6}{'gzip-6':>8}{'saved':>7}{'cpu(us)':>9}")
+    sample = bodies[0][1]
+    for size in (128, 256, 512, 1024, 2048):
+        compressed, seconds = timed(lambda body: gzip.compress(body, 6), sample[:size], 200)
+        print(f"{size:>6}{compressed:>8}{size - compressed:>7}{seconds * 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""ランキング (leaderboard.py) が100万件の記録でも速いままかを測るベンチマーク
+
+1. 順位表単体: SortedRuns に1件ずつ足しながら、件数が 10万・50万・100万 の時点で
+   追加 / 順位 / 上位10件 の1回あたりの時間を測る。比較として、1本のリストに bisect.insort する素朴な実装も測る
+2. Leaderboard: 100万件を record してまとめて書き出す時間、起動時に100万件を読み込んで順位表を作る時間
+
+    python bench/bench_leaderboard.py [件数]
+"""
+import bisect
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from leaderboard import Leaderboard, SortedRuns, run_key  # noqa: E402
+
+
+def random_run(rng):
+    answered = rng.randint(480, 900)
+    score = rng.randint(answered // 2, min(answered, 493))
+    return score, answered, rng.uniform(600, 7200), 1.7e9 + rng.random() * 1e7
+
+
+def per_call(func, args):
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter() - start) / len(args)
+
+
+def sorted_runs(total):
+    rng = random.Random(0)
+    keys = [run_key('accuracy', *random_run(rng)) for _ in range(total)]
+    probes = [run_key('accuracy', *random_run(rng)) for _ in range(10_000)]
+    checkpoints = sorted({total // 10, total // 2, total})
+
+    print(f'{"件数":>9} {"":<14} {"追加":>10} {"順位":>10} {"上位10件":>10}')
+    runs, plain = SortedRuns(), []
+    added = 0
+    for checkpoint in checkpoints:
+        batch = keys[added:checkpoint]
+        start = time.perf_counter()
+        for key in batch:
+            runs.add(key)
+        add_time = (time.perf_counter() - start) / max(1, len(batch))
+        rank_time = per_call(runs.rank, probes)
+        top_time = per_call(lambda _: runs.top(10), range(10_000))
+        print(f'{checkpoint:>9,} {"SortedRuns":<14} {add_time * 1e6:>8.2f}µs {rank_time * 1e6:>8.2f}µs'
+              f' {top_time * 1e6:>8.2f}µs')
+
+        # 素朴な実装: 1本のリストに insort (挿入のたびに後ろを全部ずらす)。件数を揃えて最後の 1万件だけ測る
+        plain = sorted(keys[:checkpoint - 10_000])
+        start = time.perf_counter()
+        for key in keys[checkpoint - 10_000:checkpoint]:
+            bisect.insort(plain, key)
+        plain_add = (time.perf_counter() - start) / 10_000
+        plain_rank = per_call(lambda key: bisect.bisect_left(plain, key), probes)
+        print(f'{"":>9} {"list+insort":<14} {plain_add * 1e6:>8.2f}µs {plain_rank * 1e6:>8.2f}µs'
+              f' {per_call(lambda _: plain[:10], range(10_000)) * 1e6:>8.2f}µs')
+        added = checkpoint
+
+    # 正しさの確認 (素朴な実装と同じ順位になること)
+    assert all(runs.rank(key) == bisect.bisect_left(plain, key) for key in probes[:1000])
+    assert runs.top(10) == plain[:10]
+
+
+def leaderboard(total):
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'leaderboard.sqlite3')
+        board = Leaderboard(path, flush_interval=3600)
+        runs = [random_run(rng) for _ in range(total)]
+        modes = ('shinkansen', 'nozomi')
+
+        start = time.perf_counter()
+        for i, (score, answered, play_time, _) in enumerate(runs):
+            board.record(modes[i & 1], 0, 0, score, answered, play_time)
+        record_time = time.perf_counter() - start
+        start = time.perf_counter()
+        board.flush()
+        flush_time = time.perf_counter() - start
+        print(f'record {total:,} 件: {record_time:.2f}s ({record_time / total * 1e6:.2f}µs/件)'
+              f'  まとめ書き: {flush_time:.2f}s')
+
+        del board, runs
+        start = time.perf_counter()
+        reloaded = Leaderboard(path)
+        print(f'起動時の読み込み ({total:,} 件 → 順位表): {time.perf_counter() - start:.2f}s')
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            reloaded.top('nozomi', 0, 0, 'time', 20)
+        print(f'top 20: {(time.perf_counter() - start) / 1000 * 1e6:.1f}µs'
+              f'  1位: {reloaded.top("shinkansen", 0, 0, "accuracy", 1)[0]}')
+
+        # 100万件入った状態でも、1件の完走の記録 (順位を返すまで) が一定時間で終わること
+        start = time.perf_counter()
+        for _ in range(10_000):
+            score, answered, play_time, _ = random_run(rng)
+            reloaded.record('shinkansen', 0, 0, score, answered, play_time)
+        print(f'{total:,} 件入った後の record: {(time.perf_counter() - start) / 10_000 * 1e6:.2f}µs/件')
+
+
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print('== 順位表単体 ==')
+    sorted_runs(total)
+    print('== Leaderboard (記録・書き出し・読み込み) ==')
+    leaderboard(total)
@@ -0,0 +1,102 @@
+"""計測 (metrics.py) を入れたことによる1リクエストあたりの負担を測るベンチマーク
+
+1. 記録処理単体: Histogram.observe / Counter.inc / セッションのサイズ計算を繰り返して1回あたりの時間を測る
+2. 通しの比較: 同じ旅 (開始 → 回答 → 次へ ...) を、計測フックあり・なしで Flask テストクライアントで走らせ、
+   1リクエストあたりの処理時間の差を見る (METRICS_DIR を付けた場合の書き出しも含む)
+
+    python bench/bench_metrics.py [リクエスト数]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import request_finished  # noqa: E402
+from flask.sessions import session_json_serializer  # noqa: E402
+
+import app as shinkansen  # noqa: E402
+from metrics import Registry  # noqa: E402
+
+
+def per_call(func, repeat=200_000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def micro():
+    registry = Registry()
+    histogram = registry.histogram('h', 'h', ('endpoint', 'method'))
+    counter = registry.counter('c', 'c', ('mode',))
+    session = {'game': 'A' * 80, 'landmarks': 255, 'offline': False}
+    rows = [
+        ('Histogram.observe', lambda: histogram.observe(0.0042, 'play', 'GET')),
+        ('Counter.inc', lambda: counter.inc('nozomi')),
+        ('session size', lambda: len(session_json_serializer.dumps(session))),
+        ('Registry.render', lambda: registry.render()),
+    ]
+    print(f"{'operation':<20}{'us/call':>10}")
+    for label, func in rows:
+        print(f"{label:<20}{per_call(func, 2000 if label == 'Registry.render' else 200_000) * 1e6:>10.2f}")
+
+
+def run(client, total):
+    """total リクエストぶん遊び、1リクエストあたりの秒数を返す"""
+    # アプリ側の乱数 (シャッフルのシード等) も固定して、毎回同じ旅にする
+    random.seed(0)
+    rng = random.Random(0)
+    count = 0
+    start = time.perf_counter()
+    client.post('/start', data={'mode': 'shinkansen'})
+    while count < total:
+        page = client.get('/play').get_data()
+        if b'ARRIVED' in page:
+            client.post('/depart', data={'mode': 'shinkansen'})
+        else:
+            client.post('/answer', data={'choice': str(rng.randint(1, 5)), 'client_speed': '120'})
+            client.post('/next')
+        count += 3
+    return (time.perf_counter() - start) / count
+
+
+def set_hooks(enabled):
+    funcs = shinkansen.app.before_request_funcs.setdefault(None, [])
+    if enabled:
+        request_finished.connect(shinkansen.record_request, shinkansen.app)
+        if shinkansen.start_request_timer not in funcs:
+            funcs.append(shinkansen.start_request_timer)
+    else:
+        request_finished.disconnect(shinkansen.record_request, shinkansen.app)
+        if shinkansen.start_request_timer in funcs:
+            funcs.remove(shinkansen.start_request_timer)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    shinkansen.app.config['TESTING'] = True
+    micro()
+
+    print(f"\n{'hooks':<22}{'us/request':>12}")
+    settings = (('off', False, None), ('on', True, None), ('on + METRICS_DIR', True, tempfile.mkdtemp()))
+    results = {label: [] for label, _, _ in settings}
+    run(shinkansen.app.test_client(), 300)  # 暖機
+    # 順番の影響を減らすため、設定を入れ替えながら5回ずつ測って最小値をとる
+    for _ in range(5):
+        for label, enabled, directory in settings:
+            set_hooks(enabled)
+            shinkansen.METRICS.directory = directory
+            results[label].append(run(shinkansen.app.test_client(), total))
+    results = {label: min(times) for label, times in results.items()}
+    for label, seconds in results.items():
+        print(f"{label:<22}{seconds * 1e6:>12.1f}")
+    set_hooks(True)
+    print(f"\n計測の負担: {(results['on'] - results['off']) * 1e6:+.1f} us/request "
+          f"(METRICS_DIR あり {(results['on + METRICS_DIR'] - results['off']) * 1e6:+.1f} us/request)")
+
+
+if __name__ == '__main__':
+    main()
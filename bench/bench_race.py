@@ -0,0 +1,197 @@
+"""レースモードの負荷試験 (1つの部屋に何百人もの購読者)
+
+gunicorn (gevent ワーカー1つ。gevent がなければ gthread) でアプリを起動し、このプロセスから asyncio で
+- 乗客 (racers): 部屋に乗って「出題 → 回答 → 次へ ... → 出発」を繰り返し、位置を更新し続ける
+- 観客 (subscribers): /race/<部屋>/events を購読し、届いたメッセージの数と遅れ (サーバーの送信時刻との差) を数える
+を同時に動かす。どちらもスレッドを使わない (asyncio のタスク1つが1接続) ので、手元の1台で何百接続でも試せる。
+
+    python bench/bench_race.py [観客の数] [乗客の数] [秒数]
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = '127.0.0.1'
+
+
+# ---------------------------------------------------------
+# 最小限の HTTP クライアント (1リクエスト1接続)
+# ---------------------------------------------------------
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+        self.requests = 0
+
+    async def request(self, method, path, form=None):
+        reader, writer = await asyncio.open_connection(HOST, self.port)
+        body = urlencode(form or {}).encode()
+        headers = [f'{method} {path} HTTP/1.1', f'Host: {HOST}', 'Connection: close',
+                   f'Content-Length: {len(body)}', 'Content-Type: application/x-www-form-urlencoded']
+        if self.cookies:
+            headers.append('Cookie: ' + '; '.join(f'{k}={v}' for k, v in self.cookies.items()))
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + body)
+        raw = await reader.read()
+        writer.close()
+        self.requests += 1
+        head, _, payload = raw.partition(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name.lower() == 'set-cookie':
+                key, _, rest = value.strip().partition('=')
+                self.cookies[key] = rest.split(';', 1)[0]
+        return int(lines[0].split()[1]), payload.decode('utf-8', 'replace')
+
+
+async def racer(port, code, name, deadline, rng, stats):
+    client = Client(port)
+    await client.request('POST', '/race/join', {'code': code, 'name': name})
+    while time.monotonic() < deadline:
+        _, page = await client.request('GET', '/play')
+        if 'MISSION COMPLETE' in page:
+            break
+        if 'ARRIVED' in page:
+            await client.request('POST', '/depart', {'mode': 'shinkansen'})
+            continue
+        await asyncio.sleep(rng.uniform(0.1, 0.4))   # 考える時間
+        await client.request('POST', '/answer', {'choice': str(rng.randint(1, 5)), 'client_speed': '150'})
+        await client.request('POST', '/next')
+        stats['answers'] += 1
+    stats['requests'] += client.requests
+
+
+async def subscriber(port, code, deadline, stats):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(f'GET /race/{code}/events HTTP/1.1\r\nHost: {HOST}\r\nAccept: text/event-stream\r\n\r\n'.encode())
+    await reader.readuntil(b'\r\n\r\n')
+    received = 0
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(reader.readuntil(b'\n\n'), remaining)
+            except asyncio.TimeoutError:
+                break
+            # chunked 転送の区切り (長さの行) が混ざるので、data: の行だけ拾う
+            for line in chunk.split(b'\n'):
+                if line.startswith(b'data: '):
+                    message = json.loads(line[6:])
+                    stats['latency'].append(time.time() - message['ts'])
+                    received += 1
+    finally:
+        writer.close()
+    stats['frames'].append(received)
+
+
+def cpu_seconds(pid):
+    """gunicorn のマスターとワーカー (子プロセス) の CPU 時間の合計"""
+    total = 0.0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return total
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, tmpdir):
+    # ワーカーの種類は gunicorn.conf.py で決める (-k では変えない)
+    try:
+        import gevent  # noqa: F401
+        worker = 'gevent', dict(GUNICORN_RACES='1', GUNICORN_WORKER_CONNECTIONS='2000')
+    except ImportError:
+        worker = 'gthread', dict(WEB_CONCURRENCY='1', GUNICORN_THREADS='1000')
+    env = dict(os.environ, **worker[1], EVENT_LOG='off', STATS_DB_PATH=os.path.join(tmpdir, 'stats.sqlite3'),
+               PLAYER_DB_PATH=os.path.join(tmpdir, 'players.sqlite3'),
+               ADAPTIVE_DB_PATH=os.path.join(tmpdir, 'adaptive.sqlite3'),
+               LEADERBOARD_DB_PATH=os.path.join(tmpdir, 'leaderboard.sqlite3'))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--bind', f'{HOST}:{port}',
+                               '--log-level', 'warning', 'app:app'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, port), timeout=0.2).close()
+            return server, worker[0]
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('サーバーが起動しませんでした')
+
+
+async def run(port, subscribers, racers, seconds):
+    host = Client(port)
+    await host.request('POST', '/race', {'race_mode': 'shinkansen', 'name': 'host'})
+    code = await room_code(host)
+    deadline = time.monotonic() + seconds
+    stats = dict(latency=[], frames=[], answers=0, requests=0)
+    rng = random.Random(0)
+    tasks = [subscriber(port, code, deadline, stats) for _ in range(subscribers)]
+    tasks += [racer(port, code, f'racer{i}', deadline, random.Random(rng.random()), stats) for i in range(racers)]
+    await asyncio.gather(*tasks)
+    return code, stats
+
+
+async def room_code(client):
+    # 部屋を作った乗客の出題画面に部屋コードが出ている
+    _, page = await client.request('GET', '/play')
+    return re.search(r'data-room="(\w+)"', page).group(1)
+
+
+def main():
+    subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    racers = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    tmpdir = tempfile.mkdtemp()
+    port = free_port()
+    server, worker = start_server(port, tmpdir)
+    try:
+        cpu_before = cpu_seconds(server.pid)
+        start = time.monotonic()
+        code, stats = asyncio.run(run(port, subscribers, racers, seconds))
+        wall = time.monotonic() - start
+        cpu = cpu_seconds(server.pid) - cpu_before
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    latency = sorted(stats['latency'])
+    frames = stats['frames']
+    print(f'ワーカー: {worker}  部屋: {code}  観客 {subscribers} 人  乗客 {racers} 人  {wall:.1f} 秒')
+    print(f'乗客: 回答 {stats["answers"]} 回 ({stats["answers"] / wall:.1f}/秒)  リクエスト {stats["requests"]} 回')
+    if frames:
+        print(f'観客: 受信 {sum(frames)} 件 (1人あたり {statistics.mean(frames):.1f} 件, 最少 {min(frames)} 件)')
+    if latency:
+        def pct(p):
+            return latency[min(len(latency) - 1, int(len(latency) * p))] * 1000
+        print(f'配信の遅れ: p50 {pct(0.5):.1f}ms  p95 {pct(0.95):.1f}ms  p99 {pct(0.99):.1f}ms  max {latency[-1] * 1000:.1f}ms')
+    print(f'サーバーの CPU 時間: {cpu:.2f}s ({cpu / wall * 100:.0f}%)')
+
+
+if __name__ == '__main__':
+    main()
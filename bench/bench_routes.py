@@ -0,0 +1,167 @@
+"""路線エンジンの検算とベンチマーク
+
+ゲームが走る経路 (鹿児島中央〜新函館北斗) の全駅・全停車パターンについて、RouteEngine の表引きの結果が
+以前の実装 (STATION_DATA を毎回走査する / 駅番号の if 分岐) と一致することを確かめ、
+1回あたりの処理時間を比較する。
+分岐する路線 (大宮で分かれる上越新幹線、高崎で分かれる北陸新幹線) の経路も、経路の駅の並びを
+毎回走査する実装と比べ、分岐駅の前後で経路と超特急名が切り替わるかを確かめる。不一致があれば終了コード 1 で終わる。
+
+    python bench/bench_routes.py [回数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import ROUTE, ROUTES  # noqa: E402
+
+MODES = ('shinkansen', 'nozomi')
+# 以前の実装が走査していた駅リスト (東北・北海道新幹線の終点までの経路)
+STATION_DATA = [ROUTES.stations[idx] for idx in ROUTE.path]
+# 分岐する路線の経路: (路線名, 分かれる元の路線, 分岐駅, 分岐して最初の駅, 終点, 分岐駅を出る超特急)
+BRANCHES = [
+    ('上越新幹線', '東北・北海道新幹線', '大宮', '熊谷', '新潟', 'とき'),
+    ('北陸新幹線', '上越新幹線', '高崎', '安中榛名', '敦賀', 'かがやき'),
+]
+
+
+# --- 以前の実装 (比較用にそのまま残す) ---
+def legacy_next_destination(current_idx, mode):
+    next_idx = current_idx + 1
+    if mode == 'nozomi':
+        found = False
+        for i in range(current_idx + 1, len(STATION_DATA)):
+            if STATION_DATA[i]['is_nozomi']:
+                next_idx = i
+                found = True
+                break
+        if not found:
+            next_idx = len(STATION_DATA) - 1
+    return next_idx
+
+
+def legacy_emergency_target(current_idx):
+    target_idx = 0
+    for i in range(current_idx, -1, -1):
+        if STATION_DATA[i]['is_nozomi']:
+            target_idx = i
+            break
+    return target_idx
+
+
+def legacy_express_name(station_idx):
+    if station_idx < 11:
+        return "みずほ"
+    elif station_idx < 45:
+        return "のぞみ"
+    else:
+        return "はやぶさ"
+
+
+# --- 分岐する経路の比較用: 経路の駅の並びをそのつど走査する ---
+def scan_next_stop(path, station_idx, mode):
+    pos = path.index(station_idx)
+    if mode == 'nozomi':
+        for idx in path[pos + 1:]:
+            if ROUTES.stations[idx]['is_nozomi']:
+                return idx
+    return path[min(pos + 1, len(path) - 1)]
+
+
+def scan_previous_express(path, station_idx):
+    for idx in reversed(path[:path.index(station_idx) + 1]):
+        if ROUTES.stations[idx]['is_nozomi']:
+            return idx
+    return path[0]
+
+
+def check_branch(name, parent, junction, first, terminal, express):
+    errors = []
+    route, parent_route = ROUTES.route(name), ROUTES.route(parent)
+    index_of = ROUTES.index_of
+    path, parent_path = list(route.path), list(parent_route.path)
+    # 分岐駅までは元の路線と同じ駅を通り、分岐駅の次はその路線の駅
+    split = path.index(index_of[junction])
+    if path[:split + 1] != parent_path[:parent_path.index(index_of[junction]) + 1]:
+        errors.append(f"{name}: 分岐駅 {junction} までの経路が {parent} と違います")
+    if path[split + 1] != index_of[first] or route.last_idx != index_of[terminal]:
+        errors.append(f"{name}: {junction} の次が {first}、終点が {terminal} になっていません")
+    if route.express_name(index_of[junction]) != express or route.line_name(index_of[junction]) != name:
+        errors.append(f"{name}: {junction} を出る列車が {route.express_name(index_of[junction])} です")
+    if parent_route.express_name(index_of[junction]) == express:
+        errors.append(f"{name}: {parent} の {junction} を出る列車まで {express} になりました")
+    for idx in path:
+        if idx != route.last_idx:
+            for mode in MODES:
+                expected, actual = scan_next_stop(path, idx, mode), route.next_stop(idx, mode)
+                if expected != actual:
+                    errors.append(f"{name} next_stop({idx} {ROUTES.stations[idx]['name']}, {mode}): {actual} != {expected}")
+        expected, actual = scan_previous_express(path, idx), route.previous_express_stop(idx)
+        if expected != actual:
+            errors.append(f"{name} previous_express_stop({idx} {ROUTES.stations[idx]['name']}): {actual} != {expected}")
+        if route.is_terminal(idx) != (idx == route.last_idx):
+            errors.append(f"{name} is_terminal({idx} {ROUTES.stations[idx]['name']})")
+    return errors
+
+
+def check():
+    errors = []
+    for idx, station in enumerate(STATION_DATA):
+        # 終点からは出発しないので、次の停車駅は終点より手前だけ比べる
+        if idx < len(STATION_DATA) - 1:
+            for mode in MODES:
+                expected, actual = legacy_next_destination(idx, mode), ROUTE.next_stop(idx, mode)
+                if expected != actual:
+                    errors.append(f"next_stop({idx} {station['name']}, {mode}): {actual} != {expected}")
+        expected, actual = legacy_emergency_target(idx), ROUTE.previous_express_stop(idx)
+        if expected != actual:
+            errors.append(f"previous_express_stop({idx} {station['name']}): {actual} != {expected}")
+        expected, actual = legacy_express_name(idx), ROUTE.express_name(idx)
+        if expected != actual:
+            errors.append(f"express_name({idx} {station['name']}): {actual} != {expected}")
+    for branch in BRANCHES:
+        errors += check_branch(*branch)
+    return errors
+
+
+def bench(func, n, stations=None):
+    stations = stations or range(len(STATION_DATA) - 1)
+    start = time.perf_counter()
+    for _ in range(n):
+        for idx in stations:
+            func(idx)
+    return (time.perf_counter() - start) / (n * len(stations)) * 1e9
+
+
+def main():
+    errors = check()
+    for error in errors:
+        print("NG:", error)
+    branch_stations = sum(len(ROUTES.route(branch[0]).path) for branch in BRANCHES)
+    print(f"検算: {len(STATION_DATA)} 駅 + 分岐経路 {len(BRANCHES)} 本 ({branch_stations} 駅) x {len(MODES)} パターン,"
+          f" 不一致 {len(errors)} 件")
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    cases = [
+        ('next_stop(nozomi)', lambda i: legacy_next_destination(i, 'nozomi'), lambda i: ROUTE.next_stop(i, 'nozomi')),
+        ('next_stop(shinkansen)', lambda i: legacy_next_destination(i, 'shinkansen'),
+         lambda i: ROUTE.next_stop(i, 'shinkansen')),
+        ('previous_express_stop', legacy_emergency_target, ROUTE.previous_express_stop),
+        ('express_name', legacy_express_name, ROUTE.express_name),
+    ]
+    print(f"{'lookup':<24}{'legacy(ns)':>12}{'engine(ns)':>12}")
+    for name, legacy, engine in cases:
+        print(f"{name:<24}{bench(legacy, n):>12.0f}{bench(engine, n):>12.0f}")
+    # 分岐する経路: 経路の駅の並びを走査する実装と比べる (legacy の列は走査の時間)
+    for branch in BRANCHES:
+        route = ROUTES.route(branch[0])
+        path = list(route.path)
+        scan = bench(lambda i: scan_next_stop(path, i, 'nozomi'), n, path[:-1])
+        engine = bench(lambda i: route.next_stop(i, 'nozomi'), n, path[:-1])
+        print(f"{branch[0] + ' next_stop(nozomi)':<24}{scan:>12.0f}{engine:>12.0f}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""セッション保存先ごとの Cookie サイズとレイテンシを比較するベンチマーク
+
+各バックエンドで同じ手順の旅 (開始 → 回答 → 次へ ... → 出発) を Flask テストクライアントで走らせ、
+リクエストに載る Cookie のバイト数と1リクエストあたりの処理時間を測る。
+
+    python bench/bench_sessions.py [回答数]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+
+import app as shinkansen  # noqa: E402
+from profiling import TimedSessionInterface  # noqa: E402
+from session_store import create_session_interface  # noqa: E402
+
+
+def run_journey(client, answers):
+    """answers 回答ぶん遊び、(リクエスト数, Cookieバイト数の合計, 最大, 経過秒) を返す"""
+    cookie_name = shinkansen.app.config['SESSION_COOKIE_NAME']
+    rng = random.Random(0)
+    requests = 0
+    total_bytes = 0
+    max_bytes = 0
+    elapsed = 0.0
+
+    def call(method, path, data=None):
+        nonlocal requests, total_bytes, max_bytes, elapsed
+        cookie = client.get_cookie(cookie_name)
+        size = len(cookie_name) + 1 + len(cookie.value) if cookie else 0
+        start = time.perf_counter()
+        response = getattr(client, method)(path, data=data)
+        elapsed += time.perf_counter() - start
+        requests += 1
+        total_bytes += size
+        max_bytes = max(max_bytes, size)
+        return response
+
+    call('post', '/start', {'mode': 'shinkansen'})
+    for _ in range(answers):
+        page = call('get', '/play').get_data(as_text=True)
+        if 'ARRIVED' in page:
+            call('post', '/depart', {'mode': 'shinkansen'})
+            continue
+        # 3割は間違えてキューを伸ばす
+        call('post', '/answer', {'choice': str(rng.randint(1, 5)) if rng.random() < 0.3 else '1',
+                                 'client_speed': '120'})
+        call('post', '/next')
+    return requests, total_bytes, max_bytes, elapsed
+
+
+def main():
+    answers = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    shinkansen.app.config['TESTING'] = True
+    tmpdir = tempfile.mkdtemp()
+    interfaces = {
+        'cookie': SecureCookieSessionInterface(),
+        'memory': create_session_interface('memory'),
+        'sqlite': create_session_interface('sqlite', db_path=os.path.join(tmpdir, 'bench.sqlite3')),
+    }
+
+    # app.py と同じく TimedSessionInterface で包んで差し替え (Server-Timing の計測も同じ条件)、終わったら元に戻す
+    original = shinkansen.app.session_interface
+    print(f"{'backend':<10}{'requests':>10}{'avg cookie(B)':>15}{'max cookie(B)':>15}{'avg latency(ms)':>17}")
+    try:
+        for kind, interface in interfaces.items():
+            shinkansen.app.session_interface = TimedSessionInterface(interface, header=original.header)
+            requests, total_bytes, max_bytes, elapsed = run_journey(shinkansen.app.test_client(), answers)
+            print(f"{kind:<10}{requests:>10}{total_bytes / requests:>15.0f}{max_bytes:>15}"
+                  f"{elapsed / requests * 1000:>17.2f}")
+    finally:
+        shinkansen.app.session_interface = original
+
+
+if __name__ == '__main__':
+    main()
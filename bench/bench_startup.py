@@ -0,0 +1,110 @@
+"""起動時間 (app.py を import し終わるまで) の内訳を測る
+
+新しいインタープリターで app.py を何回か import し、app.STARTUP_TIMES に記録された
+段階ごと (import / bank / stores / templates / routes) の時間を出させて中央値を出す。
+- cold: スナップショット (*.qbank) とテンプレートのバイトコードキャッシュを毎回消してから起動する
+- warm: 1回目に作ったものを使って起動する (本番で2回目以降に起動した時と同じ)
+- csv: QUESTION_SNAPSHOT=0 (毎回 CSV を解析する、スナップショット導入前の読み込み方) で起動する
+
+問題数を指定すると合成した大規模な問題集 (bench/bank_footprint.py と同じ作り方) で測る。
+--json <ファイル> で結果を1行の JSON として追記するので、変更ごとの起動時間の推移を追える。
+
+    python bench/bench_startup.py [問題数] [--repeat N] [--json 結果ファイル]
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from bank_footprint import synthetic_rows  # noqa: E402
+
+# app を import し、段階ごとの時間 (秒) を JSON で1行出す
+REPORT = 'import json, app; print(json.dumps(app.STARTUP_TIMES))'
+
+
+def write_csv(path, size):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['番号', '回', '区分', 'ID', '設問', '選択肢1', '選択肢2', '選択肢3', '選択肢4', '選択肢5', '正答'])
+        writer.writerows(synthetic_rows(size))
+
+
+def start_once(env):
+    """新しいプロセスで app を import し、段階ごとの時間 (ms) とプロセス全体の時間を返す"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', REPORT], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    wall = (time.perf_counter() - start) * 1000
+    phases = {name: seconds * 1000 for name, seconds in json.loads(result.stdout.splitlines()[-1]).items()}
+    phases['process'] = wall
+    return phases
+
+
+def measure(env, repeat, reset):
+    runs = []
+    for _ in range(repeat):
+        reset()
+        runs.append(start_once(env))
+    return {phase: statistics.median(run[phase] for run in runs) for phase in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('size', nargs='?', type=int, help='合成する問題数 (省略時は同梱の CSV)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='結果を1行の JSON として追記するファイル')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(tmpdir, 'questions.csv')
+        if args.size:
+            write_csv(csv_path, args.size)
+        else:
+            shutil.copy(os.path.join(ROOT, '67-76_hissu_004.csv'), csv_path)
+        snapshot = csv_path + '.qbank'
+        template_cache = os.path.join(tmpdir, 'jinja')
+        env = dict(os.environ, EVENT_LOG='off', QUESTION_CSV=csv_path, TEMPLATE_CACHE_DIR=template_cache,
+                   STATS_DB_PATH=os.path.join(tmpdir, 'stats.sqlite3'),
+                   PLAYER_DB_PATH=os.path.join(tmpdir, 'players.sqlite3'),
+                   ADAPTIVE_DB_PATH=os.path.join(tmpdir, 'adaptive.sqlite3'),
+                   LEADERBOARD_DB_PATH=os.path.join(tmpdir, 'leaderboard.sqlite3'))
+        env.pop('QUESTION_MAP_PATH', None)
+
+        def clear():
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+            shutil.rmtree(template_cache, ignore_errors=True)
+
+        results = {
+            'cold': measure(env, args.repeat, clear),
+            'warm': measure(env, args.repeat, lambda: None),
+            'csv': measure(dict(env, QUESTION_SNAPSHOT='0'), args.repeat, lambda: None),
+        }
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    phases = list(results['warm'])
+    print(f'問題集: {args.size or "同梱の CSV"}  (中央値 / {args.repeat} 回, ms)')
+    print(f'{"":<6}' + ''.join(f'{phase:>10}' for phase in phases))
+    for name, result in results.items():
+        print(f'{name:<6}' + ''.join(f'{result[phase]:>10.1f}' for phase in phases))
+
+    if args.json:
+        record = dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'), size=args.size, repeat=args.repeat,
+                      python=sys.version.split()[0], results=results)
+        with open(args.json, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
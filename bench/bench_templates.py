@@ -0,0 +1,57 @@
+"""テンプレート描画のマイクロベンチマーク
+
+毎回パース＆コンパイルする旧方式 (render_template_string 相当) と、
+起動時にコンパイル済みのテンプレートをキャッシュから使う新方式を比較する。
+
+    python bench/bench_templates.py [回数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as shinkansen  # noqa: E402
+
+QUESTIONS = shinkansen.BANKS.current.bank
+
+SAMPLE_CONTEXTS = {
+    'menu': dict(current_speed=0, all_landmarks=shinkansen.LANDMARK_DATA, collected=['0', '25'],
+                 total_questions=len(QUESTIONS), express_name='みずほ'),
+    'quiz': dict(question=QUESTIONS[0], mode_label='各駅停車', current_station='鹿児島中央',
+                 next_station='川内', score=0, progress=0, current_speed=50,
+                 landmark=shinkansen.LANDMARK_DATA[0], total_questions=len(QUESTIONS),
+                 total_answered=1, disabled_indices=[]),
+    'judgement': dict(is_correct=False, correct_answer_text='死からの自由', current_speed=80,
+                      total_questions=len(QUESTIONS), total_answered=1),
+    'station_arrival': dict(current_station='熊本', score=5, current_speed=0,
+                            total_questions=len(QUESTIONS), total_answered=7,
+                            is_nozomi_station=True, express_name='みずほ'),
+    'goal': dict(score=400, total_answered=520),
+}
+
+
+def bench(render, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        render()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # キャッシュ無効 (cache_size=0) の環境 = 毎リクエスト コンパイルしていた頃と同じ条件
+    # overlay はバイトコードキャッシュも引き継ぐので外す (外さないとコンパイルを飛ばした値になる)
+    uncached_env = shinkansen.app.jinja_env.overlay(cache_size=0, bytecode_cache=None)
+
+    print(f"{'state':<16}{'uncached(us)':>14}{'cached(us)':>12}{'speedup':>9}")
+    with shinkansen.app.test_request_context('/'):
+        for state, context in SAMPLE_CONTEXTS.items():
+            template_name = shinkansen.SCREEN_TEMPLATES[state]
+            before = bench(lambda: uncached_env.get_template(template_name).render(state=state, **context), n)
+            after = bench(lambda: shinkansen.render_screen(state, **context), n)
+            print(f"{state:<16}{before:>14.1f}{after:>12.1f}{before / after:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+"""通しの負荷試験: 模擬プレイヤーに旅を最初から最後まで遊ばせて、ルートごとの速さを測る
+
+プレイヤーは /start → /play → /answer → /next → ... → /depart を繰り返してゴールまで進む
+(ときどき /emergency_stop も押す)。正答は CSV から引き、正答率 --accuracy で正解を選ぶ。
+--json-share の割合のプレイヤーは画面と同じ JSON API (/answer に Accept: application/json) で答える。
+ブラウザと同じく Accept-Encoding: gzip を送り、応答の大きさは転送されたバイト数で数える。
+
+- inprocess: 同じプロセスの Flask テストクライアントで、プレイヤーを1人ずつ順に動かす (並行なし)
+- gunicorn: gunicorn.conf.py の構成 (preload + mmap) でワーカー --workers 個を起動し、
+  --players 人のプレイヤーをスレッドで同時に動かす
+
+ルートごとのスループットとレイテンシ (p50 / p95 / p99)、応答と Cookie の大きさ、
+1回答あたりの CPU 時間 (inprocess はこのプロセス全体、gunicorn はサーバーのプロセスの合計) を出す。
+--output で結果を JSON に書き、--compare で保存しておいた結果 (ベースライン) と比べて、
+悪くなった値があれば印を付けて終了コード 1 で終わる。
+
+    python bench/load_test.py --output bench-base.json
+    (変更してから)
+    python bench/load_test.py --output bench-new.json --compare bench-base.json
+"""
+import argparse
+import atexit
+import csv
+import gzip
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = '127.0.0.1'
+MODES = ('shinkansen', 'nozomi')
+QUESTION_ID_RE = re.compile(rb'id="questionId">([^<]+)<')
+BODY_RE = re.compile(rb'data-speed="([\d.]+)" data-landmark="(\d)" data-landmark-speed="([\d.]+)"')
+MAX_REQUESTS = 20_000   # 1回の旅のリクエスト数の上限 (ゴールできない不具合で止まらないように)
+
+# --compare で比べる値: (名前, 小さい方が良いか)
+ROUTE_METRICS = (('p50_ms', True), ('p95_ms', True), ('p99_ms', True), ('bytes_mean', True))
+TARGET_METRICS = (('requests_per_s', False), ('answers_per_s', False), ('cpu_ms_per_answer', True),
+                  ('cookie_mean', True), ('cookie_max', True))
+SIZE_METRICS = {'bytes_mean', 'cookie_mean', 'cookie_max'}
+COMPARE_OPTIONS = {'output', 'compare', 'threshold', 'size_threshold', 'min_ms', 'min_count'}
+
+
+def load_answers(csv_path):
+    """問題 ID -> 正答番号"""
+    with open(csv_path, encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return {row[3]: int(row[10]) for row in reader if len(row) >= 11}
+
+
+# ---------------------------------------------------------
+# 接続 (Flask テストクライアント / HTTP)
+# ---------------------------------------------------------
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, accept=None):
+        """(状態コード, 本文 (展開済み), 転送バイト数, 送った Cookie のバイト数, 秒数)"""
+        headers = {'Accept-Encoding': 'gzip'}
+        if accept:
+            headers['Accept'] = accept
+        cookie = self.client.get_cookie('session')
+        start = time.perf_counter()
+        response = self.client.open(path, method=method, data=form, headers=headers)
+        data = response.get_data()
+        elapsed = time.perf_counter() - start
+        body = gzip.decompress(data) if response.content_encoding == 'gzip' else data
+        return response.status_code, body, len(data), len(cookie.value) if cookie else 0, elapsed
+
+
+class HTTPClient:
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection(HOST, port, timeout=60)
+        self.cookies = {}
+
+    def request(self, method, path, form=None, accept=None):
+        payload = urlencode(form).encode() if form is not None else None
+        headers = {'Accept-Encoding': 'gzip'}
+        if payload is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if accept:
+            headers['Accept'] = accept
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        start = time.perf_counter()
+        self.conn.request(method, path, payload, headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        elapsed = time.perf_counter() - start
+        for name, value in response.getheaders():
+            if name.lower() == 'set-cookie':
+                key, _, rest = value.partition('=')
+                value = rest.split(';', 1)[0]
+                if value:
+                    self.cookies[key] = value
+                else:
+                    self.cookies.pop(key, None)
+        body = gzip.decompress(data) if response.getheader('Content-Encoding') == 'gzip' else data
+        return response.status, body, len(data), len(self.cookies.get('session', '')), elapsed
+
+
+# ---------------------------------------------------------
+# 模擬プレイヤー
+# ---------------------------------------------------------
+class Recorder:
+    """ルートごとのレイテンシと大きさ"""
+
+    def __init__(self):
+        self.routes = {}
+        self.cookies = []
+        self.answers = 0
+        self.journeys = 0
+
+    def call(self, client, method, path, form=None, accept=None, label=None):
+        status, body, size, cookie, elapsed = client.request(method, path, form, accept)
+        if status >= 400:
+            raise RuntimeError(f'{method} {path}: {status}')
+        times, sizes = self.routes.setdefault(label or f'{method} {path}', ([], []))
+        times.append(elapsed)
+        sizes.append(size)
+        self.cookies.append(cookie)
+        return status, body
+
+    def merge(self, other):
+        for label, (times, sizes) in other.routes.items():
+            mine = self.routes.setdefault(label, ([], []))
+            mine[0].extend(times)
+            mine[1].extend(sizes)
+        self.cookies.extend(other.cookies)
+        self.answers += other.answers
+        self.journeys += other.journeys
+
+
+def play_journey(client, recorder, rng, answers, mode, options, json_api):
+    """1回の旅をゴールまで遊ぶ"""
+    call = recorder.call
+    call(client, 'POST', '/start', {'mode': mode})
+    _, page = call(client, 'GET', '/play')
+    question, speed, landmark = None, 0.0, False
+    for _ in range(MAX_REQUESTS):
+        if question is None:
+            if b'MISSION COMPLETE' in page:
+                break
+            if b'ARRIVED' in page:
+                status, page = call(client, 'POST', '/depart', {'mode': mode})
+                if status == 302:
+                    _, page = call(client, 'GET', '/play')
+                continue
+            match = QUESTION_ID_RE.search(page)
+            if match is None:
+                raise RuntimeError('出題画面ではありません')
+            question = match.group(1).decode('utf-8')
+            body = BODY_RE.search(page)
+            speed = float(body.group(1))
+            landmark = body.group(2) == b'1' and speed > float(body.group(3))
+
+        if rng.random() < options.emergency_rate:
+            call(client, 'POST', '/emergency_stop')
+            _, page = call(client, 'GET', '/play')
+            question = None
+            continue
+
+        correct = answers[question]
+        choice = correct if rng.random() < options.accuracy else rng.choice([c for c in range(1, 6) if c != correct])
+        form = {'choice': choice, 'client_speed': int(speed), 'got_landmark': '1' if landmark else '0'}
+        recorder.answers += 1
+        if json_api:
+            _, body = call(client, 'POST', '/answer', form, accept='application/json', label='POST /answer (json)')
+            data = json.loads(body)
+            speed = data.get('speed', speed)
+            if data.get('next'):
+                question = data['next']['id']
+                continue
+            _, page = call(client, 'GET', '/play')
+        else:
+            call(client, 'POST', '/answer', form)
+            call(client, 'POST', '/next')
+            _, page = call(client, 'GET', '/play')
+        question = None
+    else:
+        raise RuntimeError(f'{MAX_REQUESTS} 回のリクエストでゴールできませんでした')
+    recorder.journeys += 1
+
+
+def run_player(make_client, player, journeys, answers, options):
+    rng = random.Random(options.seed * 1000 + player)
+    recorder = Recorder()
+    json_api = rng.random() < options.json_share
+    for journey in range(journeys):
+        play_journey(make_client(), recorder, rng, answers, MODES[(player + journey) % len(MODES)], options, json_api)
+        if options.think:
+            time.sleep(rng.expovariate(1 / options.think))
+    return recorder
+
+
+# ---------------------------------------------------------
+# 実行と集計
+# ---------------------------------------------------------
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def summarize(recorder, seconds, cpu):
+    requests = sum(len(times) for times, _ in recorder.routes.values())
+    routes = {}
+    for label, (times, sizes) in sorted(recorder.routes.items()):
+        times = sorted(times)
+        routes[label] = dict(count=len(times), per_s=len(times) / seconds,
+                             mean_ms=sum(times) / len(times) * 1000, p50_ms=percentile(times, 0.50) * 1000,
+                             p95_ms=percentile(times, 0.95) * 1000, p99_ms=percentile(times, 0.99) * 1000,
+                             bytes_mean=sum(sizes) / len(sizes))
+    cookies = recorder.cookies or [0]
+    return dict(journeys=recorder.journeys, answers=recorder.answers, requests=requests, seconds=seconds,
+                requests_per_s=requests / seconds, answers_per_s=recorder.answers / seconds,
+                cpu_ms_per_answer=cpu / max(recorder.answers, 1) * 1000,
+                cookie_mean=sum(cookies) / len(cookies), cookie_max=max(cookies), routes=routes)
+
+
+def run_inprocess(options, env, answers):
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    import app
+    random.seed(options.seed)   # 山札のシャッフルも毎回同じにする
+    recorder = Recorder()
+    cpu_start, start = time.process_time(), time.perf_counter()
+    for player in range(options.journeys):
+        recorder.merge(run_player(lambda: InProcessClient(app.app), player, 1, answers, options))
+    return summarize(recorder, time.perf_counter() - start, time.process_time() - cpu_start)
+
+
+def server_cpu_seconds(pid):
+    """gunicorn のマスターとワーカー (子プロセス) の CPU 時間の合計"""
+    total = 0.0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return total
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def run_gunicorn(options, env, answers):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(options.workers),
+                               '--bind', f'{HOST}:{port}', '--log-level', 'warning', 'app:app'],
+                              cwd=ROOT, env=dict(os.environ, **env), stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(300):
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn が終了しました')
+            try:
+                socket.create_connection((HOST, port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        journeys = [options.journeys // options.players + (player < options.journeys % options.players)
+                    for player in range(options.players)]
+        recorder = Recorder()
+        cpu_start, start = server_cpu_seconds(server.pid), time.perf_counter()
+        with ThreadPoolExecutor(options.players) as pool:
+            futures = [pool.submit(run_player, lambda: HTTPClient(port), player, count, answers, options)
+                       for player, count in enumerate(journeys) if count]
+            for future in futures:
+                recorder.merge(future.result())
+        seconds = time.perf_counter() - start
+        cpu = server_cpu_seconds(server.pid) - cpu_start
+    finally:
+        server.terminate()
+        server.wait()
+    return summarize(recorder, seconds, cpu)
+
+
+def print_summary(name, result):
+    print(f'\n== {name}: 旅 {result["journeys"]} 回  回答 {result["answers"]:,}  リクエスト {result["requests"]:,}'
+          f'  {result["seconds"]:.1f}s ==')
+    print(f'{result["requests_per_s"]:,.0f} リクエスト/秒  {result["answers_per_s"]:,.0f} 回答/秒'
+          f'  CPU {result["cpu_ms_per_answer"]:.2f}ms/回答'
+          f'  Cookie 平均 {result["cookie_mean"]:.0f}B 最大 {result["cookie_max"]}B')
+    print(f'{"ルート":<22} {"回数":>7} {"p50":>8} {"p95":>8} {"p99":>8} {"応答":>8}')
+    for label, route in result['routes'].items():
+        print(f'{label:<22} {route["count"]:>7,} {route["p50_ms"]:>6.2f}ms {route["p95_ms"]:>6.2f}ms'
+              f' {route["p99_ms"]:>6.2f}ms {route["bytes_mean"]:>7.0f}B')
+
+
+# ---------------------------------------------------------
+# ベースラインとの比較
+# ---------------------------------------------------------
+def compare(results, baseline, threshold, size_threshold, min_ms, min_count):
+    """悪くなった値の一覧 (対象, ルート, 値の名前, ベースライン, 今回, 変化率) を返す"""
+    regressions = []
+
+    def check(target, route, metric, lower_is_better, old, new):
+        if old is None or new is None:
+            return
+        change = (new - old) / old if old else 0.0
+        worse = change if lower_is_better else -change
+        limit = size_threshold if metric in SIZE_METRICS else threshold
+        # ミリ秒の値は、ごく小さい差 (ばらつき) では印を付けない
+        if metric.endswith('_ms') and abs(new - old) < min_ms:
+            return
+        mark = '!!' if worse > limit else ''
+        if mark:
+            regressions.append((target, route, metric, old, new, change))
+        print(f'{mark:<3}{target:<10} {route or "-":<22} {metric:<18} {old:>10.2f} -> {new:>10.2f} ({change:+.1%})')
+
+    print('\n== ベースラインとの比較 ==')
+    for target, result in results.items():
+        base = baseline.get('targets', {}).get(target)
+        if base is None:
+            print(f'{target}: ベースラインにありません')
+            continue
+        for metric, lower_is_better in TARGET_METRICS:
+            check(target, None, metric, lower_is_better, base.get(metric), result.get(metric))
+        for label, route in result['routes'].items():
+            old = base['routes'].get(label)
+            if old is None:
+                continue
+            for metric, lower_is_better in ROUTE_METRICS:
+                # 回数の少ないルート (/start など) の時間はばらつきが大きいので比べない
+                if metric.endswith('_ms') and min(old['count'], route['count']) < min_count:
+                    continue
+                check(target, label, metric, lower_is_better, old.get(metric), route.get(metric))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', choices=('inprocess', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--journeys', type=int, default=8, help='対象ごとに遊ぶ旅の数')
+    parser.add_argument('--players', type=int, default=8, help='(gunicorn) 同時に遊ぶプレイヤーの数')
+    parser.add_argument('--workers', type=int, default=4, help='(gunicorn) ワーカーの数')
+    parser.add_argument('--accuracy', type=float, default=0.75)
+    parser.add_argument('--emergency-rate', type=float, default=0.002, help='出題ごとに緊急停止する確率')
+    parser.add_argument('--json-share', type=float, default=0.5, help='JSON API で答えるプレイヤーの割合')
+    parser.add_argument('--think', type=float, default=0.0, help='旅と旅の間の平均の待ち時間 (秒)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='結果を書く JSON ファイル')
+    parser.add_argument('--compare', help='比べるベースライン (以前の --output)')
+    parser.add_argument('--threshold', type=float, default=0.15, help='時間・スループットが何割悪くなったら印を付けるか')
+    parser.add_argument('--size-threshold', type=float, default=0.05, help='応答・Cookie の大きさの同じ閾値')
+    parser.add_argument('--min-ms', type=float, default=0.05, help='これより小さいレイテンシの差は無視する (ms)')
+    parser.add_argument('--min-count', type=int, default=100, help='レイテンシを比べるのに必要なリクエスト数')
+    options = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    csv_path = os.path.join(ROOT, os.environ.get('QUESTION_CSV', '67-76_hissu_004.csv'))
+    env = dict(EVENT_LOG='off', QUESTION_CSV=csv_path, QUESTION_MAP_PATH=os.path.join(tmpdir, 'questions.qbank'),
+               STATS_DB_PATH=os.path.join(tmpdir, 'stats.sqlite3'),
+               PLAYER_DB_PATH=os.path.join(tmpdir, 'players.sqlite3'),
+               ADAPTIVE_DB_PATH=os.path.join(tmpdir, 'adaptive.sqlite3'),
+               LEADERBOARD_DB_PATH=os.path.join(tmpdir, 'leaderboard.sqlite3'))
+    # app を読み込んだ場合は終了時に成績などを書き出すので、その後 (atexit は登録と逆順) に消す
+    atexit.register(shutil.rmtree, tmpdir, ignore_errors=True)
+    answers = load_answers(csv_path)
+    results = {}
+    # gunicorn を先に動かす (inprocess はこのプロセスに app を読み込むので、環境変数を書き換える)
+    if options.target in ('gunicorn', 'both'):
+        results['gunicorn'] = run_gunicorn(options, env, answers)
+    if options.target in ('inprocess', 'both'):
+        results['inprocess'] = run_inprocess(options, env, answers)
+
+    for name, result in results.items():
+        print_summary(name, result)
+
+    # 比べ方の設定 (閾値など) は結果の条件に入れない
+    record = dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'), revision=git_revision(),
+                  python=sys.version.split()[0], cpus=os.cpu_count(),
+                  options={key: value for key, value in vars(options).items() if key not in COMPARE_OPTIONS},
+                  targets=results)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=1)
+
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        differs = [key for key, value in baseline.get('options', {}).items()
+                   if key in record['options'] and record['options'][key] != value]
+        if differs:
+            print(f'\n注意: ベースラインと条件が違います ({", ".join(differs)})')
+        regressions = compare(results, baseline, options.threshold, options.size_threshold, options.min_ms,
+                              options.min_count)
+        if regressions:
+            print(f'\n悪くなった値: {len(regressions)} 件 (ベースライン {baseline.get("revision")} と比べて)')
+            sys.exit(1)
+        print(f'\n悪くなった値はありません (ベースライン {baseline.get("revision")})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""速度の規則の調整用: 合成したプレイヤーの旅を大量にシミュレーションする (simulator.py)
+
+アプリと同じ路線・名所・問題数・規則 (game_engine.py) で、モードごとに journeys 回の旅を進めて
+完走までの時間 (旅の時間)・名所を取れた割合・区間の長さ (再出題を含む回答数) を出す。
+SpeedModel の値は --max-speed / --miss-penalty / --landmark-speed などで差し替えられる。
+--check N では、同じ条件の旅を GameEngine と GameState で1問ずつ N 回進め、平均がシミュレーションと合うか確かめる。
+
+    python bench/simulate_journeys.py [旅の数] [--mode nozomi] [--accuracy 0.6] [--time-median 12] ...
+
+NumPy が必要 (requirements.txt には入れていない): pip install -r bench/requirements.txt
+"""
+import argparse
+import inspect
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_engine import LEG_SIZES, GameEngine, SpeedModel  # noqa: E402
+from game_state import GameState  # noqa: E402
+try:
+    from simulator import simulate, summarize  # noqa: E402
+except ImportError as e:
+    if e.name != 'numpy':
+        raise
+    sys.exit('simulate_journeys.py には NumPy が必要です: pip install -r bench/requirements.txt')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('journeys', nargs='?', type=int, default=1_000_000)
+    parser.add_argument('--mode', action='append', choices=list(LEG_SIZES), help='省略時は全モード')
+    parser.add_argument('--deck-size', type=int, help='山札の問題数 (省略時は今の問題集の問題数)')
+    parser.add_argument('--leg-size', type=int, help='区間の問題数 (省略時はモードごとの既定値)')
+    parser.add_argument('--accuracy', type=float, default=0.75, help='プレイヤーの正答率の平均')
+    parser.add_argument('--concentration', type=float, default=20.0,
+                        help='正答率のベータ分布の集中度 (大きいほど平均に集まる。0 なら全員同じ)')
+    parser.add_argument('--time-median', type=float, default=8.0, help='1回の回答時間の中央値 (秒)')
+    parser.add_argument('--time-sigma', type=float, default=0.5, help='回答時間 (対数正規分布) の広がり')
+    parser.add_argument('--emergency-rate', type=float, default=0.0, help='1回の回答ごとに緊急停止する確率')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', type=int, default=0, help='GameEngine で1問ずつ進める旅の数 (検算)')
+    # SpeedModel の引数はそのままオプションにする (--max-speed 300 など)
+    for name, param in inspect.signature(SpeedModel).parameters.items():
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, type=float, default=param.default)
+    return parser.parse_args()
+
+
+def engine_journeys(engine, deck_size, mode, count, args):
+    """GameEngine と GameState で1問ずつ旅を進める (シミュレーションと同じ仮定のプレイヤー)"""
+    rng = random.Random(args.seed)
+    totals = dict(play_time=0.0, answered=0, landmarks=0)
+    for _ in range(count):
+        if args.concentration > 0:
+            p = rng.betavariate(args.accuracy * args.concentration, (1 - args.accuracy) * args.concentration)
+        else:
+            p = args.accuracy
+        state = GameState(mode, rng.getrandbits(32), deck_size)
+        engine.start(state)
+        state.draw_leg(engine.leg_size(mode))
+        collected = set()
+        while True:
+            while not engine.leg_finished(state):
+                if engine.landmark_visible(state.current_station_idx, state.current_speed):
+                    collected.add(state.current_station_idx)
+                elapsed = args.time_median * math.exp(args.time_sigma * rng.gauss(0, 1))
+                engine.answer(state, rng.random() < p, state.current_speed, elapsed)
+                state.advance()
+                if args.emergency_rate and not engine.leg_finished(state) and rng.random() < args.emergency_rate:
+                    engine.emergency_stop(state)
+            if not engine.depart(state):
+                break
+            state.draw_leg(engine.leg_size(mode))
+        totals['play_time'] += state.play_time
+        totals['answered'] += state.total_answered
+        totals['landmarks'] += len(collected)
+    return {key: value / count for key, value in totals.items()}
+
+
+def main():
+    args = parse_args()
+    import app   # 路線・名所・問題集はアプリと同じものを使う
+
+    speed = SpeedModel(**{name: getattr(args, name) for name in inspect.signature(SpeedModel).parameters})
+    leg_sizes = {mode: args.leg_size or size for mode, size in LEG_SIZES.items()}
+    engine = GameEngine(app.ROUTE, app.LANDMARK_DATA, speed, leg_sizes)
+    deck_size = args.deck_size or len(app.BANKS.current.bank)
+
+    print(f'旅 {args.journeys:,} 回  山札 {deck_size} 問  正答率 {args.accuracy:.0%} (集中度 {args.concentration:g})'
+          f'  回答時間 中央値 {args.time_median:g}s (σ {args.time_sigma:g})  緊急停止 {args.emergency_rate:g}/回答')
+    for mode in args.mode or list(LEG_SIZES):
+        start = time.perf_counter()
+        result = simulate(engine, deck_size, args.journeys, mode, args.accuracy, args.concentration,
+                          args.time_median, args.time_sigma, args.emergency_rate, seed=args.seed)
+        elapsed = time.perf_counter() - start
+        s = summarize(result)
+        finish, minutes, answered, landmarks, legs = s['finish'], s['play_minutes'], s['answered'], s['landmarks'], s['legs']
+        print(f'\n== {mode} (区間 {engine.leg_size(mode)} 問)  {elapsed:.1f}s ({args.journeys / elapsed:,.0f} 旅/秒) ==')
+        print(f'ゴール: 終点 {finish["terminal"]:.1%}  問題切れ {finish["deck"]:.1%}  打ち切り {finish["cutoff"]:.1%}')
+        if minutes is not None:
+            print(f'旅の時間 (分): 平均 {minutes["mean"]:.1f}  p50 {minutes["p50"]:.1f}  p90 {minutes["p90"]:.1f}'
+                  f'  p99 {minutes["p99"]:.1f}')
+        print(f'回答数: 平均 {answered["mean"]:.0f}  p50 {answered["p50"]:.0f}  p99 {answered["p99"]:.0f}'
+              f'  (正答率 {s["accuracy"]:.1%})')
+        print(f'名所: 平均 {landmarks["mean"]:.2f} / {landmarks["of"]}  全部取れた旅 {landmarks["all"]:.1%}'
+              f'  通った名所の駅で取れた割合 {landmarks["rate_seen"]:.1%}')
+        print(f'区間: 1回の旅で {legs["per_journey"]:.1f} 区間  区間の回答数 平均 {legs["answers_mean"]:.1f}'
+              f'  p50 {legs["answers_p50"]}  p90 {legs["answers_p90"]}  p99 {legs["answers_p99"]}  最大 {legs["answers_max"]}')
+        if args.emergency_rate:
+            print(f'緊急停止: 1回の旅で平均 {s["stops"]:.2f} 回')
+        if args.check:
+            start = time.perf_counter()
+            check = engine_journeys(engine, deck_size, mode, args.check, args)
+            elapsed = time.perf_counter() - start
+            print(f'検算 (GameEngine で {args.check:,} 回, {args.check / elapsed:,.0f} 旅/秒): '
+                  f'旅の時間 {check["play_time"] / 60:.1f} 分 (シミュレーション {minutes["mean"]:.1f})'
+                  f'  回答数 {check["answered"]:.0f} ({answered["mean"]:.0f})'
+                  f'  名所 {check["landmarks"]:.2f} ({landmarks["mean"]:.2f})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""gunicorn のワーカー数とメモリ (ワーカー1つあたりの固有 RSS) の関係を測る
+
+2つの構成を、ワーカー 1・4・16 で起動して比べる。
+- per-worker: gunicorn -w N app:app (各ワーカーが app.py を読み込み、CSV から問題集を作る)
+- preload+mmap: gunicorn -c gunicorn.conf.py -w N app:app (マスターで1回だけ読み込み、問題集は mmap)
+
+問題集は合成した大規模なもの (既定 10万問。bench/bank_footprint.py と同じ作り方) を QUESTION_CSV で渡す。
+起動後、全ワーカーに出題画面を何度か出させてから /proc/<pid>/smaps_rollup を読み、
+USS (Private_Clean + Private_Dirty: そのワーカーだけが使っているメモリ) と PSS (共有分を按分したもの) を出す。
+
+    python bench/worker_rss.py [問題数] [ワーカー数 ...]
+"""
+import csv
+import http.client
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from bank_footprint import synthetic_rows  # noqa: E402
+
+HOST = '127.0.0.1'
+CONFIGS = {
+    # gunicorn はカレントディレクトリの gunicorn.conf.py を自動で読むので、per-worker では空の設定を渡す
+    'per-worker': dict(config=None, env=dict(QUESTION_BACKEND='memory')),
+    'preload+mmap': dict(config='gunicorn.conf.py', env={}),
+}
+
+
+def write_csv(path, size):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['番号', '回', '区分', 'ID', '設問', '選択肢1', '選択肢2', '選択肢3', '選択肢4', '選択肢5', '正答'])
+        writer.writerows(synthetic_rows(size))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def children(pid):
+    result = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            result.append(int(entry))
+    return result
+
+
+def memory(pid):
+    """smaps_rollup の Rss / Pss / USS (kB)"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if rest.strip().endswith('kB'):
+                values[name] = int(rest.split()[0])
+    return dict(rss=values['Rss'], pss=values['Pss'], uss=values['Private_Clean'] + values['Private_Dirty'])
+
+
+def play(port):
+    """1回分の旅を始めて出題画面を出す (Cookie は手で受け渡す)"""
+    conn = http.client.HTTPConnection(HOST, port, timeout=30)
+    body = urlencode({'mode': 'shinkansen'})
+    conn.request('POST', '/start', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    cookie = '; '.join(value.split(';', 1)[0] for name, value in response.getheaders() if name.lower() == 'set-cookie')
+    for _ in range(3):
+        conn.request('GET', '/play', headers={'Cookie': cookie})
+        conn.getresponse().read()
+    conn.close()
+
+
+def measure(name, workers, csv_path, tmpdir):
+    config = CONFIGS[name]
+    config_path = config['config']
+    if config_path is None:
+        config_path = os.path.join(tmpdir, 'empty.conf.py')
+        open(config_path, 'w').close()
+    port = free_port()
+    env = dict(os.environ, EVENT_LOG='off', QUESTION_CSV=csv_path, WEB_CONCURRENCY=str(workers),
+               QUESTION_MAP_PATH=os.path.join(tmpdir, 'questions.qbank'),
+               STATS_DB_PATH=os.path.join(tmpdir, 'stats.sqlite3'),
+               PLAYER_DB_PATH=os.path.join(tmpdir, 'players.sqlite3'),
+               ADAPTIVE_DB_PATH=os.path.join(tmpdir, 'adaptive.sqlite3'),
+               LEADERBOARD_DB_PATH=os.path.join(tmpdir, 'leaderboard.sqlite3'), **config['env'])
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', config_path, '-w', str(workers),
+                               '--bind', f'{HOST}:{port}', '--timeout', '300', '--log-level', 'warning', 'app:app'],
+                              cwd=os.path.dirname(ROOT), env=env, stdout=subprocess.DEVNULL)
+    try:
+        # 全ワーカーが立ち上がり、リクエストに答えるまで待つ
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn が終了しました')
+            try:
+                play(port)
+                if len(children(server.pid)) >= workers:
+                    break
+            except OSError:
+                time.sleep(0.1)
+        ready = time.monotonic() - start
+        # ワーカーごとに数十回は当たるように並行して出題させる
+        with ThreadPoolExecutor(max(4, workers)) as pool:
+            list(pool.map(lambda _: play(port), range(workers * 30)))
+        time.sleep(0.5)
+        stats = [memory(pid) for pid in children(server.pid)]
+        master = memory(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    count = len(stats)
+    return dict(ready=ready, uss=sum(s['uss'] for s in stats) / count, rss=sum(s['rss'] for s in stats) / count,
+                total_pss=master['pss'] + sum(s['pss'] for s in stats), master_uss=master['uss'])
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    worker_counts = [int(arg) for arg in sys.argv[2:]] or [1, 4, 16]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(tmpdir, 'questions.csv')
+        write_csv(csv_path, size)
+        print(f'問題集: {size:,} 問 (CSV {os.path.getsize(csv_path) / 1e6:.1f} MB)')
+        print(f'{"構成":<14} {"ワーカー":>8} {"起動":>7} {"USS/ワーカー":>13} {"RSS/ワーカー":>13}'
+              f' {"マスター USS":>13} {"PSS 合計":>10}')
+        for name in CONFIGS:
+            for workers in worker_counts:
+                result = measure(name, workers, csv_path, tmpdir)
+                print(f'{name:<14} {workers:>8} {result["ready"]:>6.1f}s {result["uss"] / 1024:>11.1f}MB'
+                      f' {result["rss"] / 1024:>11.1f}MB {result["master_uss"] / 1024:>11.1f}MB'
+                      f' {result["total_pss"] / 1024:>8.1f}MB')
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""レスポンスの圧縮
+
+Accept-Encoding を見て brotli (インストールされていれば) か gzip で本文を圧縮する。
+
+- 小さい本文 (MIN_SIZE 未満) は圧縮しても得をしないのでそのまま返す
+- 強い ETag が付いた応答 (静的ファイル・名所のスプライト) の圧縮結果は (パス, ETag, 形式) ごとに LRU で覚えておき、
+  2回目からは本文を読まずに返す。画面・JSON は毎回中身が違うのでその場で圧縮する
+  (ページキャッシュから返す画面は圧縮済みの本文を持っているので、ここでは何もしない)
+- 圧縮レベルは bench/bench_compression.py で実際の画面を圧縮して決めた値
+
+brotli は任意 (pip install brotli)。なければ gzip だけを使う。
+"""
+import gzip
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = 512
+# 静的ファイル (send_file の応答) はこの大きさまでならメモリに読んで圧縮する
+MAX_FILE_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript',
+                          'application/json', 'image/svg+xml'}
+
+
+def compress(body, encoding, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, gzip_level)
+
+
+def choose_encoding(accept_encodings):
+    """クライアントが受け付ける圧縮形式のうち使うもの (なければ None)"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+class ResponseCompressor:
+    """after_request で使う圧縮処理。ETag で中身が決まる応答の圧縮結果だけを LRU で持つ"""
+
+    def __init__(self, min_size=MIN_SIZE, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY,
+                 max_entries=512):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, key):
+        with self._lock:
+            data = self._cache.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def store(self, key, data):
+        with self._lock:
+            self._cache[key] = data
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def __call__(self, request, response):
+        """圧縮できる応答なら本文を差し替えて返す"""
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        if response.direct_passthrough and not (response.content_length or 0) <= MAX_FILE_SIZE:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        etag, weak = response.get_etag()
+        key = (request.path, etag, encoding) if etag and not weak else None
+        data = self.cached(key) if key is not None else None
+        if data is None:
+            response.direct_passthrough = False
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            data = compress(body, encoding, self.gzip_level, self.brotli_quality)
+            if key is not None:
+                self.store(key, data)
+        else:
+            # 覚えていた圧縮結果を返すので、ファイルは読まずに閉じる
+            if hasattr(response.response, 'close'):
+                response.response.close()
+            response.direct_passthrough = False
+        response.set_data(data)
+        response.content_encoding = encoding
+        # 圧縮前と同じ ETag のままだと別の表現と取り違えられるので、形式ごとに変えて照合し直す
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak)
+            response.make_conditional(request)
+        return response
@@ -0,0 +1,213 @@
+"""プレイ記録 (イベントログ)
+
+回答・出発・緊急停止などを1件ずつの dict (イベント) として記録する。
+リクエスト処理ではメモリ上のキューに積むだけで、ファイルへの書き込みは
+バックグラウンドのスレッドがまとめて (バッチで) 行うので、ディスク待ちでリクエストが止まらない。
+
+- キューには上限 (max_queue) があり、溢れた分は捨てて dropped に数える (メモリを使い切らない)
+- 書き出し先は JSONLSink (サイズでローテーションする JSONL ファイル) か SQLiteSink
+- プロセス終了時 (atexit) に残りを書き出してから止まる
+- gunicorn の fork 後は、各ワーカーが最初の記録の時に自分の書き出しスレッドを起動する
+"""
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class JSONLSink:
+    """1行1イベントの JSONL。ワーカーごとに events-<pid>.jsonl に書き、max_bytes を超えたら .1, .2 ... に回す"""
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, backups=5):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+        self._pid = None
+
+    def _path(self):
+        return os.path.join(self.directory, f'events-{self._pid}.jsonl')
+
+    def _open(self):
+        if self._file is None or self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+            self._file = open(self._path(), 'a', encoding='utf-8')
+        return self._file
+
+    def write(self, events):
+        f = self._open()
+        f.write(''.join(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n' for event in events))
+        f.flush()
+        if f.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        path = self._path()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{path}.{i}'):
+                os.replace(f'{path}.{i}', f'{path}.{i + 1}')
+        os.replace(path, f'{path}.1')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SQLiteSink:
+    """SQLite の events テーブルに書く (全ワーカーで同じファイルを共有できる)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def _connect(self):
+        # 書き出しスレッドからしか使わないので、接続は1本でよい
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                " id INTEGER PRIMARY KEY, ts REAL NOT NULL, kind TEXT NOT NULL, data TEXT NOT NULL)"
+            )
+        return self._conn
+
+    def write(self, events):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO events (ts, kind, data) VALUES (?, ?, ?)",
+                             [(event['ts'], event['kind'], json.dumps(event, ensure_ascii=False))
+                              for event in events])
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class EventLog:
+    """イベントをキューに積み、書き出しスレッドが batch_size 件ずつ (または flush_interval 秒ごとに) 書く"""
+
+    def __init__(self, sink, max_queue=10000, batch_size=500, flush_interval=1.0, on_write=None):
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_write = on_write      # 書き出した件数を受け取る関数 (メトリクス用)
+        self.emitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._closing = False
+        atexit.register(self.close)
+
+    def emit(self, kind, **fields):
+        """イベントを1件積む。キューが満杯なら捨てて False を返す (待たない)"""
+        if self._pid != os.getpid():
+            self._start_writer()
+        fields['kind'] = kind
+        fields['ts'] = time.time()
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.emitted += 1
+        return True
+
+    def _start_writer(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 前のキュー・スレッドは親プロセスのものなので作り直す
+            self._queue = queue.Queue(self.max_queue)
+            self._closing = False
+            self._thread = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        pending = self._queue
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    event = pending.get(timeout=timeout)
+                    if event is None:
+                        # 終了の合図: 残りを書いて、書き出し先もこのスレッドで閉じる
+                        self._write(batch + self._drain())
+                        self.sink.close()
+                        return
+                    batch.append(event)
+            except queue.Empty:
+                pass
+            self._write(batch)
+
+    def _drain(self):
+        events = []
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return events
+            if event is not None:
+                events.append(event)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            self.sink.write(batch)
+        except (OSError, sqlite3.Error):
+            # 書けなかった分は捨てる (リクエスト処理には影響させない)
+            self.errors += 1
+            self.dropped += len(batch)
+            return
+        self.written += len(batch)
+        if self.on_write is not None:
+            self.on_write(len(batch))
+
+    def close(self, timeout=5.0):
+        """残っているイベントを書き出して書き出しスレッドを止める"""
+        if self._pid != os.getpid() or self._closing:
+            return
+        self._closing = True
+        # 満杯でも終了の合図は届ける (待つのは終了時だけ)
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._pid = None
+
+    def stats(self):
+        return dict(emitted=self.emitted, dropped=self.dropped, written=self.written, errors=self.errors,
+                    queued=self._queue.qsize() if self._queue is not None else 0)
+
+
+def create_event_log(kind, path=None, **options):
+    """設定値からイベントログを作る。'off' なら None"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    if kind == 'jsonl':
+        return EventLog(JSONLSink(path or os.path.join(base_dir, 'events')), **options)
+    if kind == 'sqlite':
+        return EventLog(SQLiteSink(path or os.path.join(base_dir, 'events.sqlite3')), **options)
+    if kind == 'off':
+        return None
+    raise ValueError(f"未知のイベントログの書き出し先です: {kind}")
@@ -0,0 +1,114 @@
+"""ゲームの規則 (Flask にもセッションにも依存しない)
+
+速度・区間の問題数・再出題・名所・停車駅と緊急停止の規則をここにまとめ、app.py のルートはこれを呼ぶ。
+状態は GameState (game_state.py) をそのまま書き換えるので、アプリを起動しなくても旅を進められる。
+規則の値は SpeedModel / GameEngine の引数で変えられる (simulator.py は同じ値で大量の旅をまとめて試す)。
+"""
+
+# 区間の問題数 (モードごと)。知らないモードは超特急扱い (GameState の保存形式と同じ)
+LEG_SIZES = {'shinkansen': 7, 'nozomi': 28}
+# 1問あたり「旅の時間」に数える上限 (秒)。放置していた時間は数えない
+MAX_COUNTED_ELAPSED = 120
+# 緊急停止で区間を打ち切る時の出題キューの位置 (どの区間の長さよりも大きい値)
+STOPPED_QUIZ_IDX = 9999
+
+
+class SpeedModel:
+    """速度の規則 (km/h)。正解すると速く答えたほど加速し、間違えると減速する"""
+
+    def __init__(self, start_speed=50, depart_speed=100, max_speed=320, min_speed=30, bonus_base=50,
+                 bonus_per_second=2, min_bonus=10, miss_penalty=50, landmark_speed=200):
+        self.start_speed = start_speed            # 旅の始まりの速度
+        self.depart_speed = depart_speed          # 駅を出発した時の速度
+        self.max_speed = max_speed                # 正解で加速しても超えない速度
+        self.min_speed = min_speed                # 不正解で減速しても下回らない速度
+        self.bonus_base = bonus_base              # 正解の加速: max(min_bonus, bonus_base - 秒数 × bonus_per_second)
+        self.bonus_per_second = bonus_per_second
+        self.min_bonus = min_bonus
+        self.miss_penalty = miss_penalty          # 不正解の減速
+        self.landmark_speed = landmark_speed      # 名所の駅でこの速度を超えていれば名所を取れる
+
+    def bonus(self, elapsed):
+        return max(self.min_bonus, self.bonus_base - elapsed * self.bonus_per_second)
+
+    def after_answer(self, speed, correct, elapsed):
+        """回答後の速度"""
+        if correct:
+            return min(self.max_speed, speed + self.bonus(elapsed))
+        return max(self.min_speed, speed - self.miss_penalty)
+
+    def params(self):
+        return dict(vars(self))
+
+
+class GameEngine:
+    """1本の路線での旅の進め方"""
+
+    def __init__(self, route, landmark_stations=(), speed=None, leg_sizes=LEG_SIZES,
+                 max_counted_elapsed=MAX_COUNTED_ELAPSED):
+        self.route = route                        # RouteEngine
+        self.landmark_stations = frozenset(landmark_stations)
+        self.speed = speed or SpeedModel()
+        self.leg_sizes = dict(leg_sizes)
+        self.max_counted_elapsed = max_counted_elapsed
+
+    # --- 区間 ---
+    def leg_size(self, mode):
+        return self.leg_sizes.get(mode, self.leg_sizes['nozomi'])
+
+    def start(self, state):
+        """始発駅で出発する (最初の区間の問題は呼び出し側で引く)"""
+        state.current_speed = self.speed.start_speed
+        state.next_station_idx = self.route.next_stop(0, state.mode)
+
+    def leg_finished(self, state):
+        """区間の問題 (再出題を含む) をすべて答えたか"""
+        return state.quiz_idx >= state.queue_length()
+
+    def journey_finished(self, state):
+        """終点に着いたか、山札を引き切ったか"""
+        return self.route.is_terminal(state.current_station_idx) or state.deck_remaining() == 0
+
+    def depart(self, state, mode=None):
+        """次の区間へ出発する (mode を渡せば乗り換える)。旅が終わっていれば False
+
+        着いた駅を現在地にして次の停車駅を決める。次の区間の問題は呼び出し側で引く。
+        """
+        if mode:
+            state.mode = mode
+        state.current_station_idx = state.next_station_idx
+        if self.journey_finished(state):
+            return False
+        state.next_station_idx = self.route.next_stop(state.current_station_idx, state.mode)
+        state.current_speed = self.speed.depart_speed
+        return True
+
+    def emergency_stop(self, state):
+        """今の区間を打ち切り、手前の超特急停車駅 (なければ始発駅) に着いたことにする。その駅を返す"""
+        target = self.route.previous_express_stop(state.current_station_idx)
+        state.next_station_idx = target
+        state.quiz_idx = STOPPED_QUIZ_IDX
+        return target
+
+    # --- 回答 ---
+    def answer(self, state, correct, speed, elapsed):
+        """採点結果を状態に反映し、回答後の速度を返す (不正解の問題は区間の最後にもう一度出す)
+
+        speed は回答した時の速度 (画面に出ていた速度。オフライン区間ではサーバーで積み上げた値)。
+        """
+        elapsed = max(0.0, elapsed)
+        if correct:
+            state.score += 1
+        else:
+            state.requeue_current()
+        state.current_speed = self.speed.after_answer(speed, correct, elapsed)
+        state.total_answered += 1
+        state.play_time += min(elapsed, self.max_counted_elapsed)
+        return state.current_speed
+
+    def has_landmark(self, station_idx):
+        return station_idx in self.landmark_stations
+
+    def landmark_visible(self, station_idx, speed):
+        """この駅・速度なら名所が取れるか (画面では速度計がこの速度を超えた時に取れる)"""
+        return station_idx in self.landmark_stations and speed > self.speed.landmark_speed
@@ -0,0 +1,255 @@
+"""ゲーム進行状態のコンパクトなエンコード
+
+山札 (question_deck) を問題番号のリストとして持つ代わりに、
+「シャッフルのシード + 何枚引いたか (cursor)」だけを保存する。
+山札の i 枚目は Feistel 置換で O(1) に復元できるので、問題数がいくら増えても状態は固定長。
+
+区間の出題キュー (quiz_queue) も「区間の先頭位置 + 問題数」と、
+間違えて再出題待ちになっている問題 (区間内の位置) だけを持つ。
+
+回・区分で絞り込んだ旅では、絞り込み条件をビットマスクで持ち、
+山札は「絞り込んだ問題インデックスの配列 (deck)」を並べ替えたものになる。
+deck は保存せず、読み込み後にアプリ側で条件から復元して設定する。
+
+問題番号は旅を始めた時の問題集の版 (bank_version) のもの。問題集が読み直されても、
+旅はその版の問題集で問題番号を引き続ける (0 = 版の番号を持たない古いセッション)。
+
+アダプティブ出題 (苦手な問題を多めに出す) の旅では山札の並びをシードから復元できないので、
+区間ごとに選んだ山札位置と出題済みのビットマップはサーバー側 (adaptive_deck.AdaptiveDeckStore) に置き、
+状態にはその行を引くハンドル (deck_handle, 64bit) だけを持たせる (問題数が増えても状態は固定長のまま)。
+"""
+import base64
+import struct
+
+STATE_VERSION = 3
+
+MODE_CODES = {'shinkansen': 0, 'nozomi': 1}
+MODE_NAMES = {code: name for name, code in MODE_CODES.items()}
+
+# version, mode, seed, deck_size, cursor, leg_start, leg_len, quiz_idx, leg_misses,
+# current_station_idx, next_station_idx, score, total_answered, current_speed, question_start_time,
+# (v2〜) round_mask, category_mask, 再出題数, (v3〜) フラグ, 回答にかけた時間の合計, 問題集の版, アダプティブ出題のハンドル
+_HEADERS = {
+    1: struct.Struct('<BBIIIIBHHHHIIfdB'),
+    2: struct.Struct('<BBIIIIBHHHHIIfdQIB'),
+    3: struct.Struct('<BBIIIIBHHHHIIfdQIBBfIQ'),
+}
+_PENDING_FIELD = {1: 15, 2: 17, 3: 17}
+
+FLAG_ADAPTIVE = 1
+FLAG_UNRANKED = 2   # オフライン区間の問題 (正答つき) を渡した旅。ランキングに載せない
+
+# 再出題待ちは区間の問題数 (最大28) + 1 を超えないが、念のため上限を設ける
+MAX_PENDING = 255
+
+
+def _mix(value):
+    """32bit の整数ハッシュ (murmur3 の finalizer)"""
+    value ^= value >> 16
+    value = (value * 0x85EBCA6B) & 0xFFFFFFFF
+    value ^= value >> 13
+    value = (value * 0xC2B2AE35) & 0xFFFFFFFF
+    value ^= value >> 16
+    return value
+
+
+def permute(seed, size, position):
+    """seed で決まる 0..size-1 の並べ替えの position 番目を返す (Feistel + cycle walking)"""
+    if size <= 1:
+        return position
+    bits = max(2, (size - 1).bit_length())
+    bits += bits & 1
+    half = bits // 2
+    mask = (1 << half) - 1
+    value = position
+    while True:
+        left, right = value >> half, value & mask
+        for round_no in range(4):
+            left, right = right, left ^ (_mix(right ^ seed ^ (round_no * 0x9E3779B9)) & mask)
+        value = (left << half) | right
+        # 範囲外に出たら範囲内に戻るまで置換を繰り返す (平均 4 回未満)
+        if value < size:
+            return value
+
+
+class GameState:
+    """1回の旅の進行状態"""
+
+    __slots__ = ('mode', 'seed', 'deck_size', 'cursor', 'leg_start', 'leg_len', 'quiz_idx',
+                 'leg_misses', 'pending', 'current_station_idx', 'next_station_idx', 'score',
+                 'total_answered', 'current_speed', 'question_start_time', 'round_mask',
+                 'category_mask', 'deck', 'adaptive', 'leg_positions', 'drawn', 'deck_handle',
+                 'play_time', 'bank_version', 'unranked')
+
+    def __init__(self, mode, seed, deck_size):
+        self.mode = mode
+        self.seed = seed
+        self.deck_size = deck_size
+        self.cursor = 0            # 山札から引いた枚数
+        self.leg_start = 0         # 現在の区間の1問目が山札の何枚目か
+        self.leg_len = 0           # 現在の区間で山札から引いた問題数
+        self.quiz_idx = 0          # 出題キュー上の現在位置
+        self.leg_misses = 0        # この区間でキュー末尾に追加された (間違えた) 回数
+        self.pending = []          # まだ出題されていない再出題 (区間内の位置)
+        self.current_station_idx = 0
+        self.next_station_idx = 0
+        self.score = 0
+        self.total_answered = 0
+        self.current_speed = 50
+        self.question_start_time = 0.0
+        self.round_mask = 0        # 出題する回 (0 = 絞り込みなし)
+        self.category_mask = 0     # 出題する区分 (0 = 絞り込みなし)
+        self.deck = None           # 絞り込み後の問題インデックス配列 (保存しない)
+        self.adaptive = False      # アダプティブ出題か
+        self.leg_positions = None  # (アダプティブ) 現在の区間の山札位置 (保存しない。ハンドルで引く)
+        self.drawn = None          # (アダプティブ) 出題済みの山札位置のビットマップ (区間を選ぶ時だけ読む。保存しない)
+        self.deck_handle = 0       # (アダプティブ) サーバー側の山札の状態を引くハンドル
+        self.play_time = 0.0       # 回答にかけた時間の合計 (秒)。ランキングの「旅の時間」
+        self.bank_version = 0      # 問題番号を引く問題集の版 (0 = 今の版)
+        self.unranked = False      # オフライン区間で遊んだ旅 (ランキングに載せない)
+
+    # --- 山札 ---
+    def deck_remaining(self):
+        return self.deck_size - self.cursor
+
+    def deck_at(self, position):
+        """山札の position 枚目の問題インデックス"""
+        shuffled = permute(self.seed, self.deck_size, position)
+        return shuffled if self.deck is None else self.deck[shuffled]
+
+    def deck_index(self, position):
+        """山札位置 (絞り込み後の番号) を問題インデックスに変換する"""
+        return position if self.deck is None else self.deck[position]
+
+    def draw_leg(self, count):
+        """山札から次の区間分の問題を取り出す（足りない場合はあるだけ）"""
+        count = min(count, self.deck_remaining())
+        self._start_leg(count)
+
+    def set_leg(self, positions):
+        """(アダプティブ) 選んだ山札位置を次の区間の問題にする"""
+        self.mark_drawn(positions)
+        self.leg_positions = list(positions)
+        self._start_leg(len(positions))
+
+    def clear_drawn(self):
+        """(アダプティブ) 出題済みの山札位置を空にする (山札1問1ビット)"""
+        self.drawn = bytearray((self.deck_size + 7) // 8)
+
+    def mark_drawn(self, positions):
+        """(アダプティブ) 山札位置を出題済みにする"""
+        if self.drawn is None:
+            self.clear_drawn()
+        for position in positions:
+            self.drawn[position >> 3] |= 1 << (position & 7)
+
+    def is_drawn(self, position):
+        drawn = self.drawn
+        return drawn is not None and position >> 3 < len(drawn) and bool(drawn[position >> 3] >> (position & 7) & 1)
+
+    def _start_leg(self, count):
+        self.leg_start = self.cursor
+        self.leg_len = count
+        self.cursor += count
+        self.quiz_idx = 0
+        self.leg_misses = 0
+        self.pending = []
+
+    # --- 出題キュー ---
+    def queue_length(self):
+        return self.leg_len + self.leg_misses
+
+    def queue_offset(self, idx):
+        """出題キューの idx 番目が区間内の何問目か"""
+        if idx < self.leg_len:
+            return idx
+        first_pending = self.queue_length() - len(self.pending)
+        return self.pending[idx - first_pending]
+
+    def question_index(self, idx):
+        """出題キューの idx 番目の問題インデックス"""
+        offset = self.queue_offset(idx)
+        if self.leg_positions is not None:
+            return self.deck_index(self.leg_positions[offset])
+        return self.deck_at(self.leg_start + offset)
+
+    def current_question_index(self):
+        return self.question_index(self.quiz_idx)
+
+    def requeue_current(self):
+        """今の問題をキューの末尾に追加（再出題）"""
+        if len(self.pending) >= MAX_PENDING:
+            return
+        self.pending.append(self.queue_offset(self.quiz_idx))
+        self.leg_misses += 1
+
+    def advance(self):
+        """次の問題へ。出題済みになった再出題は捨てる"""
+        self.quiz_idx += 1
+        first_pending = self.queue_length() - len(self.pending)
+        consumed = min(len(self.pending), max(0, self.quiz_idx - first_pending))
+        del self.pending[:consumed]
+
+
+def encode_state(state):
+    flags = (FLAG_ADAPTIVE if state.adaptive else 0) | (FLAG_UNRANKED if state.unranked else 0)
+    header = _HEADERS[STATE_VERSION].pack(
+        STATE_VERSION, MODE_CODES.get(state.mode, 1), state.seed, state.deck_size, state.cursor,
+        state.leg_start, state.leg_len, min(state.quiz_idx, 0xFFFF), state.leg_misses,
+        state.current_station_idx, state.next_station_idx, state.score, state.total_answered,
+        state.current_speed, state.question_start_time, state.round_mask, state.category_mask,
+        len(state.pending), flags, state.play_time, state.bank_version, state.deck_handle,
+    )
+    return base64.urlsafe_b64encode(header + bytes(state.pending)).decode('ascii')
+
+
+def decode_state(text):
+    """encode_state の逆。古いバージョンはそのまま読み替え、壊れている・未知のバージョンなら None"""
+    try:
+        raw = base64.urlsafe_b64decode(text.encode('ascii'))
+        header = _HEADERS.get(raw[0]) if raw else None
+        if header is None:
+            return None
+        fields = header.unpack_from(raw)
+        state = _decode_fields(fields)
+        state.pending = list(raw[header.size:header.size + fields[_PENDING_FIELD[fields[0]]]])
+    except (ValueError, struct.error, AttributeError):
+        return None
+    return state
+
+
+def _decode_fields(fields):
+    state = GameState(MODE_NAMES.get(fields[1], 'nozomi'), fields[2], fields[3])
+    (state.cursor, state.leg_start, state.leg_len, state.quiz_idx, state.leg_misses,
+     state.current_station_idx, state.next_station_idx, state.score, state.total_answered,
+     state.current_speed, state.question_start_time) = fields[4:15]
+    if fields[0] >= 2:
+        state.round_mask, state.category_mask = fields[15:17]
+    if fields[0] >= 3:
+        flags, state.play_time, state.bank_version, state.deck_handle = fields[18:22]
+        state.adaptive = bool(flags & FLAG_ADAPTIVE)
+        state.unranked = bool(flags & FLAG_UNRANKED)
+    return state
+
+
+def migrate_legacy_session(data, seed, bank_size):
+    """問題リストをそのまま持っていた旧形式のセッションから GameState を作る
+
+    旧形式の山札は並び順を再現できないので新しいシードで引き直すが、
+    残り枚数・区間の残り問題数・スコア・現在地はそのまま引き継ぐ。
+    """
+    state = GameState(data.get('mode') or 'shinkansen', seed, bank_size)
+    deck = data.get('question_deck', [])
+    queue = data.get('quiz_queue', [])
+    idx = data.get('current_quiz_idx', 0)
+    remaining_in_leg = min(max(0, len(queue) - idx), 255)
+    state.leg_len = remaining_in_leg
+    state.cursor = max(0, bank_size - len(deck))
+    state.leg_start = max(0, state.cursor - remaining_in_leg)
+    state.current_station_idx = data.get('current_station_idx', 0)
+    state.next_station_idx = data.get('next_station_idx', 0)
+    state.score = data.get('score', 0)
+    state.total_answered = data.get('total_answered_count', 0)
+    state.current_speed = data.get('current_speed', 50)
+    state.question_start_time = data.get('question_start_time', 0.0)
+    return state
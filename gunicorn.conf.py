@@ -0,0 +1,67 @@
+"""本番用の gunicorn 設定 (このディレクトリで gunicorn app:app とすれば自動で読まれる)
+
+- preload_app: app.py はマスターで1回だけ読み込み、ワーカーは fork で受け継ぐ
+- 問題集は mmap 版 (QUESTION_BACKEND=mmap)。バイナリファイルの書き出しはマスターで1回だけ行い、
+  ワーカーは同じページキャッシュを読むだけなので、ワーカーを増やしても問題集の分のメモリは増えない
+- 読み込み中は GC を止め、読み込みが済んだら gc.freeze() で、それまでに作ったオブジェクトを GC の対象から外す。
+  ワーカーの GC が共有ページ上のオブジェクトの GC ヘッダーを書き換えて、ページがコピーされるのを防ぐ
+- METRICS_DIR を指定した場合: 起動時に前回の集計ファイルを消し、終了したワーカーの集計は
+  metrics-archived.json に足し込んでから消す (metrics.py)
+- ワーカーは既定で同期ワーカー WEB_CONCURRENCY 個 (既定 4)。mmap の問題集を全ワーカーで共有するための構成で、
+  GUNICORN_THREADS を 2 以上にすると gthread (ワーカーごとにスレッド) になる
+- レースモードは GUNICORN_RACES=1 で起動した時だけ使える (オプトイン)。部屋はプロセス内にだけあり、
+  SSE の接続は待っている間ずっと開いたままなので、gevent のワーカー1つで動かす
+  (Python のコードは CPU 1つ分しか使えない)。gevent の monkey patch は、preload でアプリを読み込む前
+  (この設定ファイルを読んだ時点) に当てるので、マスターで作ったロックも gevent のものになる。
+  それ以外の構成では /race は 503 で断り、メニューにもレースを出さない (post_fork で RACE_ENABLED を決める。
+  同期ワーカーでも、ワーカー1つで GUNICORN_THREADS を増やせばレースを受け付ける)
+- ワーカーの種類はこのファイルでだけ決める。コマンドラインの -k / --worker-class での上書きには対応しない
+  (monkey patch を当てるかどうかと食い違うので、起動時に止める)。-w で数を変えるのはよい
+"""
+import gc
+import os
+import sys
+
+os.environ.setdefault('QUESTION_BACKEND', 'mmap')
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+preload_app = True
+
+if os.environ.get('GUNICORN_RACES') == '1':
+    worker_class = 'gevent'
+    workers = 1
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+    from gevent import monkey
+    monkey.patch_all()
+else:
+    threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+    worker_class = 'gthread' if threads > 1 else 'sync'
+    workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+
+gc.disable()
+
+
+def on_starting(server):
+    if server.cfg.worker_class_str != worker_class:
+        server.log.error("ワーカーの種類は gunicorn.conf.py で決めます (-k %s には対応しません)。"
+                         "レースモードは GUNICORN_RACES=1 で起動してください", server.cfg.worker_class_str)
+        sys.exit(1)
+    from metrics import wipe_directory
+    wipe_directory(os.environ.get('METRICS_DIR'))
+
+
+def when_ready(server):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+    # -w / --threads をコマンドラインで変えた場合も含め、実際の構成でレースを受け付けるか決める
+    cfg = server.cfg
+    single = cfg.workers == 1 and (cfg.worker_class_str == 'gevent' or cfg.threads > 1)
+    os.environ['RACE_ENABLED'] = '1' if single else '0'
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(os.environ.get('METRICS_DIR'), worker.pid)
@@ -0,0 +1,242 @@
+"""ランキング (完走した旅の正答率順・時間順)
+
+モード (各駅停車 / 超特急) と出題範囲 (回・区分の絞り込み) ごとに、
+正答率順 (同率なら時間の短い順) と時間順 (同じなら正答率の高い順) の2つの順位表を持つ。
+
+- 順位表は SortedRuns (小さなソート済みリストを並べたもの + リストの長さの Fenwick 木)。
+  追加・「自分は何位か」は O(log n)、上位 K 件は O(K)。100万件でも1回あたり数マイクロ秒。
+- 1件の記録は1つの整数 (キー) にまとめる: 並べ替えの第1・第2キー、完走時刻 (同点なら先に完走した方が上)、
+  回答数、正解数。整数の大小がそのまま順位になり、表示に要る値もキーから戻せる。
+- 記録の SQLite (leaderboard_runs テーブル) への書き込みは flush_interval 秒ごとにまとめて行う。
+  その時に他のワーカーが書いた分も読み込むので、複数ワーカーでも順位表は最大 flush_interval 秒遅れで揃う。
+"""
+import bisect
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from itertools import chain, islice
+
+from sqlite_conn import ProcessConnection
+
+METRICS = ('accuracy', 'time')
+
+_MILLION = 1_000_000
+_MASK20 = (1 << 20) - 1
+_MASK32 = (1 << 32) - 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leaderboard_runs (
+    id INTEGER PRIMARY KEY,
+    origin TEXT NOT NULL, mode TEXT NOT NULL, round_mask INTEGER NOT NULL, category_mask INTEGER NOT NULL,
+    score INTEGER NOT NULL, total_answered INTEGER NOT NULL, play_time REAL NOT NULL, finished_at REAL NOT NULL,
+    player_id TEXT
+)
+"""
+_RUN_COLUMNS = ('origin', 'mode', 'round_mask', 'category_mask', 'score', 'total_answered', 'play_time',
+                'finished_at', 'player_id')
+
+
+# ---------------------------------------------------------
+# 1件の記録 <-> 整数キー (小さいほど上位)
+# ---------------------------------------------------------
+def run_key(metric, score, total_answered, play_time, finished_at):
+    answered = max(1, min(total_answered, _MASK20))
+    miss = _MILLION - min(score, answered) * _MILLION // answered    # 誤答率 (ppm)
+    tenths = min(int(play_time * 10), _MASK32)                        # 時間 (0.1秒単位)
+    first, second = (miss, tenths) if metric == 'accuracy' else (tenths, miss)
+    key = first << 32 | second
+    key = key << 32 | min(int(finished_at), _MASK32)
+    return (key << 20 | answered) << 20 | min(score, answered)
+
+
+def decode_key(metric, key):
+    score = key & _MASK20
+    answered = key >> 20 & _MASK20
+    finished_at = key >> 40 & _MASK32
+    first, second = key >> 104, key >> 72 & _MASK32
+    miss, tenths = (first, second) if metric == 'accuracy' else (second, first)
+    return dict(score=score, total_answered=answered, accuracy=(_MILLION - miss) / _MILLION,
+                play_time=tenths / 10, finished_at=finished_at)
+
+
+# ---------------------------------------------------------
+# 順位表
+# ---------------------------------------------------------
+class SortedRuns:
+    """ソート済みの整数の列。add / rank が O(log n)
+
+    LOAD 件前後の小さなソート済みリストに分けて持ち (挿入でずらすのは1つのリストの中だけ)、
+    各リストの長さを Fenwick 木に入れて「あるリストより前に何件あるか」を O(log n) で数える。
+    """
+
+    LOAD = 1000
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._lists = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes = [chunk[-1] for chunk in self._lists]
+        self._len = len(keys)
+        self._tree = None
+
+    def __len__(self):
+        return self._len
+
+    def add(self, key):
+        self._len += 1
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._tree = None
+            return
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._lists[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            bisect.insort(self._lists[pos], key)
+        if len(self._lists[pos]) > 2 * self.LOAD:
+            # 大きくなったリストは半分に分ける (Fenwick 木は次に数える時に作り直す)
+            chunk = self._lists[pos]
+            self._lists[pos:pos + 1] = [chunk[:self.LOAD], chunk[self.LOAD:]]
+            self._maxes[pos:pos + 1] = [chunk[self.LOAD - 1], chunk[-1]]
+            self._tree = None
+        elif self._tree is not None:
+            i = pos + 1
+            while i < len(self._tree):
+                self._tree[i] += 1
+                i += i & -i
+
+    def _build_tree(self):
+        tree = [0] + [len(chunk) for chunk in self._lists]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def rank(self, key):
+        """key より小さい (上位の) 件数"""
+        if not self._lists:
+            return 0
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        if self._tree is None:
+            self._build_tree()
+        before = 0
+        i = pos
+        while i > 0:
+            before += self._tree[i]
+            i -= i & -i
+        return before + bisect.bisect_left(self._lists[pos], key)
+
+    def top(self, count):
+        return list(islice(chain.from_iterable(self._lists), count))
+
+
+class Leaderboard:
+    """モード・出題範囲ごとの順位表と、SQLite へのまとめ書き"""
+
+    def __init__(self, db_path, flush_interval=5.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._origin = (None, None)           # (pid, 印)。このプロセスが書いた行の印 (他のワーカーの行だけ読み込むため)
+        self._boards = {}                     # (mode, round_mask, category_mask, metric) -> SortedRuns
+        self._pending = []
+        self._last_id = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._db = ProcessConnection(db_path)
+        with self._db.use() as conn:
+            conn.execute(_SCHEMA)
+        self.load()
+
+    @property
+    def origin(self):
+        # fork したワーカーごとに別の印を使う
+        if self._origin[0] != os.getpid():
+            self._origin = (os.getpid(), secrets.token_hex(8))
+        return self._origin[1]
+
+    def load(self):
+        """記録をすべて読み込んで順位表を作り直す (まとめてソートするので1件ずつ足すより速い)"""
+        groups = {}
+        last_id = 0
+        with self._db.use() as conn:
+            rows = conn.execute(
+                "SELECT id, mode, round_mask, category_mask, score, total_answered, play_time, finished_at"
+                " FROM leaderboard_runs ORDER BY id").fetchall()
+        for row in rows:
+            last_id, mode, round_mask, category_mask, score, answered, play_time, finished_at = row
+            for metric in METRICS:
+                groups.setdefault((mode, round_mask, category_mask, metric), []).append(
+                    run_key(metric, score, answered, play_time, finished_at))
+        with self._lock:
+            self._boards = {board: SortedRuns(keys) for board, keys in groups.items()}
+            self._last_id = last_id
+
+    def _add(self, mode, round_mask, category_mask, score, answered, play_time, finished_at):
+        ranks = {}
+        for metric in METRICS:
+            board = self._boards.get((mode, round_mask, category_mask, metric))
+            if board is None:
+                board = self._boards[(mode, round_mask, category_mask, metric)] = SortedRuns()
+            key = run_key(metric, score, answered, play_time, finished_at)
+            board.add(key)
+            ranks[metric] = board.rank(key) + 1
+        return ranks
+
+    def record(self, mode, round_mask, category_mask, score, total_answered, play_time, player_id=None):
+        """完走を記録して、{'accuracy': 順位, 'time': 順位, 'total': 件数} を返す"""
+        finished_at = time.time()
+        with self._lock:
+            ranks = self._add(mode, round_mask, category_mask, score, total_answered, play_time, finished_at)
+            ranks['total'] = len(self._boards[(mode, round_mask, category_mask, 'accuracy')])
+            self._pending.append((self.origin, mode, round_mask, category_mask, score, total_answered, play_time,
+                                  finished_at, player_id))
+        return ranks
+
+    def top(self, mode, round_mask, category_mask, metric='accuracy', count=10):
+        with self._lock:
+            board = self._boards.get((mode, round_mask, category_mask, metric))
+            keys = board.top(count) if board is not None else []
+        return [dict(rank=i + 1, **decode_key(metric, key)) for i, key in enumerate(keys)]
+
+    def size(self, mode, round_mask, category_mask):
+        with self._lock:
+            board = self._boards.get((mode, round_mask, category_mask, 'accuracy'))
+            return len(board) if board is not None else 0
+
+    # --- 書き出し ---
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """たまった記録を書き出し、他のワーカーが書いた記録を順位表に取り込む"""
+        self._last_flush = time.monotonic()
+        with self._lock:
+            pending, self._pending = self._pending, []
+        try:
+            if pending:
+                with self._db.transaction() as conn:
+                    conn.executemany(
+                        f"INSERT INTO leaderboard_runs ({', '.join(_RUN_COLUMNS)})"
+                        f" VALUES ({', '.join('?' * len(_RUN_COLUMNS))})", pending)
+            with self._db.use() as conn:
+                rows = conn.execute(
+                    "SELECT id, origin, mode, round_mask, category_mask, score, total_answered, play_time, finished_at"
+                    " FROM leaderboard_runs WHERE id > ? ORDER BY id", (self._last_id,)).fetchall()
+        except sqlite3.Error:
+            with self._lock:
+                self._pending[:0] = pending
+            return
+        origin = self.origin
+        with self._lock:
+            for row_id, row_origin, *run in rows:
+                if row_origin != origin:
+                    self._add(*run)
+                self._last_id = max(self._last_id, row_id)
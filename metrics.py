@@ -0,0 +1,201 @@
+"""軽量なメトリクス (Prometheus テキスト形式)
+
+カウンタとヒストグラムをプロセス内の dict で数え、/metrics で Prometheus のテキスト形式にして返す。
+1回の記録は「ロック1回 + dict の足し算」だけなので、リクエストごとに何回呼んでも負担は小さい。
+
+gunicorn の複数ワーカーで動かす場合は、METRICS_DIR (全ワーカー共通のディレクトリ) を指定すると、
+各ワーカーが自分の集計を metrics-<pid>-<乱数>.json として定期的 (既定 1 秒ごと) に書き出し、
+/metrics を受けたワーカーが全ファイルを足し合わせて返す (prometheus_client の multiprocess モードと同じ考え方)。
+- ファイル名にはプロセスごとの乱数も付けるので、pid が使い回されても (コンテナの再起動など) 前のファイルを上書きしない
+- 終了したワーカーのファイルはマスターが mark_process_dead で metrics-archived.json に足し込んでから消すので、
+  カウンタはワーカーが入れ替わっても減らず、ファイルも増え続けない
+- マスターの起動時に wipe_directory で前回の分を消す (gunicorn.conf.py の on_starting / child_exit)
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+# 秒単位のヒストグラムの既定の区切り
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+ARCHIVE_FILE = 'metrics-archived.json'
+
+
+class Counter:
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # ラベル値のタプル -> 値
+
+    def inc(self, *labels, amount=1):
+        with self.registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Histogram:
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # ラベル値のタプル -> [区切りごとの件数 ... , +Inf の件数, 合計]
+
+    def observe(self, value, *labels):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[slot] += 1
+            entry[-1] += value
+
+
+class Registry:
+    """メトリクスの登録先。METRICS_DIR を渡すとワーカー間で集計を共有する"""
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._last_flush = 0.0
+        self._process = None                 # (pid, ファイル名)。fork したら作り直す
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(self, name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(self, name, help_text, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    # --- ワーカー間の共有 ---
+    def snapshot(self):
+        """このプロセスの集計 (JSON にできる形)"""
+        with self.lock:
+            return {metric.name: [[list(labels), value] for labels, value in metric.values.items()]
+                    for metric in self.metrics}
+
+    def _path(self):
+        pid = os.getpid()
+        if self._process is None or self._process[0] != pid:
+            self._process = (pid, f'metrics-{pid}-{uuid.uuid4().hex[:12]}.json')
+        return os.path.join(self.directory, self._process[1])
+
+    def flush(self):
+        if not self.directory:
+            return
+        self._last_flush = time.monotonic()
+        path = self._path()
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def maybe_flush(self):
+        """前回の書き出しから flush_interval 秒経っていれば書き出す (リクエストの終わりに呼ぶ)"""
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def collect(self):
+        """全ワーカーの集計を足し合わせる。共有しない場合はこのプロセスの分だけ"""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        return _merge_files(glob.glob(os.path.join(self.directory, 'metrics-*.json')))
+
+    # --- 出力 ---
+    def render(self):
+        """Prometheus のテキスト形式 (text/plain; version=0.0.4)"""
+        data = self.collect()
+        lines = []
+        for metric in self.metrics:
+            kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {kind}')
+            for labels, value in sorted(data.get(metric.name, []), key=lambda item: item[0]):
+                pairs = [f'{name}="{_escape(label)}"' for name, label in zip(metric.labelnames, labels)]
+                if kind == 'counter':
+                    lines.append(f'{metric.name}{_labels(pairs)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le = 'le="{}"'.format(bound if bound == '+Inf' else _number(bound))
+                    lines.append(f'{metric.name}_bucket{_labels(pairs + [le])} {cumulative}')
+                lines.append(f'{metric.name}_sum{_labels(pairs)} {_number(value[-1])}')
+                lines.append(f'{metric.name}_count{_labels(pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+# ---------------------------------------------------------
+# ワーカーのファイルの片付け (gunicorn のマスターから呼ぶ)
+# ---------------------------------------------------------
+def _merge_files(paths):
+    merged = {}
+    for path in paths:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in data.items():
+            totals = merged.setdefault(name, {})
+            for labels, value in series:
+                key = tuple(labels)
+                if isinstance(value, list):
+                    current = totals.get(key)
+                    totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+    return {name: [[list(labels), value] for labels, value in totals.items()] for name, totals in merged.items()}
+
+
+def wipe_directory(directory):
+    """前回の起動で書かれた集計ファイルを消す (マスターの起動時に、ワーカーを起動する前に呼ぶ)"""
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json*')):
+        os.remove(path)
+
+
+def mark_process_dead(directory, pid):
+    """終了したワーカーのファイルを metrics-archived.json に足し込んで消す (マスターが1つずつ呼ぶ)"""
+    if not directory:
+        return
+    dead = glob.glob(os.path.join(directory, f'metrics-{pid}-*.json'))
+    if not dead:
+        return
+    archive = os.path.join(directory, ARCHIVE_FILE)
+    data = _merge_files([archive] + dead)
+    tmp_path = f'{archive}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, archive)
+    for path in dead:
+        os.remove(path)
+
+
+def _labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,70 @@
+"""描画済みページのキャッシュ
+
+メニュー (名所コレクションの組み合わせ 2^8 通り) や到着・ゴール画面のように、
+描画結果が少数の値だけで決まる画面は、値の組をキーにして描画済みの HTML を保存しておき、
+2回目からはテンプレートを通さずにそのまま返す。gzip 版 (brotli があればその版も) も保存時に1回だけ作る。
+本文のハッシュを ETag にするので、同じページの再読み込みには 304 で答えられる。
+
+キャッシュには「版 (version)」を持たせ、テンプレートや名所データが変わって版が変わったら丸ごと捨てる。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from compression import brotli, compress
+
+
+class CachedPage:
+    """描画済みの HTML と、その圧縮版 (形式 -> バイト列)"""
+
+    __slots__ = ('body', 'etag', 'encoded')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.encoded = {'gzip': compress(body, 'gzip')}
+        if brotli is not None:
+            self.encoded['br'] = compress(body, 'br')
+
+
+class PageCache:
+    """キー -> CachedPage の LRU。版が変わったら全件捨てる"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, version, key, render):
+        """key の描画済みページを返す。なければ render() (str を返す) で描画して保存する"""
+        with self._lock:
+            if version != self.version:
+                self._data.clear()
+                self.version = version
+            page = self._data.get(key)
+            if page is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return page
+            self.misses += 1
+
+        # 描画はロックの外で行う (同じキーを同時に描画しても結果は同じ)
+        page = CachedPage(render().encode('utf-8'))
+        with self._lock:
+            if version == self.version:
+                self._data[key] = page
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.version = None
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,237 @@
+"""プレイヤープロフィール (旅の続き・名所コレクション・完走の記録)
+
+セッション (Cookie) が消えても旅を続けられるように、希望したプレイヤーだけ
+SQLite の players テーブルに進み具合を保存する。
+
+- 書き込みはライトビハインド: 回答のたびに DB へは書かず、メモリ上のプロフィールを書き換えて
+  書き換えた列を覚えておくだけ。flush_interval 秒ごとに、変更のあったプロフィールを
+  1行ずつ (何回書き換えても1回の UPSERT に) まとめて書き出す。
+- 書き出すのは書き換えた列だけ。回数 (games_started / games_completed) は増分を足し、
+  best_score は大きい方、名所 (landmarks) はビットの和を取るので、別のワーカーが同じプレイヤーを
+  同時に書き換えても、それぞれの増分は消えない (旅の続きなど、それ以外の列は後から書いた方になる)。
+- 読み込みは1回の SELECT (旅の続きに必要な値はすべて players の1行にある)。
+  読んだプロフィールはメモリに置いて使い回す (max_entries を超えたら、書き出し済みの古いものから外す)。
+- 複数ワーカーで動かす場合、別のワーカーの変更は最大 flush_interval + cache_ttl 秒遅れて見える。
+"""
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_conn import ProcessConnection
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    player_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL, updated_at REAL NOT NULL,
+    landmarks INTEGER NOT NULL DEFAULT 0, review TEXT,  -- review: 復習表のキー (adaptive_deck)
+    journey TEXT, journey_mode TEXT, journey_station INTEGER, journey_score INTEGER,
+    offline INTEGER NOT NULL DEFAULT 0,
+    games_started INTEGER NOT NULL DEFAULT 0, games_completed INTEGER NOT NULL DEFAULT 0,
+    best_score INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS player_history (
+    id INTEGER PRIMARY KEY,
+    player_id TEXT NOT NULL, finished_at REAL NOT NULL,
+    game INTEGER, mode TEXT, score INTEGER, total_answered INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_player_history ON player_history (player_id, finished_at);
+"""
+
+_COLUMNS = ('player_id', 'created_at', 'updated_at', 'landmarks', 'review',
+            'journey', 'journey_mode', 'journey_station', 'journey_score', 'offline',
+            'games_started', 'games_completed', 'best_score')
+_HISTORY_COLUMNS = ('player_id', 'finished_at', 'game', 'mode', 'score', 'total_answered')
+_COUNTERS = ('games_started', 'games_completed')
+# 書き出す時に今の DB の値と合わせる列 (それ以外は上書き)
+_MERGES = dict({name: f'{name} + excluded.{name}' for name in _COUNTERS},
+               best_score='MAX(best_score, excluded.best_score)', landmarks='landmarks | excluded.landmarks')
+
+
+def new_player_id():
+    return secrets.token_urlsafe(16)
+
+
+def valid_player_id(player_id):
+    return bool(player_id) and len(player_id) <= 64 and all(c.isalnum() or c in '-_' for c in player_id)
+
+
+class ProfileStore:
+    """プロフィールのライトビハインド・キャッシュ"""
+
+    def __init__(self, db_path, flush_interval=2.0, max_entries=10000, cache_ttl=30.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.cache_ttl = cache_ttl
+        self.loads = 0
+        self.writes = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # player_id -> (読んだ時刻, プロフィール dict)
+        self._dirty = {}              # player_id -> 書き換えた列の集合
+        self._deltas = {}             # player_id -> まだ書き出していない回数の増分
+        self._history = []            # まだ書き出していない完走の記録
+        self._last_flush = time.monotonic()
+        self._db = ProcessConnection(db_path)
+        with self._db.use() as conn:
+            conn.executescript(_SCHEMA)
+
+    # --- 読み込み ---
+    def get(self, player_id):
+        """プロフィール (dict) を返す。なければ None"""
+        with self._lock:
+            entry = self._cache.get(player_id)
+            if entry is not None and (player_id in self._dirty or time.monotonic() - entry[0] < self.cache_ttl):
+                self._cache.move_to_end(player_id)
+                return entry[1]
+        with self._db.use() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM players WHERE player_id = ?", (player_id,)
+            ).fetchone()
+        self.loads += 1
+        if row is None:
+            return None
+        with self._lock:
+            # 読んでいる間に別のスレッドが書き換えていたら、そちらを優先する
+            if player_id in self._dirty:
+                return self._cache[player_id][1]
+            profile = dict(zip(_COLUMNS, row))
+            self._put(player_id, profile)
+            return profile
+
+    def _put(self, player_id, profile):
+        self._cache[player_id] = (time.monotonic(), profile)
+        self._cache.move_to_end(player_id)
+        # 溢れたら古い順に外す (書き出し前のものは残す)
+        if len(self._cache) > self.max_entries:
+            for old_id in list(self._cache):
+                if len(self._cache) <= self.max_entries:
+                    break
+                if old_id not in self._dirty:
+                    del self._cache[old_id]
+
+    # --- 書き込み (メモリ上だけ。DB へは flush でまとめて書く) ---
+    def create(self, **fields):
+        """新しいプロフィールを作って player_id を返す"""
+        now = time.time()
+        profile = dict.fromkeys(_COLUMNS)
+        profile.update(created_at=now, updated_at=now, landmarks=0, offline=0,
+                       games_started=0, games_completed=0, best_score=0)
+        profile.update(fields)
+        profile['player_id'] = player_id = new_player_id()
+        with self._lock:
+            self._put(player_id, profile)
+            self._dirty[player_id] = set(_COLUMNS[1:])
+            self._deltas[player_id] = {name: profile[name] for name in _COUNTERS}
+        return player_id
+
+    def update(self, player_id, **fields):
+        """値を書き換える。プロフィールがなければ False"""
+        return self._change(player_id, fields)
+
+    def _change(self, player_id, fields, counts=None):
+        """fields を書き換え、counts (回数の列 -> 増分) を足す。プロフィールがなければ False"""
+        profile = self.get(player_id)
+        if profile is None:
+            return False
+        counts = counts or {}
+        with self._lock:
+            profile.update(fields)
+            profile['updated_at'] = time.time()
+            deltas = self._deltas.setdefault(player_id, dict.fromkeys(_COUNTERS, 0))
+            for name, count in counts.items():
+                profile[name] += count
+                deltas[name] += count
+            self._dirty.setdefault(player_id, set()).update(fields, counts, ['updated_at'])
+        return True
+
+    def save_journey(self, player_id, journey, mode, station, score, offline, started=False):
+        """進行中の旅 (エンコード済みの GameState) を覚える"""
+        fields = dict(journey=journey, journey_mode=mode, journey_station=station, journey_score=score,
+                      offline=int(offline))
+        return self._change(player_id, fields, dict(games_started=1) if started else None)
+
+    def finish_journey(self, player_id, game, mode, score, total_answered):
+        """完走: 旅の続きを消し、記録に残す"""
+        profile = self.get(player_id)
+        if profile is None:
+            return False
+        self._change(player_id, dict(journey=None, journey_mode=None, journey_station=None, journey_score=None,
+                                     best_score=max(profile['best_score'], score)),
+                     dict(games_completed=1))
+        with self._lock:
+            self._history.append((player_id, time.time(), game, mode, score, total_answered))
+        return True
+
+    # --- 書き出し ---
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """変更のあったプロフィールと完走の記録を1回のトランザクションで書き出す
+
+        書き換えた列が同じ行ごとにまとめて UPSERT する。まだ DB にない行 (create した行) はそのまま入り、
+        ある行は書き換えた列だけを直す (回数は増分を足す)。
+        """
+        self._last_flush = time.monotonic()
+        with self._lock:
+            if not self._dirty and not self._history:
+                return
+            groups = {}
+            for pid, names in self._dirty.items():
+                row = dict(self._cache[pid][1], **self._deltas.get(pid, dict.fromkeys(_COUNTERS, 0)))
+                groups.setdefault(frozenset(names), []).append(tuple(row[name] for name in _COLUMNS))
+            history, self._history = self._history, []
+            dirty, self._dirty = self._dirty, {}
+            deltas, self._deltas = self._deltas, {}
+
+        try:
+            with self._db.transaction() as conn:
+                for names, rows in groups.items():
+                    updates = ', '.join(f"{name} = {_MERGES.get(name, f'excluded.{name}')}"
+                                        for name in _COLUMNS[1:] if name in names)
+                    conn.executemany(
+                        f"INSERT INTO players ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+                        f" ON CONFLICT(player_id) DO UPDATE SET {updates}",
+                        rows,
+                    )
+                conn.executemany(
+                    f"INSERT INTO player_history ({', '.join(_HISTORY_COLUMNS)})"
+                    f" VALUES ({', '.join('?' * len(_HISTORY_COLUMNS))})",
+                    history,
+                )
+        except sqlite3.Error:
+            # 書けなかった分は次の書き出しでやり直す (リクエスト処理は止めない)
+            with self._lock:
+                for pid, names in dirty.items():
+                    if pid not in self._cache:
+                        continue
+                    self._dirty.setdefault(pid, set()).update(names)
+                    pending = self._deltas.setdefault(pid, dict.fromkeys(_COUNTERS, 0))
+                    for name, count in deltas.get(pid, {}).items():
+                        pending[name] += count
+                self._history[:0] = history
+                self.errors += 1
+            return
+        self.writes += 1
+
+    def history(self, player_id, limit=10):
+        """最近の完走の記録 (新しい順)。まだ書き出していない分も含む"""
+        with self._lock:
+            pending = [dict(zip(_HISTORY_COLUMNS, row)) for row in self._history if row[0] == player_id]
+        with self._db.use() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_HISTORY_COLUMNS)} FROM player_history WHERE player_id = ?"
+                " ORDER BY finished_at DESC LIMIT ?", (player_id, limit)
+            ).fetchall()
+        records = pending[::-1] + [dict(zip(_HISTORY_COLUMNS, row)) for row in rows]
+        for record in records:
+            del record['player_id']
+        return records[:limit]
+
+    def stats(self):
+        return dict(cached=len(self._cache), dirty=len(self._dirty), pending_history=len(self._history),
+                    loads=self.loads, writes=self.writes, errors=self.errors)
@@ -0,0 +1,211 @@
+"""処理時間の内訳 (Server-Timing) と、抽出したリクエストのプロファイル
+
+Server-Timing:
+    span('render') などで囲んだ区間の時間をリクエストごとに足し込み、
+    応答の Server-Timing ヘッダー (ブラウザの開発者ツールの Timing タブに出る) にまとめて載せる。
+    セッションの読み書きとルーティングは TimedSessionInterface で測る。
+
+SamplingProfiler:
+    rate の割合のリクエストだけをプロファイルし、ディレクトリに集計を書き出す。
+    rate が 0 (既定) の間は「rate > 0 か」を見るだけなので、ほぼ負担はない。
+    - cprofile: cProfile の結果を足し合わせて profile-<pid>.pstats に書く (python -m pstats で読める)
+    - collapsed: 別スレッドで一定間隔ごとにスタックを覗き、stacks-<pid>.txt に
+      「関数;関数;... 回数」の形で書く (flamegraph.pl や speedscope でフレームグラフにできる)
+"""
+import cProfile
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g
+from flask.sessions import SessionInterface
+
+
+# ---------------------------------------------------------
+# Server-Timing
+# ---------------------------------------------------------
+def add_span(name, seconds):
+    spans = g.get('server_timing')
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+class span:
+    """with span('deck'): ... で囲んだ区間の時間を Server-Timing に足す"""
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_span(self.name, time.perf_counter() - self.start)
+
+
+def mark_routing():
+    """before_request の最初で呼ぶ。セッションを開いてからここまでを routing として数える"""
+    opened = g.get('server_timing_opened')
+    if opened is not None:
+        add_span('routing', time.perf_counter() - opened)
+
+
+def format_server_timing(spans, total):
+    parts = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in spans.items()]
+    parts.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(parts)
+
+
+class TimedSessionInterface(SessionInterface):
+    """元のセッションインターフェースを包み、読み書きの時間を測って Server-Timing ヘッダーを付ける
+
+    save_session はリクエスト処理の最後 (after_request の後) に呼ばれるので、ここでヘッダーを書く。
+    header は True / False か、ヘッダーを付けるリクエストかを返す関数 (管理者のリクエストだけに付ける場合など)。
+    """
+
+    def __init__(self, inner, header=True):
+        self.inner = inner
+        self.header = header
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def open_session(self, app, request):
+        start = time.perf_counter()
+        g.server_timing = {}
+        g.server_timing_start = start
+        session = self.inner.open_session(app, request)
+        g.server_timing_opened = now = time.perf_counter()
+        add_span('session', now - start)
+        return session
+
+    def make_null_session(self, app):
+        return self.inner.make_null_session(app)
+
+    def is_null_session(self, obj):
+        return self.inner.is_null_session(obj)
+
+    def save_session(self, app, session, response):
+        start = time.perf_counter()
+        self.inner.save_session(app, session, response)
+        now = time.perf_counter()
+        add_span('session', now - start)
+        spans = g.get('server_timing')
+        header = self.header() if callable(self.header) else self.header
+        if header and spans is not None:
+            response.headers['Server-Timing'] = format_server_timing(spans, now - g.server_timing_start)
+
+
+# ---------------------------------------------------------
+# サンプリング・プロファイラ
+# ---------------------------------------------------------
+PROFILE_MODES = ('cprofile', 'collapsed')
+
+
+class SamplingProfiler:
+    """rate の割合のリクエストをプロファイルして、directory に集計を書き出す"""
+
+    def __init__(self, directory='profiles', rate=0.0, mode='cprofile', interval=0.001, flush_every=20):
+        self.directory = directory
+        self.rate = 0.0
+        self.mode = 'cprofile'
+        self.interval = interval          # collapsed のスタックを覗く間隔 (秒)
+        self.flush_every = flush_every    # 何リクエスト分たまったらファイルに書くか
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stats = None
+        self._stacks = Counter()
+        self._active = {}                 # スレッドID -> ラベル (collapsed で測定中のリクエスト)
+        self._sampler = None
+        self.configure(rate, mode)
+
+    def configure(self, rate=None, mode=None):
+        if rate is not None:
+            self.rate = min(max(float(rate), 0.0), 1.0)
+        if mode is not None:
+            if mode not in PROFILE_MODES:
+                raise ValueError(f"未知のプロファイル形式です: {mode}")
+            self.mode = mode
+
+    def status(self):
+        return dict(rate=self.rate, mode=self.mode, samples=self.samples, directory=self.directory)
+
+    # --- リクエストごと ---
+    def start(self, label):
+        """このリクエストを測るなら測定を始めてトークンを返す。測らないなら None"""
+        if not self.rate or random.random() >= self.rate:
+            return None
+        if self.mode == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            return ('cprofile', profile)
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = label
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name='profile-sampler', daemon=True)
+                self._sampler.start()
+        return ('collapsed', thread_id)
+
+    def stop(self, token):
+        kind, value = token
+        with self._lock:
+            if kind == 'cprofile':
+                value.disable()
+                if self._stats is None:
+                    self._stats = pstats.Stats(value)
+                else:
+                    self._stats.add(value)
+            else:
+                self._active.pop(value, None)
+            self.samples += 1
+            if self.samples % self.flush_every == 0:
+                self._write()
+
+    # --- collapsed: スタックを一定間隔で覗く ---
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                frames = sys._current_frames()
+                for thread_id, label in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        self._stacks[self._collapse(label, frame)] += 1
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(label, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        names.append(label)
+        return ';'.join(reversed(names))
+
+    # --- 書き出し ---
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        pid = os.getpid()
+        if self._stats is not None:
+            self._stats.dump_stats(os.path.join(self.directory, f'profile-{pid}.pstats'))
+        if self._stacks:
+            path = os.path.join(self.directory, f'stacks-{pid}.txt')
+            with open(f'{path}.tmp', 'w') as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+            os.replace(f'{path}.tmp', path)
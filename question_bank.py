@@ -0,0 +1,548 @@
+"""省メモリな問題集
+
+問題ごとに dict と5要素のリストを作る代わりに、列ごとの配列で持つ。
+
+- 選択肢の文字列は重複を除いたプール (_option_pool) にまとめ、問題側は番号 (array('I')) だけを持つ
+- 正答番号は array('B') (1問1バイト)
+- ID はよく似た文字列が多いので sys.intern する
+- 回・区分ごとの問題番号の一覧 (round_index / category_index) を読み込み時に作っておく
+
+ALL_QUESTIONS[i] は従来の dict と同じく q['options'] / q.options のどちらでも読める Question を返す。
+
+大量の過去問を扱う場合は SQLiteQuestionBank (問題を必要な時だけ1行ずつ読む) も使える。
+CSV を解析した結果は write_bank_file でスナップショット (バイナリファイル) に書き出しておけば、
+次からは read_bank_file で CSV を解析せずに読める (source に CSV の中身の CRC32 を入れて、古いものは使わない)。
+gunicorn で多数のワーカーを動かす場合は、同じファイルを MappedQuestionBank で mmap する (読み込みもメモリも1回分で済む)。
+"""
+import csv
+import functools
+import glob
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import zlib
+from array import array
+
+OPTIONS_PER_QUESTION = 5
+
+
+class Question:
+    """問題1問分のビュー。必要になった時だけ作る"""
+
+    __slots__ = ('id', 'question', 'options', 'answer_idx')
+
+    def __init__(self, qid, question, options, answer_idx):
+        self.id = qid
+        self.question = question
+        self.options = options
+        self.answer_idx = answer_idx
+
+    def __getitem__(self, key):
+        # 旧実装 (dict) と同じ q['answer_idx'] の書き方で読めるように
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+
+class QuestionBank:
+    """問題集を列ごとの配列で持つ"""
+
+    def __init__(self):
+        self.ids = []
+        self.texts = []
+        self.option_refs = array('I')
+        self.answers = array('B')
+        self.round_index = {}      # 回 -> その回の問題インデックス (昇順)
+        self.category_index = {}   # 区分 -> その区分の問題インデックス (昇順)
+        self._option_pool = []
+        self._option_index = {}
+        self.source = None         # スナップショットから読んだ場合は、その source
+
+    def _option_ref(self, text):
+        ref = self._option_index.get(text)
+        if ref is None:
+            ref = len(self._option_pool)
+            self._option_pool.append(text)
+            self._option_index[text] = ref
+        return ref
+
+    def add(self, qid, question, options, answer_idx, round_no=None, category=None):
+        idx = len(self.answers)
+        if round_no is not None:
+            self.round_index.setdefault(round_no, array('I')).append(idx)
+        if category:
+            self.category_index.setdefault(sys.intern(category), array('I')).append(idx)
+        self.ids.append(sys.intern(qid))
+        self.texts.append(question)
+        self.option_refs.extend(self._option_ref(text) for text in options[:OPTIONS_PER_QUESTION])
+        self.answers.append(answer_idx)
+
+    def __len__(self):
+        return len(self.answers)
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self.answers):
+            raise IndexError(idx)
+        start = idx * OPTIONS_PER_QUESTION
+        pool = self._option_pool
+        options = tuple(pool[ref] for ref in self.option_refs[start:start + OPTIONS_PER_QUESTION])
+        return Question(self.ids[idx], self.texts[idx], options, self.answers[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def option_count(self):
+        """重複を除いた選択肢の種類数"""
+        return len(self._option_pool)
+
+
+# ---------------------------------------------------------
+# SQLite 版: 過去問を全部入れても、出題する問題だけを必要な時に読む
+# ---------------------------------------------------------
+# CSV の列: 番号, 回, 区分, ID, 設問, 選択肢1〜5, 正答 (以降の列は使わない)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    pos INTEGER PRIMARY KEY,          -- 取り込んだ順の番号。再取り込みしても変わらない (消した問題の番号は欠ける)
+    qid TEXT NOT NULL UNIQUE,
+    number INTEGER, round INTEGER, category TEXT,
+    question TEXT NOT NULL,
+    opt1 TEXT, opt2 TEXT, opt3 TEXT, opt4 TEXT, opt5 TEXT,
+    answer INTEGER NOT NULL,
+    source TEXT                       -- 取り込んだ CSV (絶対パス)
+);
+CREATE TABLE IF NOT EXISTS imported_files (
+    path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL
+);
+"""
+
+IMPORT_BATCH_SIZE = 1000
+
+
+def _csv_records(csv_path):
+    with open(csv_path, mode='r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 11:
+                continue
+            yield (int(row[0]) if row[0].isdigit() else None, int(row[1]) if row[1].isdigit() else None,
+                   row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9], int(row[10]))
+
+
+def import_csv_files(db_path, csv_paths):
+    """CSV を SQLite に取り込む。取り込み済みで変更のないファイルは飛ばし、ID が同じ問題は上書きする
+
+    取り込み直したファイルからなくなった問題と、csv_paths にないファイルから取り込んだ問題は消す
+    (残った問題の pos は変えない)。取り込んだ (追加・更新・削除した) 問題数を返す。
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(_SCHEMA)
+        # source 列のない古い DB: 全ファイルを取り込み直して source を入れ、どのファイルにもない問題は消す
+        if 'source' not in {row[1] for row in conn.execute("PRAGMA table_info(questions)")}:
+            with conn:
+                conn.execute("ALTER TABLE questions ADD COLUMN source TEXT")
+                conn.execute("DELETE FROM imported_files")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (qid TEXT PRIMARY KEY)")
+        keys = [os.path.abspath(csv_path) for csv_path in csv_paths]
+        imported = 0
+        for csv_path, key in zip(csv_paths, keys):
+            stat = os.stat(csv_path)
+            row = conn.execute("SELECT size, mtime FROM imported_files WHERE path = ?", (key,)).fetchone()
+            if row == (stat.st_size, stat.st_mtime):
+                continue
+
+            batch = []
+            with conn:
+                conn.execute("DELETE FROM temp.seen")
+                for record in _csv_records(csv_path):
+                    batch.append(record + (key,))
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        imported += _upsert(conn, batch)
+                        batch = []
+                imported += _upsert(conn, batch)
+                before = conn.total_changes
+                conn.execute("DELETE FROM questions WHERE source = ? AND qid NOT IN (SELECT qid FROM temp.seen)",
+                             (key,))
+                imported += conn.total_changes - before
+                conn.execute("INSERT OR REPLACE INTO imported_files (path, size, mtime) VALUES (?, ?, ?)",
+                             (key, stat.st_size, stat.st_mtime))
+        with conn:
+            before = conn.total_changes
+            placeholders = ', '.join('?' * len(keys))
+            conn.execute(f"DELETE FROM questions WHERE source IS NULL OR source NOT IN ({placeholders})", keys)
+            imported += conn.total_changes - before
+            conn.execute(f"DELETE FROM imported_files WHERE path NOT IN ({placeholders})", keys)
+        return imported
+    finally:
+        conn.close()
+
+
+def _upsert(conn, batch):
+    if not batch:
+        return 0
+    conn.executemany("INSERT OR IGNORE INTO temp.seen (qid) VALUES (?)", [(record[3],) for record in batch])
+    before = conn.total_changes
+    # ID が既にあれば pos はそのまま、内容が変わった時だけ更新する
+    conn.executemany(
+        "INSERT INTO questions (number, round, category, qid, question, opt1, opt2, opt3, opt4, opt5, answer, source)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT(qid) DO UPDATE SET number = excluded.number, round = excluded.round,"
+        " category = excluded.category, question = excluded.question, opt1 = excluded.opt1,"
+        " opt2 = excluded.opt2, opt3 = excluded.opt3, opt4 = excluded.opt4, opt5 = excluded.opt5,"
+        " answer = excluded.answer, source = excluded.source"
+        " WHERE (questions.question, questions.opt1, questions.opt2, questions.opt3, questions.opt4,"
+        " questions.opt5, questions.answer, questions.number, questions.round, questions.category, questions.source)"
+        " IS NOT (excluded.question, excluded.opt1, excluded.opt2, excluded.opt3, excluded.opt4,"
+        " excluded.opt5, excluded.answer, excluded.number, excluded.round, excluded.category, excluded.source)",
+        batch,
+    )
+    return conn.total_changes - before
+
+
+def versioned_db_path(db_path, version):
+    """版ごとの DB ファイルのパス (questions.sqlite3 -> questions-<版の番号>.sqlite3)"""
+    stem, ext = os.path.splitext(db_path)
+    return f'{stem}-{version:08x}{ext}'
+
+
+def import_versioned_db(db_path, csv_paths, version):
+    """CSV を版ごとの DB ファイルに取り込み、(そのパス, 取り込んだ問題数) を返す
+
+    同じ版のファイルがあれば (別のワーカーが取り込み済み) そのまま使う。なければ一番新しい版のファイルを
+    複製してから差分だけを取り込むので、問題の番号 (pos) は版をまたいでも変わらず、変更のない CSV は読み直さない。
+    取り込みは一時ファイルで行ってから置き換えるので、古い版のファイル (旅の途中の版) は書き換えない。
+    """
+    path = versioned_db_path(db_path, version)
+    if os.path.exists(path):
+        return path, 0
+    stem, ext = os.path.splitext(db_path)
+    previous = sorted(glob.glob(f'{glob.escape(stem)}-{"[0-9a-f]" * 8}{glob.escape(ext)}'), key=os.path.getmtime)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        if previous:
+            src = sqlite3.connect(f"file:{previous[-1]}?mode=ro", uri=True)
+            dst = sqlite3.connect(tmp_path)
+            try:
+                src.backup(dst)
+            finally:
+                src.close()
+                dst.close()
+        imported = import_csv_files(tmp_path, csv_paths)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, imported
+
+
+class SQLiteQuestionBank:
+    """SQLite に入った問題集。ALL_QUESTIONS[i] の時だけ1行読み、最近使った問題は LRU で持つ
+
+    remove_on_close=True なら、close (版を捨てた時) で DB ファイルも消す (import_versioned_db で作った版のファイル)。
+    接続はプロセスごとに1つなので、別のワーカーがファイルを消しても、接続済みのプロセスはそのまま読める。
+    問題番号は pos の昇順に詰めた番号。消した問題で pos が欠けている場合だけ、問題番号 -> pos の表 (4バイト/問) を持つ。
+    """
+
+    def __init__(self, db_path, cache_size=2048, remove_on_close=False):
+        self.db_path = db_path
+        self.remove_on_close = remove_on_close
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._length = None
+        self._positions = None   # 問題番号 -> pos (pos に欠けがなければ None)
+        self._indexes = None
+        self._fetch = functools.lru_cache(maxsize=cache_size)(self._fetch_row)
+
+    def _connect(self):
+        # gunicorn の fork 後に親の接続を使い回さないよう、プロセスごとに接続する
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def __len__(self):
+        if self._length is None:
+            count, last = self._query("SELECT COUNT(*), COALESCE(MAX(pos), 0) FROM questions")[0]
+            if count != last:
+                self._positions = array('I', (pos for (pos,) in self._query("SELECT pos FROM questions ORDER BY pos")))
+            self._length = count
+        return self._length
+
+    def _fetch_row(self, idx):
+        pos = idx + 1 if self._positions is None else self._positions[idx]
+        rows = self._query(
+            "SELECT qid, question, opt1, opt2, opt3, opt4, opt5, answer FROM questions WHERE pos = ?", (pos,))
+        if not rows:
+            raise IndexError(idx)
+        row = rows[0]
+        return Question(row[0], row[1], tuple(row[2:7]), row[7])
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self._fetch(idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def _load_indexes(self):
+        # 回・区分の列だけを1回読んで索引を作る
+        round_index, category_index = {}, {}
+        rows = self._query("SELECT round, category FROM questions ORDER BY pos")
+        for idx, (round_no, category) in enumerate(rows):
+            if round_no is not None:
+                round_index.setdefault(round_no, array('I')).append(idx)
+            if category:
+                category_index.setdefault(category, array('I')).append(idx)
+        self._indexes = (round_index, category_index)
+
+    @property
+    def round_index(self):
+        if self._indexes is None:
+            self._load_indexes()
+        return self._indexes[0]
+
+    @property
+    def category_index(self):
+        if self._indexes is None:
+            self._load_indexes()
+        return self._indexes[1]
+
+    def available(self):
+        """DB ファイルを読めるか (別のワーカーが版を捨ててファイルを消していれば、まだ接続していないプロセスは読めない)"""
+        return (self._conn is not None and self._pid == os.getpid()) or os.path.exists(self.db_path)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._fetch.cache_clear()
+            if self.remove_on_close:
+                try:
+                    os.remove(self.db_path)
+                except OSError:
+                    pass
+
+
+# ---------------------------------------------------------
+# mmap 版: 1つのバイナリファイルを全ワーカーで共有する
+# ---------------------------------------------------------
+# ファイルの中身: マジック, 版, メタデータ (JSON) の長さ, メタデータ, 4バイト境界に揃えた各セクション
+#   answers (u8) / option_refs (u32) / ids・texts・pool の終端オフセット (u32) と UTF-8 の本文 / 回・区分の索引 (u32)
+# 問題を読む時はファイルの該当部分から直接文字列を作るだけなので、Python のオブジェクトを共有しない。
+# gunicorn の fork 後も参照カウントの書き換えでページがコピーされることはなく、ページキャッシュを全ワーカーで共有する。
+_BANK_MAGIC = b'QBNK'
+_BANK_VERSION = 1
+_BANK_HEADER = struct.Struct('<4sII')
+
+
+def _offsets(strings):
+    """UTF-8 にした文字列を連結した本文と、各文字列の終端オフセット (先頭に 0)"""
+    encoded = [text.encode('utf-8') for text in strings]
+    ends = array('I', [0])
+    total = 0
+    for data in encoded:
+        total += len(data)
+        ends.append(total)
+    return ends.tobytes(), b''.join(encoded)
+
+
+def write_bank_file(bank, path, source=None):
+    """QuestionBank を mmap 用のファイルに書き出す (一時ファイルに書いてから置き換える)"""
+    index = array('I')
+    rounds, categories = {}, {}
+    for key, indices in bank.round_index.items():
+        rounds[str(key)] = [len(index), len(indices)]
+        index.extend(indices)
+    for key, indices in bank.category_index.items():
+        categories[key] = [len(index), len(indices)]
+        index.extend(indices)
+    id_ends, ids = _offsets(bank.ids)
+    text_ends, texts = _offsets(bank.texts)
+    pool_ends, pool = _offsets(bank._option_pool)
+    sections = [('answers', bank.answers.tobytes()), ('option_refs', bank.option_refs.tobytes()),
+                ('id_ends', id_ends), ('text_ends', text_ends), ('pool_ends', pool_ends), ('index', index.tobytes()),
+                ('ids', ids), ('texts', texts), ('pool', pool)]
+
+    layout = {}
+    offset = 0
+    for name, data in sections:
+        layout[name] = [offset, len(data)]
+        offset += (len(data) + 3) & ~3
+    meta = json.dumps(dict(count=len(bank), pool=len(bank._option_pool), sections=layout,
+                           rounds=rounds, categories=categories, source=source)).encode('utf-8')
+    base = (_BANK_HEADER.size + len(meta) + 3) & ~3
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_BANK_HEADER.pack(_BANK_MAGIC, _BANK_VERSION, len(meta)) + meta)
+        for name, data in sections:
+            f.seek(base + layout[name][0])
+            f.write(data)
+        f.truncate(base + offset)
+    os.replace(tmp_path, path)
+
+
+def _bank_sections(view, path):
+    """スナップショットのメタデータと、セクションを切り出す関数 section(名前, 形式) を返す"""
+    try:
+        magic, version, meta_len = _BANK_HEADER.unpack_from(view)
+        if magic != _BANK_MAGIC or version != _BANK_VERSION:
+            raise ValueError
+        meta = json.loads(bytes(view[_BANK_HEADER.size:_BANK_HEADER.size + meta_len]))
+    except (ValueError, struct.error):
+        raise ValueError(f"問題集ファイルの形式が違います: {path}") from None
+    base = (_BANK_HEADER.size + meta_len + 3) & ~3
+
+    def section(name, fmt='B'):
+        start, length = meta['sections'][name]
+        return view[base + start:base + start + length].cast(fmt)
+
+    return meta, section
+
+
+def _strings(ends, blob):
+    data = bytes(blob)
+    return [data[start:end].decode('utf-8') for start, end in zip(ends, ends[1:])]
+
+
+def read_bank_file(path):
+    """スナップショットを読み込んで QuestionBank を作る (CSV の解析も選択肢の重複除去もしない)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    meta, section = _bank_sections(memoryview(data), path)
+    bank = QuestionBank()
+    bank.source = meta['source']
+    bank.answers.frombytes(section('answers'))
+    bank.option_refs.frombytes(section('option_refs'))
+    bank.ids = [sys.intern(qid) for qid in _strings(section('id_ends', 'I'), section('ids'))]
+    bank.texts = _strings(section('text_ends', 'I'), section('texts'))
+    bank._option_pool = _strings(section('pool_ends', 'I'), section('pool'))
+    bank._option_index = {text: ref for ref, text in enumerate(bank._option_pool)}
+    index = section('index')
+    for target, entries, convert in ((bank.round_index, meta['rounds'], int),
+                                     (bank.category_index, meta['categories'], sys.intern)):
+        for key, (start, length) in entries.items():
+            indices = target[convert(key)] = array('I')
+            indices.frombytes(index[start * 4:(start + length) * 4])
+    return bank
+
+
+@functools.lru_cache(maxsize=64)
+def _file_crc32(path, size, mtime_ns):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(functools.partial(f.read, 1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+    return f'{crc:08x}'
+
+
+def file_checksum(path):
+    """ファイルの中身の CRC32 (16進8桁)。大きさと更新時刻が前回と同じなら、前回の結果を使う"""
+    stat = os.stat(path)
+    return _file_crc32(path, stat.st_size, stat.st_mtime_ns)
+
+
+def sources_checksum(paths):
+    """元データのファイル群の版の番号: 各ファイルの CRC32 をまとめた CRC32 (読めないファイルは飛ばす)
+
+    0 は「版の番号なし」(古いセッション) に使うので、0 になった場合は 1 にする。
+    """
+    parts = []
+    for path in paths:
+        try:
+            parts.append(file_checksum(path))
+        except OSError:
+            continue
+    return zlib.crc32(' '.join(parts).encode('ascii')) or 1
+
+
+class MappedQuestionBank:
+    """write_bank_file で書いたファイルを mmap して読む問題集 (読み取り専用)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        meta, section = _bank_sections(memoryview(self._mmap), path)
+        self._count = meta['count']
+        self.source = meta['source']
+        self.answers = section('answers')
+        self.option_refs = section('option_refs', 'I')
+        self._id_ends, self._ids = section('id_ends', 'I'), section('ids')
+        self._text_ends, self._texts = section('text_ends', 'I'), section('texts')
+        self._pool_ends, self._pool = section('pool_ends', 'I'), section('pool')
+        index = section('index', 'I')
+        # 索引もファイルの一部をそのまま指す (コピーしない)
+        self.round_index = {int(key): index[start:start + length]
+                            for key, (start, length) in meta['rounds'].items()}
+        self.category_index = {key: index[start:start + length]
+                               for key, (start, length) in meta['categories'].items()}
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def _string(ends, blob, i):
+        return str(blob[ends[i]:ends[i + 1]], 'utf-8')
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self._count:
+            raise IndexError(idx)
+        start = idx * OPTIONS_PER_QUESTION
+        options = tuple(self._string(self._pool_ends, self._pool, ref)
+                        for ref in self.option_refs[start:start + OPTIONS_PER_QUESTION])
+        return Question(self._string(self._id_ends, self._ids, idx), self._string(self._text_ends, self._texts, idx),
+                        options, self.answers[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def option_count(self):
+        return len(self._pool_ends) - 1
+
+
+def filter_indices(bank, rounds=(), categories=()):
+    """回・区分で絞り込んだ問題インデックスの昇順配列を返す。どちらも指定がなければ None (全問)
+
+    読み込み時に作った索引の和集合・積集合だけで求めるので、問題本体は読まない。
+    """
+    selected = None
+    for index, keys in ((bank.round_index, rounds), (bank.category_index, categories)):
+        if not keys:
+            continue
+        chosen = set()
+        for key in keys:
+            chosen.update(index.get(key, ()))
+        selected = chosen if selected is None else selected & chosen
+    if selected is None:
+        return None
+    return array('I', sorted(selected))
+
+
+def question_key(qid):
+    """問題 ID の 32bit のキー (セッションの復習表など、版をまたいで問題を指す所に使う)"""
+    return zlib.crc32(str(qid).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    # python question_bank.py questions.sqlite3 a.csv b.csv ...
+    if len(sys.argv) < 3:
+        sys.exit(f"usage: {sys.argv[0]} DB_PATH CSV_PATH [CSV_PATH ...]")
+    print(f"{import_csv_files(sys.argv[1], sys.argv[2:])} 問を取り込みました")
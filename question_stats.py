@@ -0,0 +1,187 @@
+"""問題ごとの正答率・解答時間の集計
+
+問題ごとのカウンタ (回答数・正解数・解答時間の合計とヒストグラム・選択肢ごとの回答数) を
+問題番号で引ける配列に持ち、1回の回答は配列の足し算だけ (O(1)) で記録する。
+
+各ワーカーは「前回の書き出し以降の増分」だけを持ち、一定間隔 (既定 5 秒) ごとに
+SQLite の question_stats テーブルへ足し込む (UPSERT で加算するので、複数ワーカーが書いても合計が合う)。
+/stats はこのテーブルだけを読むので、イベントログを集計し直す必要はない。
+"""
+import sqlite3
+import threading
+import time
+from array import array
+
+CHOICES = 5
+# 解答時間のヒストグラムの区切り (秒)。最後の区間は「それ以上」
+ELAPSED_BUCKETS = (2, 5, 10, 20, 30, 60)
+
+_HIST_COLUMNS = [f'h{i}' for i in range(len(ELAPSED_BUCKETS) + 1)]
+_CHOICE_COLUMNS = [f'c{i + 1}' for i in range(CHOICES)]
+_COUNTER_COLUMNS = ['attempts', 'correct', 'elapsed_sum'] + _HIST_COLUMNS + _CHOICE_COLUMNS
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS question_stats (
+    qid TEXT PRIMARY KEY,
+    q_index INTEGER NOT NULL, round INTEGER, category TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0, correct INTEGER NOT NULL DEFAULT 0,
+    elapsed_sum REAL NOT NULL DEFAULT 0,
+    {', '.join(f'{name} INTEGER NOT NULL DEFAULT 0' for name in _HIST_COLUMNS + _CHOICE_COLUMNS)},
+    updated_at REAL NOT NULL DEFAULT 0
+)
+"""
+
+SORT_KEYS = {
+    'miss_rate': 'CAST(correct AS REAL) / attempts ASC, attempts DESC',
+    'elapsed': 'elapsed_sum / attempts DESC',
+    'attempts': 'attempts DESC',
+    'round': 'round ASC, CAST(correct AS REAL) / attempts ASC',
+    'category': 'category ASC, CAST(correct AS REAL) / attempts ASC',
+}
+
+
+def elapsed_bucket(elapsed):
+    for i, bound in enumerate(ELAPSED_BUCKETS):
+        if elapsed < bound:
+            return i
+    return len(ELAPSED_BUCKETS)
+
+
+class QuestionStats:
+    """問題番号ごとのカウンタ (このワーカーで、まだ書き出していない増分)"""
+
+    def __init__(self, size, db_path, flush_interval=5.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._reset(size)
+        conn = sqlite3.connect(db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            # updated_at のない古いテーブルには列を足す (アダプティブ出題が変わった行だけ読み直すため)
+            if 'updated_at' not in {row[1] for row in conn.execute("PRAGMA table_info(question_stats)")}:
+                conn.execute("ALTER TABLE question_stats ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_question_stats_updated ON question_stats (updated_at)")
+        finally:
+            conn.close()
+
+    def _reset(self, size):
+        self.size = size
+        self.attempts = array('I', bytes(4 * size))
+        self.correct = array('I', bytes(4 * size))
+        self.elapsed_sum = array('d', bytes(8 * size))
+        self.elapsed_hist = array('I', bytes(4 * size * (len(ELAPSED_BUCKETS) + 1)))
+        self.choices = array('I', bytes(4 * size * CHOICES))
+        self._touched = set()
+
+    def record(self, q_index, choice, correct, elapsed):
+        if not 0 <= q_index < self.size:
+            return
+        with self._lock:
+            self.attempts[q_index] += 1
+            if correct:
+                self.correct[q_index] += 1
+            self.elapsed_sum[q_index] += elapsed
+            self.elapsed_hist[q_index * (len(ELAPSED_BUCKETS) + 1) + elapsed_bucket(elapsed)] += 1
+            if 1 <= choice <= CHOICES:
+                self.choices[q_index * CHOICES + choice - 1] += 1
+            self._touched.add(q_index)
+
+    def maybe_flush(self, describe):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush(describe)
+
+    def flush(self, describe):
+        """増分を SQLite に足し込んでゼロに戻す。describe(q_index) -> (qid, 回, 区分)"""
+        self._last_flush = time.monotonic()
+        with self._lock:
+            if not self._touched:
+                return
+            hist_width = len(ELAPSED_BUCKETS) + 1
+            now = time.time()
+            rows = []
+            for idx in sorted(self._touched):
+                hist = self.elapsed_hist[idx * hist_width:(idx + 1) * hist_width]
+                choices = self.choices[idx * CHOICES:(idx + 1) * CHOICES]
+                rows.append((*describe(idx), idx, self.attempts[idx], self.correct[idx], self.elapsed_sum[idx],
+                             *hist, *choices, now))
+                # 書き出した分をゼロに戻す (触った問題だけ)
+                self.attempts[idx] = self.correct[idx] = 0
+                self.elapsed_sum[idx] = 0.0
+                for i in range(idx * hist_width, (idx + 1) * hist_width):
+                    self.elapsed_hist[i] = 0
+                for i in range(idx * CHOICES, (idx + 1) * CHOICES):
+                    self.choices[i] = 0
+            self._touched.clear()
+
+        names = ['qid', 'round', 'category', 'q_index'] + _COUNTER_COLUMNS + ['updated_at']
+        updates = ', '.join(f'{name} = {name} + excluded.{name}' for name in _COUNTER_COLUMNS)
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO question_stats ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+                    f" ON CONFLICT(qid) DO UPDATE SET q_index = excluded.q_index, round = excluded.round,"
+                    f" category = excluded.category, updated_at = excluded.updated_at, {updates}",
+                    rows,
+                )
+        finally:
+            conn.close()
+
+    def resize(self, size):
+        """問題数が変わった時 (問題集の読み直し) に呼ぶ。書き出していない増分は先に describe で書くこと"""
+        with self._lock:
+            self._reset(size)
+
+
+def hardest_questions(db_path, rounds=(), categories=(), sort='miss_rate', min_attempts=1, limit=50):
+    """集計テーブルから問題を並べて返す (既定: 正答率の低い順)"""
+    where = ['attempts >= ?']
+    params = [min_attempts]
+    if rounds:
+        where.append(f"round IN ({', '.join('?' * len(rounds))})")
+        params.extend(rounds)
+    if categories:
+        where.append(f"category IN ({', '.join('?' * len(categories))})")
+        params.extend(categories)
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10)
+    try:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(
+            f"SELECT * FROM question_stats WHERE {' AND '.join(where)}"
+            f" ORDER BY {SORT_KEYS.get(sort, SORT_KEYS['miss_rate'])} LIMIT ?",
+            params + [limit],
+        ).fetchall()
+    finally:
+        conn.close()
+
+    result = []
+    for row in rows:
+        choices = [row[name] for name in _CHOICE_COLUMNS]
+        result.append(dict(
+            qid=row['qid'], q_index=row['q_index'], round=row['round'], category=row['category'],
+            attempts=row['attempts'], correct=row['correct'],
+            correct_rate=row['correct'] / row['attempts'],
+            avg_elapsed=row['elapsed_sum'] / row['attempts'],
+            elapsed_hist=[row[name] for name in _HIST_COLUMNS],
+            choices=choices,
+        ))
+    return result
+
+
+def attempt_counts(db_path, since=None):
+    """問題 ID -> (回答数, 正解数)。アダプティブ出題の重み付け用
+
+    since (time.time() の値) を渡すと、それ以降に書き出された行だけを返す。
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10)
+    try:
+        if since is None:
+            rows = conn.execute("SELECT qid, attempts, correct FROM question_stats")
+        else:
+            rows = conn.execute("SELECT qid, attempts, correct FROM question_stats WHERE updated_at >= ?", (since,))
+        return {qid: (attempts, correct) for qid, attempts, correct in rows}
+    finally:
+        conn.close()
@@ -0,0 +1,159 @@
+"""レースモード (みんなで同じ列車に乗る)
+
+同じ部屋 (ルーム) のプレイヤーは同じ山札のシードで出発し、互いの現在地 (駅・次の駅・区間の進み具合・速度) を
+Server-Sent Events (SSE) で受け取る。
+
+- 位置の更新 (update) は部屋の表の自分の行を上書きして「変更あり」の印を付けるだけ (O(1))
+- 配信用のスレッドが tick 秒ごとに、変更のあった部屋だけ全員分の位置を1つの SSE メッセージ (bytes) にまとめ、
+  部屋の Condition で購読者を起こす。購読者は最新のメッセージをそのまま送るだけなので、
+  tick の間に何回更新があっても1回分にまとまり (合体)、購読者が何百人いてもエンコードは1回で済む
+- 購読者ごとにスレッドを立てない: gunicorn を gevent ワーカーで動かせば、
+  1つの接続は待機中のグリーンレット1つ (数 KB) になる
+- 部屋はプロセス内にだけある。レースモードを使う場合はワーカー1つ (gevent) で動かすこと
+  (gunicorn.conf.py では GUNICORN_RACES=1 で起動する。既定の複数ワーカーの構成ではレースを受け付けない)
+"""
+import json
+import os
+import secrets
+import threading
+import time
+
+_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'   # 読み間違えやすい文字 (I, O, 0, 1) は使わない
+
+
+class RaceRoom:
+    def __init__(self, code, seed, mode, round_mask=0, category_mask=0):
+        self.code = code
+        self.seed = seed
+        self.mode = mode
+        self.round_mask = round_mask
+        self.category_mask = category_mask
+        self.racers = {}              # 乗客番号 -> 位置 (dict)
+        self.next_racer = 1
+        self.version = 0              # 配信したメッセージの番号
+        self.frame = b''              # 最新の SSE メッセージ
+        self.dirty = False
+        self.closed = False
+        self.subscribers = 0
+        self.last_active = time.monotonic()
+        self.cond = threading.Condition()
+
+    def snapshot(self):
+        return dict(room=self.code, mode=self.mode, racers=list(self.racers.values()))
+
+
+class RaceBroadcaster:
+    """部屋の管理と、tick ごとの位置の一斉配信"""
+
+    def __init__(self, tick=0.25, heartbeat=15.0, max_rooms=1000, room_ttl=3600.0, max_racers=500):
+        self.tick = tick
+        self.heartbeat = heartbeat            # 更新がなくても、この秒数ごとにコメント行を送って接続を保つ
+        self.max_rooms = max_rooms
+        self.room_ttl = room_ttl              # 購読者がいなくなってからこの秒数たった部屋は片付ける
+        self.max_racers = max_racers
+        self.frames = 0                       # 作った SSE メッセージの数
+        self.updates = 0                      # 受け取った位置の更新の数
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    # --- 部屋 ---
+    def create_room(self, seed, mode, round_mask=0, category_mask=0):
+        with self._lock:
+            self._sweep()
+            if len(self._rooms) >= self.max_rooms:
+                return None
+            code = ''.join(secrets.choice(_CODE_ALPHABET) for _ in range(5))
+            while code in self._rooms:
+                code = ''.join(secrets.choice(_CODE_ALPHABET) for _ in range(5))
+            room = self._rooms[code] = RaceRoom(code, seed, mode, round_mask, category_mask)
+            return room
+
+    def room(self, code):
+        return self._rooms.get((code or '').upper())
+
+    def join(self, room, name):
+        """乗客として登録して乗客番号を返す。満員なら None"""
+        with room.cond:
+            if len(room.racers) >= self.max_racers:
+                return None
+            racer_id = room.next_racer
+            room.next_racer += 1
+            room.racers[racer_id] = dict(id=racer_id, name=name[:16] or f'乗客{racer_id}', station='', next_station='',
+                                         station_idx=0, progress=0.0, speed=0, score=0, finished=False)
+            room.dirty = True
+        self._ensure_thread()
+        return racer_id
+
+    def update(self, room, racer_id, **position):
+        """乗客の位置を書き換える (配信は次の tick でまとめて)"""
+        racer = room.racers.get(racer_id)
+        if racer is None:
+            return
+        racer.update(position)
+        room.dirty = True
+        room.last_active = time.monotonic()
+        self.updates += 1
+        self._ensure_thread()
+
+    # --- 配信 ---
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='race-broadcaster', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            for room in list(self._rooms.values()):
+                if room.dirty:
+                    self._publish(room)
+
+    def _publish(self, room):
+        with room.cond:
+            room.dirty = False
+            room.version += 1
+            data = json.dumps(dict(room.snapshot(), ts=time.time()), ensure_ascii=False, separators=(',', ':'))
+            room.frame = f'id: {room.version}\nevent: positions\ndata: {data}\n\n'.encode('utf-8')
+            self.frames += 1
+            room.cond.notify_all()
+
+    def stream(self, room, last_version=0):
+        """SSE の本文を返すジェネレーター。新しいメッセージが出るたびに (途中を飛ばして) 最新のものを送る"""
+        room.subscribers += 1
+        try:
+            yield b'retry: 3000\n\n'
+            if room.frame and room.version != last_version:
+                last_version = room.version
+                yield room.frame
+            while not room.closed:
+                with room.cond:
+                    if room.version == last_version:
+                        room.cond.wait(self.heartbeat)
+                    version, frame = room.version, room.frame
+                if version != last_version:
+                    last_version = version
+                    yield frame
+                else:
+                    yield b': keepalive\n\n'
+        finally:
+            room.subscribers -= 1
+            room.last_active = time.monotonic()
+
+    def _sweep(self):
+        now = time.monotonic()
+        for code, room in list(self._rooms.items()):
+            if not room.subscribers and now - room.last_active > self.room_ttl:
+                room.closed = True
+                del self._rooms[code]
+
+    def stats(self):
+        rooms = list(self._rooms.values())
+        return dict(rooms=len(rooms), racers=sum(len(room.racers) for room in rooms),
+                    subscribers=sum(room.subscribers for room in rooms), frames=self.frames, updates=self.updates)
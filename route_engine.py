@@ -0,0 +1,127 @@
+"""路線エンジン
+
+路線ごとの駅の並びと、その路線が分かれる分岐駅 (例: 上越新幹線は大宮、北陸新幹線は高崎) のデータから
+路線網を作り、始発駅からそれぞれの路線の終点まで乗り通す経路 (Route) ごとに、停車パターン
+(各駅停車 / 超特急) ごとの「次の停車駅」「ひとつ前の超特急停車駅」「その駅から乗る超特急の名前」を
+起動時に表にしておき、ゲーム中はどれも O(1) で引けるようにする。
+
+駅番号は路線網全体での通し番号 (路線データの並び順)。路線を後ろに足しても、今までの駅の番号は変わらない。
+"""
+
+
+class Route:
+    """始発駅から1本の路線の終点までの経路の停車駅表
+
+    表は路線網の駅番号で引く。経路にない駅の行は使わない (その駅で止まったことにする)。
+    """
+
+    def __init__(self, name, path, stations, line_of, express_of):
+        self.name = name
+        self.path = tuple(path)                  # 通る駅の番号 (始発駅から順に)
+        self.station_count = len(stations)       # 路線網全体の駅数 (表の長さ)
+        self.last_idx = self.path[-1]            # 終点
+        count = self.station_count
+        on_route = [False] * count
+        local_next = list(range(count))
+        express_next = list(range(count))
+        previous_express = list(range(count))
+        line = [None] * count
+        express = [None] * count
+
+        # 各駅停車: 経路上の隣の駅へ (終点はそのまま)
+        for here, there in zip(self.path, self.path[1:] + self.path[-1:]):
+            on_route[here] = True
+            local_next[here] = there
+            line[here], express[here] = line_of[here], express_of[here]
+
+        # 超特急: 後ろから走査して「自分より先で最初の停車駅 (なければ終点)」を埋める
+        upcoming = self.last_idx
+        for i in reversed(self.path):
+            express_next[i] = upcoming
+            if stations[i]['is_nozomi']:
+                upcoming = i
+
+        # 緊急停止: 前から走査して「自分を含めて手前で最後の停車駅 (なければ始発駅)」を埋める
+        previous = self.path[0]
+        for i in self.path:
+            if stations[i]['is_nozomi']:
+                previous = i
+            previous_express[i] = previous
+
+        self._on_route = tuple(on_route)
+        self._local_next = tuple(local_next)
+        self._express_next = tuple(express_next)
+        self._previous_express = tuple(previous_express)
+        self._line = tuple(line)
+        self._express = tuple(express)
+
+    def next_stop(self, station_idx, mode):
+        """mode で運転した場合の次の停車駅 (超特急以外は各駅停車扱い)"""
+        return (self._express_next if mode == 'nozomi' else self._local_next)[station_idx]
+
+    def previous_express_stop(self, station_idx):
+        """station_idx を含めて手前で最後の超特急停車駅 (なければ始発駅)"""
+        return self._previous_express[station_idx]
+
+    def is_terminal(self, station_idx):
+        """終点か (経路にない駅も、そこから先へは進めないので終点扱い)"""
+        return station_idx == self.last_idx or not self._on_route[station_idx]
+
+    def express_name(self, station_idx):
+        return self._express[station_idx]
+
+    def line_name(self, station_idx):
+        return self._line[station_idx]
+
+
+class RouteEngine:
+    """路線網 (路線ごとの駅の並びと分岐駅) と、路線ごとの経路の停車駅表"""
+
+    def __init__(self, lines):
+        """lines: [{"line", "express", "from" (最初の路線にはない), "stations": [{"name", "is_nozomi"}, ...]}, ...]
+
+        "stations" はその路線だけの駅 (分岐駅は含めない)。"from" は分岐駅の名前で、それより前に並べた
+        路線の駅でなければならない。分岐駅を出る列車と、その路線の駅を出る列車が "express" の名前になる
+        (例: 博多を出るのは「のぞみ」)。
+        """
+        self.stations = [station for line in lines for station in line['stations']]
+        self.index_of = {}
+        line_of, express_of, owner = [], [], {}
+        for line in lines:
+            for station in line['stations']:
+                if station['name'] in self.index_of:
+                    raise ValueError(f"駅 {station['name']} が2つの路線にあります")
+                self.index_of[station['name']] = len(line_of)
+                owner[station['name']] = line['line']
+                line_of.append(line['line'])
+                express_of.append(line['express'])
+
+        # 路線ごとに、始発駅からその路線の終点までの経路を作る (親の路線の経路を分岐駅で切って、自分の駅をつなぐ)
+        self.routes = {}
+        paths = {}
+        for k, line in enumerate(lines):
+            own = [self.index_of[station['name']] for station in line['stations']]
+            junction = line.get('from')
+            if junction is None:
+                if k:
+                    raise ValueError(f"路線 {line['line']} に分岐駅 (from) がありません")
+                path = own
+            else:
+                if owner.get(junction) not in paths:
+                    raise ValueError(f"路線 {line['line']} の分岐駅 {junction} は、それより前の路線の駅ではありません")
+                parent = paths[owner[junction]]
+                path = parent[:parent.index(self.index_of[junction]) + 1] + own
+            paths[line['line']] = path
+
+        # 分岐駅を出る列車は、分かれていく路線の列車 (経路ごとに違うので経路ごとに上書きする)
+        for line in lines:
+            path = paths[line['line']]
+            line_names, express_names = list(line_of), list(express_of)
+            for here, there in zip(path, path[1:]):
+                if line_of[there] != line_of[here]:
+                    line_names[here], express_names[here] = line_of[there], express_of[there]
+            self.routes[line['line']] = Route(line['line'], path, self.stations, line_names, express_names)
+
+    def route(self, line_name):
+        """始発駅から line_name の終点までの経路"""
+        return self.routes[line_name]
@@ -0,0 +1,162 @@
+"""サーバーサイド・セッションストア
+
+ブラウザには推測不能なセッションIDだけを Cookie で渡し、
+セッションの中身はサーバー側のバックエンドに保存する。
+
+- MemorySessionBackend: プロセス内 LRU + TTL (ワーカー1つで動かす場合向け)
+- SQLiteSessionBackend: SQLite ファイル (gunicorn の複数ワーカーで共有する場合向け)
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+from sqlite_conn import ProcessConnection
+
+
+class MemorySessionBackend:
+    """プロセス内の LRU キャッシュ。古い順 & 期限切れから追い出す"""
+
+    def __init__(self, max_entries=10000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # sid -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return payload
+
+    def set(self, sid, payload):
+        now = time.time()
+        with self._lock:
+            self._data[sid] = (now + self.ttl, payload)
+            self._data.move_to_end(sid)
+            # 先頭 (最も古い) から期限切れを掃除し、それでも溢れたら LRU で追い出す
+            while self._data:
+                oldest_sid, (expires_at, _) = next(iter(self._data.items()))
+                if expires_at >= now and len(self._data) <= self.max_entries:
+                    break
+                del self._data[oldest_sid]
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteSessionBackend:
+    """SQLite ファイルに保存する。同じファイルを指せば全ワーカーで共有できる"""
+
+    # 書き込み何回ごとに期限切れ行を掃除するか
+    PURGE_INTERVAL = 500
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self._db = ProcessConnection(path)
+        self._writes = 0
+        with self._db.use() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " sid TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+
+    def get(self, sid):
+        with self._db.use() as conn:
+            row = conn.execute(
+                "SELECT payload FROM sessions WHERE sid = ? AND expires_at >= ?", (sid, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, payload):
+        now = time.time()
+        with self._db.use() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (sid, payload, expires_at) VALUES (?, ?, ?)",
+                (sid, payload, now + self.ttl),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_INTERVAL == 0:
+                conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+
+    def delete(self, sid):
+        with self._db.use() as conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Cookie にはセッションIDだけを載せ、中身は backend に預ける"""
+
+    serializer = session_json_serializer
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            payload = self.backend.get(sid)
+            if payload is not None:
+                return ServerSideSession(self.serializer.loads(payload), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.backend.set(session.sid, self.serializer.dumps(dict(session)))
+        # IDは変わらないので、新規発行時だけ Cookie を送れば十分
+        if session.new or (session.permanent and self.should_set_cookie(app, session)):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def create_session_interface(kind, db_path=None, ttl=86400, max_entries=10000):
+    """設定値からセッションインターフェースを作る。'cookie' なら None (Flask標準のまま)"""
+    if kind == 'memory':
+        return ServerSideSessionInterface(MemorySessionBackend(max_entries=max_entries, ttl=ttl))
+    if kind == 'sqlite':
+        db_path = db_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.sqlite3')
+        return ServerSideSessionInterface(SQLiteSessionBackend(db_path, ttl=ttl))
+    if kind == 'cookie':
+        return None
+    raise ValueError(f"未知のセッションバックエンドです: {kind}")
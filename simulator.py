@@ -0,0 +1,216 @@
+"""旅のまとめてシミュレーション (NumPy)
+
+game_engine.py と同じ規則・同じ値で、合成したプレイヤーの旅を何百万回もまとめて進め、
+完走までの時間・名所を取れた割合・区間の長さ (再出題を含む回答数) を集計する。
+速度の規則 (SpeedModel) や区間の問題数を変えて、手で遊ばずに調整の当たりを付けるためのもの。
+
+- プレイヤーごとの正答率はベータ分布 (平均 accuracy, 集中度 concentration。0 なら全員同じ)、
+  1回の回答時間は対数正規分布 (中央値 time_median 秒, 広がり time_sigma) から引く。
+  正規乱数は遅いので、分布を 65536 等分した分位点の表を作り、16bit の一様乱数で表を引く
+  (加速量・旅の時間に数える秒数も表にしておく)
+- 問題ごとの難しさは区別しない。出題キューの順番は結果に効かないので、区間は
+  「まだ正解していない問題の数」だけで進める (正解で1つ減り、不正解なら再出題で減らない)
+- 1回の回答を1ステップとして、旅の途中のプレイヤー全員を配列でまとめて進める (ゴールした旅は配列から外す)
+- 名所は画面に出ている速度 (回答する前の速度) が landmark_speed を超えていれば取れたことにする
+- emergency_rate: 1回の回答ごとに緊急停止する確率 (手前の超特急停車駅まで戻る)
+
+NumPy が必要 (アプリ本体は使わないので requirements.txt には入れていない。bench/requirements.txt から入れる)。
+bench/simulate_journeys.py から使う。
+"""
+from statistics import NormalDist
+
+import numpy as np
+
+# 理由: 終点に着いた / 山札を引き切った / max_answers 回答えても終わらなかった
+FINISH_TERMINAL, FINISH_DECK, FINISH_CUTOFF = 0, 1, 2
+_QUANTILES = 1 << 16
+
+
+def _popcount(masks):
+    return np.unpackbits(masks.astype('<u8').view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class _Route:
+    """RouteEngine の表を配列にしたもの"""
+
+    def __init__(self, engine, mode):
+        route = engine.route
+        stations = range(route.station_count)
+        self.next_stop = np.array([route.next_stop(i, mode) for i in stations], dtype=np.int32)
+        self.previous_express = np.array([route.previous_express_stop(i) for i in stations], dtype=np.int32)
+        self.terminal = np.array([route.is_terminal(i) for i in stations], dtype=bool)
+        self.landmark_count = len(engine.landmark_stations)
+        dtype = next(t for t in (np.uint8, np.uint16, np.uint32, np.uint64) if np.iinfo(t).bits >= self.landmark_count)
+        self.landmark_bits = np.zeros(route.station_count, dtype=dtype)
+        for bit, station_idx in enumerate(sorted(engine.landmark_stations)):
+            self.landmark_bits[station_idx] = 1 << bit
+
+
+def _answer_tables(speed_model, max_counted, time_median, time_sigma):
+    """16bit の乱数 -> (正解した時の加速量, 旅の時間に数える秒数) の表"""
+    normal = NormalDist()
+    z = np.array([normal.inv_cdf((k + 0.5) / _QUANTILES) for k in range(_QUANTILES)])
+    elapsed = time_median * np.exp(time_sigma * z)
+    bonus = np.maximum(speed_model.min_bonus, speed_model.bonus_base - elapsed * speed_model.bonus_per_second)
+    return bonus.astype(np.float32), np.minimum(elapsed, max_counted).astype(np.float32)
+
+
+def simulate(engine, deck_size, journeys, mode='shinkansen', accuracy=0.75, concentration=20.0,
+             time_median=8.0, time_sigma=0.5, emergency_rate=0.0, max_answers=None, seed=0, chunk=1 << 17):
+    """journeys 回の旅を進めて、旅ごとの結果の配列 (dict) を返す
+
+    戻り値: play_time (旅の時間、秒), answered, score, accuracy (プレイヤーの正答率), landmarks (取れた名所の数),
+    landmarks_seen (通った名所の駅の数), stops (緊急停止の回数), finish (FINISH_*), legs (区間の数),
+    leg_answers (区間ごとの回答数のヒストグラム), landmark_count (路線の名所の数)
+    """
+    rng = np.random.default_rng(seed)
+    route = _Route(engine, mode)
+    leg_size = engine.leg_size(mode)
+    max_answers = max_answers or 50 * max(deck_size, 1)
+    tables = _answer_tables(engine.speed, engine.max_counted_elapsed, time_median, time_sigma)
+    parts = []
+    for start in range(0, journeys, chunk):
+        n = min(chunk, journeys - start)
+        if concentration > 0:
+            p = rng.beta(accuracy * concentration, (1 - accuracy) * concentration, n).astype(np.float32)
+        else:
+            p = np.full(n, accuracy, dtype=np.float32)
+        parts.append(_run(engine.speed, tables, route, leg_size, deck_size, p, rng, emergency_rate, max_answers))
+    result = {key: np.concatenate([part[key] for part in parts])
+              for key in parts[0] if key != 'leg_answers'}
+    hist = np.zeros(max(len(part['leg_answers']) for part in parts), dtype=np.int64)
+    for part in parts:
+        hist[:len(part['leg_answers'])] += part['leg_answers']
+    result['leg_answers'] = hist
+    result['landmark_count'] = route.landmark_count
+    return result
+
+
+def _run(speed_model, tables, route, leg_size, deck_size, p, rng, emergency_rate, max_answers):
+    bonus_table, time_table = tables
+    n = len(p)
+    first_leg = min(leg_size, deck_size)
+    # 旅の途中のプレイヤーの状態 (ゴールした旅は外していくので、元の番号を ids に持つ)
+    ids = np.arange(n)
+    station = np.zeros(n, dtype=np.int32)
+    next_station = np.full(n, route.next_stop[0], dtype=np.int32)
+    speed = np.full(n, speed_model.start_speed, dtype=np.float32)
+    queue = np.full(n, first_leg, dtype=np.int32)       # この区間でまだ正解していない問題の数
+    cursor = np.full(n, first_leg, dtype=np.int32)      # 山札から引いた枚数
+    leg_answers = np.zeros(n, dtype=np.int32)
+    answered = np.zeros(n, dtype=np.int32)
+    score = np.zeros(n, dtype=np.int32)
+    play_time = np.zeros(n, dtype=np.float32)
+    here = np.full(n, route.landmark_bits[0])          # 今の区間の駅の名所のビット (名所がなければ 0)
+    seen = here.copy()
+    collected = np.zeros(n, dtype=route.landmark_bits.dtype)
+    stops = np.zeros(n, dtype=np.int32)
+    legs = np.ones(n, dtype=np.int32)
+    state = [station, next_station, speed, queue, cursor, leg_answers, answered, score, play_time,
+             here, seen, collected, stops, legs, p]
+
+    out = dict(play_time=np.zeros(n), answered=np.zeros(n, dtype=np.int32), score=np.zeros(n, dtype=np.int32),
+               accuracy=p, landmarks=np.zeros(n, dtype=np.int64), landmarks_seen=np.zeros(n, dtype=np.int64),
+               stops=np.zeros(n, dtype=np.int32), finish=np.zeros(n, dtype=np.int8),
+               legs=np.zeros(n, dtype=np.int32))
+    hist = np.zeros(1, dtype=np.int64)
+
+    while ids.size:
+        m = ids.size
+        # 出題画面: 名所の駅でその時の速度が閾値を超えていれば取れる
+        collected |= here * (speed > speed_model.landmark_speed)
+
+        correct = rng.random(m, dtype=np.float32) < p
+        draw = rng.integers(0, _QUANTILES, m, dtype=np.uint16)
+        speed[:] = np.where(correct, np.minimum(speed_model.max_speed, speed + bonus_table[draw]),
+                            np.maximum(speed_model.min_speed, speed - speed_model.miss_penalty))
+        answered += 1
+        score += correct
+        play_time += time_table[draw]
+        queue -= correct
+        leg_answers += 1
+
+        if emergency_rate > 0:
+            stop = (rng.random(m) < emergency_rate) & (queue > 0)
+            next_station[stop] = route.previous_express[station[stop]]
+            queue[stop] = 0
+            stops += stop
+
+        arrived = np.flatnonzero(queue == 0)
+        cutoff = answered >= max_answers
+        if not arrived.size and not cutoff.any():
+            continue
+        if arrived.size:
+            counts = np.bincount(leg_answers[arrived])
+            if len(counts) > len(hist):
+                hist = np.concatenate([hist, np.zeros(len(counts) - len(hist), dtype=np.int64)])
+            hist[:len(counts)] += counts
+            # 駅に着いて、終点・山札切れでなければ次の区間へ出発する
+            station[arrived] = next_station[arrived]
+            left = deck_size - cursor[arrived]
+            done = route.terminal[station[arrived]] | (left == 0)
+            go = arrived[~done]
+            size = np.minimum(leg_size, left[~done])
+            next_station[go] = route.next_stop[station[go]]
+            cursor[go] += size
+            queue[go] = size
+            speed[go] = speed_model.depart_speed
+            leg_answers[go] = 0
+            legs[go] += 1
+            here[go] = route.landmark_bits[station[go]]
+            seen[go] |= here[go]
+            finish = np.full(m, -1, dtype=np.int8)
+            finish[arrived[done]] = np.where(route.terminal[station[arrived[done]]], FINISH_TERMINAL, FINISH_DECK)
+        else:
+            finish = np.full(m, -1, dtype=np.int8)
+        finish[cutoff & (finish < 0)] = FINISH_CUTOFF
+
+        ended = finish >= 0
+        if ended.any():
+            target = ids[ended]
+            out['play_time'][target] = play_time[ended]
+            out['answered'][target] = answered[ended]
+            out['score'][target] = score[ended]
+            out['landmarks'][target] = _popcount(collected[ended])
+            out['landmarks_seen'][target] = _popcount(seen[ended])
+            out['stops'][target] = stops[ended]
+            out['finish'][target] = finish[ended]
+            out['legs'][target] = legs[ended]
+            keep = ~ended
+            ids = ids[keep]
+            state = [array[keep] for array in state]
+            (station, next_station, speed, queue, cursor, leg_answers, answered, score, play_time,
+             here, seen, collected, stops, legs, p) = state
+
+    out['leg_answers'] = hist
+    return out
+
+
+def summarize(result, percentiles=(50, 90, 99)):
+    """simulate の結果を集計する (時間は分)"""
+    def spread(values):
+        return dict(mean=float(np.mean(values)), **{f'p{q}': float(np.percentile(values, q)) for q in percentiles})
+
+    hist = result['leg_answers']
+    legs = np.arange(len(hist))
+    total_legs = hist.sum()
+    cumulative = np.cumsum(hist) / max(total_legs, 1)
+    landmark_count = result['landmark_count']
+    journeys = len(result['answered'])
+    finished = result['finish'] != FINISH_CUTOFF
+    return dict(
+        journeys=journeys,
+        finish={name: float(np.mean(result['finish'] == code))
+                for name, code in (('terminal', FINISH_TERMINAL), ('deck', FINISH_DECK), ('cutoff', FINISH_CUTOFF))},
+        play_minutes=spread(result['play_time'][finished] / 60) if finished.any() else None,
+        answered=spread(result['answered']),
+        accuracy=float(result['score'].sum() / max(result['answered'].sum(), 1)),
+        landmarks=dict(mean=float(np.mean(result['landmarks'])), of=landmark_count,
+                       all=float(np.mean(result['landmarks'] == landmark_count)) if landmark_count else 0.0,
+                       rate_seen=float(result['landmarks'].sum() / max(result['landmarks_seen'].sum(), 1))),
+        legs=dict(per_journey=float(np.mean(result['legs'])),
+                  answers_mean=float((legs * hist).sum() / max(total_legs, 1)),
+                  **{f'answers_p{q}': int(np.searchsorted(cumulative, q / 100)) for q in percentiles},
+                  answers_max=int(legs[hist > 0].max()) if total_legs else 0),
+        stops=float(np.mean(result['stops'])),
+    )
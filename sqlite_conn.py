@@ -0,0 +1,51 @@
+"""ストア (セッション・プロフィール・ランキング・アダプティブ出題) が使う SQLite の接続
+
+接続はプロセスごとに1本だけ開き、リクエストを処理するスレッド (gevent のワーカーなら greenlet) で
+ロックを持って順番に使う。threading.local に置くと、gevent の monkey patch の後は greenlet ごと、
+つまりリクエストごとに接続を開き直し、PRAGMA も毎回やり直すことになるので使わない。
+
+- fork したプロセスでは開き直す (gunicorn --preload でマスターが開いた接続は使わない)
+- BEGIN 〜 COMMIT のトランザクションは transaction() で、ロックを持ったまま済ませる
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ProcessConnection:
+    """プロセスごとに1本の接続 (WAL, synchronous=NORMAL, 自動コミット)"""
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self.connects = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def use(self):
+        """with conn.use() as db: の間だけ接続を貸す (ほかのスレッド・greenlet は待つ)"""
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                self._conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                             check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._pid = os.getpid()
+                self.connects += 1
+            yield self._conn
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN 〜 COMMIT。途中で例外が出たら ROLLBACK して投げ直す"""
+        with self.use() as conn:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
@@ -0,0 +1,86 @@
+// 運転席: 速度計・車窓 (天気/トンネル/名所) のアニメーション
+const canvas = document.getElementById('speedometer');
+const ctx = canvas ? canvas.getContext('2d') : null;
+// ★ 画面ごとの値は body の data-* 属性で受け取る (このファイル自体は全画面共通でキャッシュされる)
+const cockpit = document.body.dataset;
+let currentSpeed = Number(cockpit.speed) || 0, targetSpeed = currentSpeed;
+const hasLandmark = cockpit.landmark === '1';
+const landmarkSpeed = Number(cockpit.landmarkSpeed) || 200; // game_engine.py の SpeedModel.landmark_speed
+const isTunnel = cockpit.tunnel === '1';
+let landmarkCollected = false;
+
+function drawSpeedometer() {
+    if (!ctx) return;
+    ctx.clearRect(0, 0, 200, 200);
+    const cx = 100, cy = 100, radius = 80;
+    ctx.beginPath(); ctx.arc(cx, cy, radius, 0.75 * Math.PI, 2.25 * Math.PI); ctx.lineWidth = 10; ctx.strokeStyle = '#1e293b'; ctx.stroke();
+    const maxSpeed = 350;
+    const speedAngle = (0.75 + (1.5 * (currentSpeed / maxSpeed))) * Math.PI;
+    ctx.beginPath(); ctx.moveTo(cx, cy); ctx.lineTo(cx + Math.cos(speedAngle)*(radius-10), cy + Math.sin(speedAngle)*(radius-10)); ctx.lineWidth = 4; ctx.strokeStyle = '#facc15'; ctx.stroke();
+    const display = document.getElementById('speedDisplay'); if(display) display.innerText = Math.round(currentSpeed);
+    updateEnvironment(currentSpeed);
+}
+
+function updateEnvironment(speed) {
+    const windowView = document.getElementById('windowView');
+    const rainEffect = document.getElementById('rainEffect');
+    const weatherIcon = document.getElementById('weatherIcon');
+    const landmarkLayer = document.getElementById('landmarkLayer');
+    const landmarkNotify = document.getElementById('landmarkGet');
+    const inputGotLandmark = document.getElementById('gotLandmarkInput');
+
+    // ★インジケーター制御
+    const p = document.getElementById('ind-p');
+    const n = document.getElementById('ind-n');
+    const b = document.getElementById('ind-b');
+
+    const reset = (el) => {
+        el.className = "w-3 h-3 rounded-full bg-slate-800 border border-slate-600 flex items-center justify-center text-[6px] text-slate-400 font-bold transition-colors";
+    };
+    const active = (el, colorClass, glowColor) => {
+        el.className = `w-3 h-3 rounded-full ${colorClass} border border-white/50 flex items-center justify-center text-[6px] text-black font-bold shadow-[0_0_8px_${glowColor}] transition-colors`;
+    };
+
+    if (p && n && b) {
+        reset(p); reset(n); reset(b);
+        if (Math.abs(targetSpeed - currentSpeed) < 1) {
+            active(n, "bg-green-500", "rgba(34,197,94,0.8)"); // Neutral
+        } else if (targetSpeed > currentSpeed) {
+            active(p, "bg-orange-500", "rgba(249,115,22,0.8)"); // Power
+        } else {
+            active(b, "bg-red-500", "rgba(239,68,68,0.8)"); // Brake
+        }
+    }
+
+    if (isTunnel) {
+        windowView.classList.add('weather-tunnel'); if(weatherIcon) weatherIcon.innerText = "🚇";
+    } else {
+        if (speed < 100) {
+            windowView.classList.add('weather-rainy'); rainEffect.style.opacity = 1; if(weatherIcon) weatherIcon.innerText = "☔️";
+            if(landmarkLayer) landmarkLayer.style.opacity = 0.2;
+        } else {
+            windowView.classList.remove('weather-rainy'); rainEffect.style.opacity = 0; if(weatherIcon) weatherIcon.innerText = "☀️";
+            if(landmarkLayer) landmarkLayer.style.opacity = 1;
+            if (hasLandmark && !landmarkCollected && speed > landmarkSpeed) {
+                landmarkCollected = true;
+                if(landmarkNotify) landmarkNotify.classList.remove('translate-x-full');
+                if(inputGotLandmark) inputGotLandmark.value = "1";
+                setTimeout(() => { if(landmarkNotify) landmarkNotify.classList.add('translate-x-full'); }, 3000);
+            }
+        }
+    }
+}
+
+function animate() {
+    if (Math.abs(targetSpeed - currentSpeed) > 1) currentSpeed += (targetSpeed - currentSpeed) * 0.1; else currentSpeed = targetSpeed;
+    drawSpeedometer(); requestAnimationFrame(animate);
+}
+setInterval(() => {
+     const mt = document.getElementById('layerMountains'), bd = document.getElementById('layerBuildings'), se = document.getElementById('speedEffect');
+     if(!mt) return;
+     if(currentSpeed < 5) { mt.style.animationPlayState = 'paused'; bd.style.animationPlayState = 'paused'; se.style.opacity = 0; }
+     else { mt.style.animationPlayState = 'running'; bd.style.animationPlayState = 'running'; se.style.opacity = Math.min((currentSpeed - 100) / 200, 0.5);
+         const factor = 300 / Math.max(currentSpeed, 10); bd.style.animationDuration = (0.5 * factor) + 's'; }
+}, 100);
+if (ctx) animate();
+function submitAnswer(btn) { document.getElementById('clientSpeedInput').value = Math.round(currentSpeed); btn.innerHTML = "TRANSMITTING..."; }
@@ -0,0 +1,16 @@
+// ★レースモード: 部屋を作る時は、/start のフォームで選んだ出題範囲の絞り込みも一緒に送る
+//   (レースのフォームは /start とは別なので、チェックボックスの値を hidden で写す)
+(function () {
+    const raceForm = document.getElementById('raceForm');
+    const startForm = document.getElementById('startForm');
+    if (!raceForm || !startForm) return;
+    raceForm.addEventListener('submit', (event) => {
+        raceForm.querySelectorAll('input[data-copied]').forEach((input) => input.remove());
+        if (!event.submitter || event.submitter.getAttribute('formaction') !== '/race') return;
+        startForm.querySelectorAll('input[name="round"]:checked, input[name="category"]:checked').forEach((box) => {
+            const hidden = document.createElement('input');
+            hidden.type = 'hidden'; hidden.name = box.name; hidden.value = box.value; hidden.dataset.copied = '1';
+            raceForm.appendChild(hidden);
+        });
+    });
+})();
@@ -0,0 +1,136 @@
+// 出題画面: APIモード (1往復で回答→次の問題) とオフライン区間モード
+// ★APIモード: 回答→判定→次の問題を1往復で取得し、ページを再読み込みせずに差し替える
+//   (fetch が使えない・失敗した場合は従来どおりフォーム送信で /answer → /next → /play)
+const OPTION_ENABLED = "w-full text-left px-3 py-3 rounded text-xs md:text-sm transition-all duration-100 group border flex-shrink-0 bg-slate-800/80 hover:bg-blue-600/50 border-slate-600 hover:border-blue-400 text-white active:bg-blue-700";
+const OPTION_DISABLED = "w-full text-left px-3 py-3 rounded text-xs md:text-sm transition-all duration-100 group border flex-shrink-0 bg-slate-900/50 border-slate-800 text-slate-700 cursor-not-allowed";
+const answerForm = document.getElementById('answerForm');
+
+function showVerdict(data) {
+    document.getElementById('verdictClear').classList.toggle('hidden', !data.correct);
+    document.getElementById('verdictWarning').classList.toggle('hidden', data.correct);
+    document.getElementById('verdictAnswer').textContent = data.correct_answer_text;
+    document.getElementById('verdictPanel').classList.remove('hidden');
+}
+
+function showQuestion(q) {
+    document.getElementById('questionId').textContent = q.id;
+    document.getElementById('questionText').textContent = q.question;
+    document.getElementById('answeredCount').textContent = q.total_answered;
+    document.getElementById('progressBar').style.width = q.progress + '%';
+    answerForm.querySelectorAll('button[name="choice"]').forEach((btn, i) => {
+        const disabled = q.disabled_indices.includes(i);
+        btn.disabled = disabled;
+        btn.className = disabled ? OPTION_DISABLED : OPTION_ENABLED;
+        btn.innerHTML = '<span class="option-label mr-2 pointer-events-none"></span><span class="option-text pointer-events-none"></span>';
+        const label = btn.querySelector('.option-label'), text = btn.querySelector('.option-text');
+        label.textContent = `[${i + 1}]`;
+        label.classList.add(...(disabled ? ['invisible'] : ['text-blue-400', 'group-hover:text-white']));
+        text.textContent = q.options[i];
+        if (disabled) text.classList.add('line-through', 'opacity-30');
+    });
+    document.getElementById('verdictPanel').classList.add('hidden');
+}
+
+// ★オフライン区間モード: 区間の残り問題を先読みして端末内で採点し、駅到着時にまとめて送信する
+//   送信前の結果は localStorage に残すので、トンネル内で再読み込みしても続きから遊べる
+const OFFLINE_MODE = answerForm.dataset.offline === '1';
+let offlineLeg = null;
+
+function gradeOffline(choice) {
+    const leg = offlineLeg, i = leg.queue[leg.pos];
+    const correct = (leg.bundle.answers[i] ^ leg.bundle.salts[i]) === choice;
+    if (!correct) leg.queue.push(i); // 不正解なら区間の末尾に再出題
+    leg.pos += 1;
+    return correct;
+}
+
+function showOfflineQuestion() {
+    const leg = offlineLeg, q = leg.bundle.questions[leg.queue[leg.pos]];
+    showQuestion({ ...q, progress: leg.pos / leg.queue.length * 100, total_answered: leg.bundle.total_answered + leg.results.length + 1 });
+    leg.shownAt = performance.now();
+}
+
+function answerOffline(choice) {
+    const leg = offlineLeg, q = leg.bundle.questions[leg.queue[leg.pos]];
+    const elapsed = (performance.now() - leg.shownAt) / 1000;
+    const correct = gradeOffline(choice);
+    leg.results.push({ id: q.id, choice, elapsed, got_landmark: landmarkCollected ? 1 : 0 });
+    localStorage.setItem(leg.storageKey, JSON.stringify(leg.results));
+    // 速度はサーバーと同じ式・同じ値 (game_engine.py の SpeedModel) で計算
+    const rule = leg.bundle.speed_rule;
+    leg.speed = correct ? Math.min(rule.max_speed, leg.speed + Math.max(rule.min_bonus, rule.bonus_base - elapsed * rule.bonus_per_second))
+                        : Math.max(rule.min_speed, leg.speed - rule.miss_penalty);
+    targetSpeed = leg.speed;
+    const answerIdx = leg.bundle.answers[leg.queue[leg.pos - 1]] ^ leg.bundle.salts[leg.queue[leg.pos - 1]];
+    showVerdict({ correct, correct_answer_text: q.options[answerIdx - 1] });
+    setTimeout(() => { if (leg.pos < leg.queue.length) showOfflineQuestion(); else syncLegResults(); }, 1500);
+}
+
+async function syncLegResults() {
+    const leg = offlineLeg;
+    document.getElementById('verdictNext').classList.add('hidden');
+    document.getElementById('syncStatus').classList.remove('hidden');
+    document.getElementById('verdictPanel').classList.remove('hidden');
+    let res;
+    try {
+        res = await fetch('/leg_result', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
+            body: JSON.stringify({ leg: leg.bundle.leg, start: leg.bundle.start, results: leg.results }),
+        });
+        if (res.status >= 500) throw new Error(res.status);
+    } catch (e) {
+        // 圏外 (トンネル内) なら少し待って再送
+        setTimeout(syncLegResults, 3000);
+        return;
+    }
+    // 反映済み・不整合 (4xx) の場合もサーバーの状態を正として画面を取り直す
+    localStorage.removeItem(leg.storageKey);
+    window.location.href = '/play';
+}
+
+async function loadLegBundle() {
+    try {
+        const res = await fetch('/leg_bundle', { headers: { 'Accept': 'application/json' } });
+        if (!res.ok) return;
+        const bundle = await res.json();
+        const storageKey = `shinkansen-leg-${bundle.leg}-${bundle.start}`;
+        offlineLeg = { bundle, storageKey, queue: bundle.questions.map((_, i) => i), pos: 0, results: [], speed: bundle.speed, shownAt: 0 };
+        // 送信前の結果が残っていれば、それを再生して続きから
+        for (const result of JSON.parse(localStorage.getItem(storageKey) || '[]')) {
+            if (offlineLeg.pos >= offlineLeg.queue.length || bundle.questions[offlineLeg.queue[offlineLeg.pos]].id !== result.id) break;
+            gradeOffline(result.choice);
+            offlineLeg.results.push(result);
+        }
+        if (offlineLeg.pos < offlineLeg.queue.length) showOfflineQuestion(); else syncLegResults();
+    } catch (e) {
+        offlineLeg = null; // 先読みできなければ通常の API モードで続行
+    }
+}
+if (OFFLINE_MODE && window.fetch && window.localStorage) loadLegBundle();
+
+answerForm.addEventListener('submit', async (event) => {
+    const btn = event.submitter;
+    if (!window.fetch || !btn) return;
+    event.preventDefault();
+    if (offlineLeg) { answerOffline(Number(btn.value)); return; }
+    const body = new FormData(answerForm);
+    body.append('choice', btn.value);
+    let data;
+    try {
+        const res = await fetch(answerForm.action, { method: 'POST', body, headers: { 'Accept': 'application/json' } });
+        if (!res.ok) throw new Error(res.status);
+        data = await res.json();
+    } catch (e) {
+        // 通信に失敗したら従来のフォーム送信へフォールバック
+        const hidden = document.createElement('input');
+        hidden.type = 'hidden'; hidden.name = 'choice'; hidden.value = btn.value;
+        answerForm.appendChild(hidden); answerForm.submit();
+        return;
+    }
+    if (data.speed !== undefined) { targetSpeed = data.speed; showVerdict(data); }
+    setTimeout(() => {
+        if (data.next && data.next.options.length === answerForm.querySelectorAll('button[name="choice"]').length) showQuestion(data.next);
+        else window.location.href = data.redirect || '/play';
+    }, 1500);
+});
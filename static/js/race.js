@@ -0,0 +1,35 @@
+// ★レースモード: 同じ部屋の乗客の現在地を SSE (EventSource) で受け取って並べる
+//   サーバーは一定間隔ごとに全員分をまとめて送るので、届いたら丸ごと描き直すだけでよい
+(function () {
+    const panel = document.getElementById('racePanel');
+    if (!panel || !window.EventSource) return;
+    const me = Number(panel.dataset.racer);
+    const list = document.getElementById('raceRacers');
+
+    function render(racers) {
+        // 先を走っている順 (駅 → 区間の進み具合)
+        racers.sort((a, b) => (b.finished - a.finished) || (b.station_idx - a.station_idx) || (b.progress - a.progress));
+        list.replaceChildren(...racers.map((r) => {
+            const li = document.createElement('li');
+            li.className = 'flex items-center gap-2' + (r.id === me ? ' text-yellow-300 font-bold' : '');
+            const name = document.createElement('span');
+            name.className = 'w-16 truncate';
+            name.textContent = r.name;
+            const track = document.createElement('span');
+            track.className = 'flex-grow h-1 bg-slate-700 rounded overflow-hidden';
+            const bar = document.createElement('span');
+            bar.className = 'block h-full bg-cyan-400';
+            bar.style.width = (r.finished ? 100 : r.progress * 100) + '%';
+            track.appendChild(bar);
+            const where = document.createElement('span');
+            where.className = 'w-28 truncate text-right';
+            where.textContent = r.finished ? `ゴール (${r.score}問正解)` : `${r.station}→${r.next_station} ${r.speed}km/h`;
+            li.append(name, track, where);
+            return li;
+        }));
+    }
+
+    const source = new EventSource(`/race/${panel.dataset.room}/events`);
+    source.addEventListener('positions', (e) => render(JSON.parse(e.data).racers));
+    window.addEventListener('pagehide', () => source.close());
+})();